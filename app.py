@@ -1,20 +1,18 @@
 import os
 import logging
-from flask import Flask, render_template
+import threading
+from flask import Flask, current_app, render_template
+from werkzeug.exceptions import HTTPException
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from flask_wtf.csrf import CSRFProtect
 from flask_login import LoginManager
 from dotenv import load_dotenv
+from replica import RoutingSession, REPLICA_BIND, replica_url, init_replica
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Debug: Print environment variables (remove in production)
-print(f"GOOGLE_CLIENT_ID loaded: {'Yes' if os.environ.get('GOOGLE_CLIENT_ID') else 'No'}")
-print(f"GOOGLE_CLIENT_SECRET loaded: {'Yes' if os.environ.get('GOOGLE_CLIENT_SECRET') else 'No'}")
-print(f"SESSION_SECRET loaded: {'Yes' if os.environ.get('SESSION_SECRET') else 'No'}")
-
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
@@ -23,169 +21,185 @@ class Base(DeclarativeBase):
     pass
 
 # Initialize extensions
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 csrf = CSRFProtect()
 login_manager = LoginManager()
 
-# Create the Flask application
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
-
-# Configure session settings for better persistence
-app.config['SESSION_COOKIE_SECURE'] = False  # Set to True in production with HTTPS
-app.config['SESSION_COOKIE_HTTPONLY'] = True
-app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
-app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour
-
-# Email configuration
-app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
-app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
-app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', 'drrichaeyeclinic@gmail.com')
-app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', 'onlg iqtn eizf vehv')
-app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'True').lower() == 'true'
-app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'drrichaeyeclinic@gmail.com')
-
-# Google OAuth configuration
-app.config['GOOGLE_CLIENT_ID'] = os.environ.get('GOOGLE_CLIENT_ID')
-app.config['GOOGLE_CLIENT_SECRET'] = os.environ.get('GOOGLE_CLIENT_SECRET')  
-
-
-# Configure the database - PostgreSQL
-database_url = os.environ.get('DATABASE_URL')
-if database_url and database_url.startswith('postgres://'):
-    # Fix for newer SQLAlchemy versions
-    database_url = database_url.replace('postgres://', 'postgresql://', 1)
-
-app.config["SQLALCHEMY_DATABASE_URI"] = database_url or "postgresql://localhost/drricha_dev"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-# Initialize extensions with app
-db.init_app(app)
-csrf.init_app(app)
-login_manager.init_app(app)
-login_manager.login_view = 'patient_login'
-
-# User loader function for Flask-Login
-@login_manager.user_loader
+# Background jobs start on a worker's first request instead of at import
+BACKGROUND_JOBS = os.environ.get('BACKGROUND_JOBS', 'True').lower() == 'true'
+_jobs_started = False
+_jobs_lock = threading.Lock()
+
+
+def create_app():
+    """Create and configure the Flask application
+
+    Only settings and extensions are set up here. Schema work and default
+    accounts are done once per deploy by bootstrap.py, and background jobs
+    are started by the worker's first request, so importing the app stays
+    cheap for every gunicorn worker.
+    """
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
+
+    # Configure session settings for better persistence
+    app.config['SESSION_COOKIE_SECURE'] = False  # Set to True in production with HTTPS
+    app.config['SESSION_COOKIE_HTTPONLY'] = True
+    app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+    app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour
+
+    # Email configuration
+    app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+    app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+    # SMTP_EMAIL/SMTP_PASSWORD are what the reminder service used to read
+    app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', os.environ.get('SMTP_EMAIL', 'drrichaeyeclinic@gmail.com'))
+    app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', os.environ.get('SMTP_PASSWORD', 'onlg iqtn eizf vehv'))
+    app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'True').lower() == 'true'
+    app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'drrichaeyeclinic@gmail.com')
+
+    # Google OAuth configuration
+    app.config['GOOGLE_CLIENT_ID'] = os.environ.get('GOOGLE_CLIENT_ID')
+    app.config['GOOGLE_CLIENT_SECRET'] = os.environ.get('GOOGLE_CLIENT_SECRET')
+
+    # Configure the database - PostgreSQL
+    database_url = os.environ.get('DATABASE_URL')
+    if database_url and database_url.startswith('postgres://'):
+        # Fix for newer SQLAlchemy versions
+        database_url = database_url.replace('postgres://', 'postgresql://', 1)
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url or "postgresql://localhost/drricha_dev"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    # Connection pool sizing, health checks and PgBouncer mode from the environment
+    from db_pool import engine_options
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
+
+    # Optional read replica for reporting views (see replica.py)
+    if replica_url():
+        app.config["SQLALCHEMY_BINDS"] = {
+            REPLICA_BIND: {'url': replica_url(), **engine_options(replica_url(), bind=REPLICA_BIND)}
+        }
+
+    # Initialize extensions with app
+    db.init_app(app)
+    csrf.init_app(app)
+    login_manager.init_app(app)
+    init_replica(app, db)
+    login_manager.login_view = 'patient_login'
+    login_manager.user_loader(load_user)
+
+    register_error_handlers(app)
+
+    if BACKGROUND_JOBS:
+        app.before_request(start_background_jobs)
+
+    @app.cli.command('bootstrap')
+    def bootstrap_command():
+        """Create tables, apply schema upgrades and add the default accounts"""
+        from bootstrap import bootstrap, report_environment
+        report_environment()
+        bootstrap()
+
+    return app
+
+
+# User loader function for Flask-Login, served from a short-lived cache (see user_cache.py)
 def load_user(user_id):
-    from models import Doctor, Assistant, Admin, Patient
-    try:
-        if user_id.startswith('doctor_'):
-            return Doctor.query.get(int(user_id.split('_')[1]))
-        elif user_id.startswith('assistant_'):
-            return Assistant.query.get(int(user_id.split('_')[1]))
-        elif user_id.startswith('admin_'):
-            return Admin.query.get(int(user_id.split('_')[1]))
-        else:
-            return Patient.query.get(int(user_id))
-    except (ValueError, AttributeError):
-        return None
+    from user_cache import load_cached_user
+    return load_cached_user(user_id)
 
-# Import routes after app is created
-from routes import *
 
-# Initialize database function
-def init_database():
-    """Initialize database tables and default accounts"""
+def start_background_jobs():
+    """Start the reminder service, OTP purge job, email outbox worker and payment reconciliation once per process"""
+    global _jobs_started
+    if _jobs_started:
+        return
+    with _jobs_lock:
+        if _jobs_started:
+            return
+        _jobs_started = True
+
+    # Start the reminder service
     try:
-        # Import here to avoid circular imports
-        from models import Doctor, Assistant
-        from datetime import date
-        
-        # Create all tables first
-        db.create_all()
-        print('Database tables initialized')
-
-        # Check if we need to create default accounts
-        try:
-            # Create default doctor account if it doesn't exist
-            doctor = Doctor.query.filter_by(username='drricha').first()
-            if not doctor:
-                doctor = Doctor(
-                    username='drricha',
-                    email='drricha@eyeclinic.com',
-                    full_name='Dr. Richa Sharma',
-                    mobile_number='9876543210',
-                    qualifications='MBBS, MS, FPOS',
-                    specialization='Ophthalmology, Pediatric Eye Care'
-                )
-                doctor.set_password('admin123')
-                db.session.add(doctor)
-                print('Default doctor account created')
-
-            # Create optometrist account if it doesn't exist
-            assistant = Assistant.query.filter_by(username='assistant').first()
-            if not assistant:
-                assistant = Assistant(
-                    username='assistant',
-                    email='assistant@eyeclinic.com',
-                    full_name='Clinic Optometrist',
-                    mobile_number='9876543211',
-                    position='Optometrist',
-                    joining_date=date.today()
-                )
-                assistant.set_password('assistant123')
-                db.session.add(assistant)
-                print('Default optometrist account created')
-
-            # Commit changes
-            db.session.commit()
-            print('Database initialization completed successfully')
-            
-        except Exception as query_error:
-            # If there's an issue with queries, just create tables and continue
-            print(f'Note: {str(query_error)}')
-            print('Tables created successfully. You may need to run init_db.py separately.')
-        
+        from reminder_system import start_reminder_service
+        start_reminder_service(current_app._get_current_object())
+        print("Appointment reminder service initialized")
     except Exception as e:
-        db.session.rollback()
-        print(f'Error initializing database: {str(e)}')
-        # Don't raise the error, just print it and continue
-        print('Continuing without default accounts...')
-
-# Initialize database when app starts
-with app.app_context():
-    init_database()
-
-# Start the reminder service
-try:
-    from reminder_system import start_reminder_service
-    start_reminder_service()
-    print("Appointment reminder service initialized")
-except Exception as e:
-    print(f"Could not start reminder service: {str(e)}")
-
-# Register error handlers
-@app.errorhandler(400)
-def bad_request(e):
-    return render_template('400.html'), 400
-
-@app.errorhandler(404)
-def page_not_found(e):
-    return render_template('404.html'), 404
-
-@app.errorhandler(500)
-def internal_server_error(e):
-    # Log the error for debugging
-    print(f"Internal server error: {str(e)}")
+        print(f"Could not start reminder service: {str(e)}")
+
+    # Start the job that deletes used and expired OTP codes
     try:
-        # Try to rollback any pending database transactions
-        db.session.rollback()
-    except:
-        pass
-    return render_template('500.html'), 500
-
-@app.errorhandler(Exception)
-def handle_exception(e):
-    # Log any unhandled exceptions
-    print(f"Unhandled exception: {str(e)}")
+        from otp_store import start_otp_purge
+        start_otp_purge(current_app._get_current_object())
+    except Exception as e:
+        print(f"Could not start OTP purge job: {str(e)}")
+
+    # Start delivering queued email
+    try:
+        from outbox import start_outbox_worker
+        start_outbox_worker(current_app._get_current_object())
+    except Exception as e:
+        print(f"Could not start email outbox worker: {str(e)}")
+
+    # Keep payment statuses in line with their appointments
     try:
-        db.session.rollback()
-    except:
-        pass
-    # Return 500 error page for any unhandled exceptions
-    return render_template('500.html'), 500
+        from reconciliation import start_payment_reconciliation
+        start_payment_reconciliation(current_app._get_current_object())
+    except Exception as e:
+        print(f"Could not start payment reconciliation: {str(e)}")
+
+
+def register_error_handlers(app):
+    """Render the error pages and roll back failed transactions"""
+
+    @app.errorhandler(400)
+    def bad_request(e):
+        return render_template('400.html'), 400
+
+    @app.errorhandler(404)
+    def page_not_found(e):
+        return render_template('404.html'), 404
+
+    @app.errorhandler(500)
+    def internal_server_error(e):
+        # Log the error for debugging
+        print(f"Internal server error: {str(e)}")
+        try:
+            # Try to rollback any pending database transactions
+            db.session.rollback()
+        except:
+            pass
+        return render_template('500.html'), 500
+
+    @app.errorhandler(Exception)
+    def handle_exception(e):
+        # HTTP errors such as 405 keep their own status and response
+        if isinstance(e, HTTPException):
+            return e
+        # Log any unhandled exceptions
+        print(f"Unhandled exception: {str(e)}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        # Return 500 error page for any unhandled exceptions
+        return render_template('500.html'), 500
+
+
+# The application gunicorn serves (app:app); routes register on it
+app = create_app()
+
+# Import routes after app is created
+import routes  # noqa: E402,F401
 
 if __name__ == '__main__':
+    # Running this file makes it __main__; serve the copy routes registered on
+    from app import app as application
+    from bootstrap import bootstrap, report_environment
+
+    report_environment()
+    with application.app_context():
+        bootstrap()
+
     port = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
+    application.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Email render throughput, cached templates vs per-message loading
+
+Renders the appointment reminder (plain and HTML variants) and builds the
+MIME message N times in two ways:
+
+  per-message  a fresh Jinja environment for every message, so each one
+               reads and compiles the templates and reads and base64-encodes
+               the logo, the way the reminder service used to treat its
+               f-string and image
+  cached       notifications.py as the application uses it: templates
+               compiled once, logo encoded once
+
+Nothing is sent. Use --logo to measure with a larger image than the one in
+static/img.
+
+    python benchmark_email_render.py --messages 10000
+"""
+
+import argparse
+import sys
+import time
+from datetime import date, time as clock_time, timedelta
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+import notifications
+from mail_transport import build_message
+
+SENDER = 'benchmark@eyeclinic.local'
+
+
+def contexts(count):
+    appointment_date = date.today() + timedelta(days=1)
+    for number in range(count):
+        yield {
+            'patient_name': f'Patient {number}',
+            'appointment_date': appointment_date,
+            'appointment_time': clock_time(17, 30),
+            'when': 'tomorrow',
+        }
+
+
+def build(render, images, context):
+    subject, text, html = render('reminder', **context)
+    return build_message(f"{context['patient_name'].replace(' ', '')}@example.com", subject, text,
+                         sender=SENDER, html=html, images=images(html))
+
+
+def fresh_environment_render(template_name, **context):
+    """What a render costs when nothing is kept between messages"""
+    env = Environment(loader=FileSystemLoader(notifications.TEMPLATE_DIR),
+                      autoescape=select_autoescape(['html']), trim_blocks=True, keep_trailing_newline=True)
+    env.globals.update(notifications.CLINIC)
+    module = env.get_template(f'{template_name}.txt').make_module(context)
+    html = env.get_template(f'{template_name}.html').render(dict(context, logo_cid='clinic_logo'))
+    return str(module.subject), str(module), html
+
+
+def uncached_images(html):
+    notifications._assets.clear()
+    return notifications.inline_images(html)
+
+
+def run(label, render, images, count, serialize):
+    start = time.perf_counter()
+    total_bytes = 0
+    for context in contexts(count):
+        msg = build(render, images, context)
+        if serialize:
+            total_bytes += len(msg.as_bytes())
+    elapsed = time.perf_counter() - start
+    return label, elapsed, total_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure reminder email rendering with and without template/asset caching')
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--logo', help='image to embed instead of static/img/clinic_logo.jpg')
+    parser.add_argument('--serialize', action='store_true', help='also serialize each message to bytes')
+    args = parser.parse_args()
+
+    if args.logo:
+        notifications.INLINE_ASSETS['clinic_logo'] = args.logo
+        notifications.STATIC_DIR = ''
+
+    runs = [
+        run('per-message', fresh_environment_render, uncached_images, args.messages, args.serialize),
+        run('cached', notifications.render, notifications.inline_images, args.messages, args.serialize),
+    ]
+
+    print(f"{'mode':<14} {'seconds':>9} {'messages/s':>12} {'us/message':>12}")
+    for label, elapsed, total_bytes in runs:
+        print(f"{label:<14} {elapsed:>9.3f} {args.messages / elapsed:>12.0f} {1e6 * elapsed / args.messages:>12.1f}")
+    if args.serialize:
+        print(f"message size: {runs[1][2] / args.messages:.0f} bytes")
+    print(f"speedup: {runs[0][1] / runs[1][1]:.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
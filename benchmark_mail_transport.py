@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+SMTP throughput, per-message connections vs the shared pool
+
+Sends the same batch of messages twice to an SMTP server: once opening a
+new connection (and STARTTLS/login, when configured) for every message, the
+way the reminder service used to, and once through mail_transport's pooled
+batch send. Reports messages per second for each.
+
+Point it at a local stand-in rather than a real mailbox:
+
+    python -m aiosmtpd -n -l localhost:1025
+    python benchmark_mail_transport.py --host localhost --port 1025 --messages 200
+"""
+
+import argparse
+import smtplib
+import sys
+import time
+
+from mail_transport import MailSettings, SMTPPool, SMTP_TIMEOUT, build_message
+
+SENDER = 'benchmark@eyeclinic.local'
+
+
+def build_batch(count):
+    return [
+        build_message(f'patient{number}@example.com', f'Benchmark reminder {number}',
+                      '<p>Your appointment is tomorrow.</p>', 'html', sender=SENDER)
+        for number in range(count)
+    ]
+
+
+def send_one_connection_each(settings, messages):
+    """Connect, optionally STARTTLS and log in, send and quit for every message"""
+    for msg in messages:
+        with smtplib.SMTP(settings.server, settings.port, timeout=SMTP_TIMEOUT) as server:
+            if settings.use_tls:
+                server.starttls()
+            if settings.password:
+                server.login(settings.username, settings.password)
+            server.send_message(msg)
+
+
+def send_pooled(settings, messages):
+    """Send the whole batch through a fresh pool"""
+    pool = SMTPPool(settings)
+    try:
+        errors = pool.send_batch(messages)
+    finally:
+        pool.close()
+    failed = [error for error in errors if error is not None]
+    if failed:
+        raise RuntimeError(f'{len(failed)} pooled sends failed, first: {failed[0]}')
+    return pool.snapshot()
+
+
+def timed(label, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    return label, elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-message SMTP connections with the pooled transport')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1025)
+    parser.add_argument('--username', default='')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--tls', action='store_true', help='use STARTTLS on every connection')
+    parser.add_argument('--messages', type=int, default=200)
+    args = parser.parse_args()
+
+    settings = MailSettings(args.host, args.port, args.username, args.password, args.tls)
+    messages = build_batch(args.messages)
+
+    runs = [
+        timed('per-message connection', send_one_connection_each, settings, messages),
+        timed('pooled batch', send_pooled, settings, messages),
+    ]
+
+    print(f"{'mode':<24} {'seconds':>9} {'messages/s':>12}")
+    for label, elapsed, _ in runs:
+        print(f"{label:<24} {elapsed:>9.3f} {args.messages / elapsed:>12.1f}")
+
+    stats = runs[1][2]
+    print(f"pool: {stats['connects']} connects, {stats['reconnects']} reconnects, {stats['sent']} sent")
+    print(f"speedup: {runs[0][1] / runs[1][1]:.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
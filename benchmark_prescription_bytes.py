@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Bytes fetched per page for prescription and medical record views
+
+Creates a patient with a number of doctor prescriptions and a medical
+record full of narrative text, renders the pages that show them and reports
+the queries issued and the bytes of row data they return, once with the
+deferred column groups declared in models.py and once with every column
+loaded eagerly (the behaviour before the groups were introduced). Bytes are
+measured by re-running each captured SELECT and summing the size of the
+values it returns.
+
+Runs against DATABASE_URL and removes everything it creates.
+
+    python benchmark_prescription_bytes.py --prescriptions 20
+"""
+
+import argparse
+import sys
+from datetime import datetime, time, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import defaultload, undefer
+from app import app, db
+from models import Patient, Appointment, MedicalRecord, DoctorPrescription, Doctor
+
+NARRATIVE = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 20
+
+# Mappers whose deferred groups are disabled in the eager run
+DEFERRED_MODELS = (DoctorPrescription, MedicalRecord)
+
+
+def deferred_columns(model):
+    """The model's column attributes that are deferred by default"""
+    return [getattr(model, prop.key) for prop in model.__mapper__.column_attrs if prop.deferred]
+
+
+def create_fixture(count):
+    """A patient with `count` doctor prescriptions and one appointment with a medical record"""
+    doctor = Doctor.query.first()
+    patient = Patient(full_name='Prescription Benchmark', mobile_number='0000000000', age=1, is_registered=False)
+    db.session.add(patient)
+    db.session.flush()
+
+    appointment = Appointment(
+        patient_id=patient.id,
+        appointment_date=datetime.now().date() + timedelta(days=3650),
+        appointment_time=time(17, 0),
+        status='completed'
+    )
+    appointment.allow_overbooking = True
+    db.session.add(appointment)
+    db.session.flush()
+
+    for i in range(count):
+        prescription = DoctorPrescription(patient_id=patient.id, doctor_id=doctor.id, diagnosis=f'Diagnosis {i}')
+        for column in deferred_columns(DoctorPrescription):
+            setattr(prescription, column.key, NARRATIVE[:200] if column.key == 'referred_to_cc' else NARRATIVE)
+        db.session.add(prescription)
+
+    record = MedicalRecord(appointment_id=appointment.id, diagnosis='Diagnosis')
+    for column in deferred_columns(MedicalRecord):
+        setattr(record, column.key, NARRATIVE)
+    db.session.add(record)
+    db.session.commit()
+    return doctor.id, patient.id, appointment.id, prescription.id
+
+
+def remove_fixture(patient_id, appointment_id):
+    MedicalRecord.query.filter_by(appointment_id=appointment_id).delete()
+    DoctorPrescription.query.filter_by(patient_id=patient_id).delete()
+    db.session.delete(db.session.get(Appointment, appointment_id))
+    db.session.delete(db.session.get(Patient, patient_id))
+    db.session.commit()
+
+
+class Capture:
+    """Records the SELECT statements issued while rendering a page"""
+
+    def __init__(self):
+        self.statements = []
+        self.eager = False
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            self.statements.append((statement, parameters))
+
+    def do_orm_execute(self, state):
+        if not (self.eager and state.is_select):
+            return
+        options = []
+        for mapper in state.all_mappers:
+            if mapper.class_ in DEFERRED_MODELS:
+                # Lazy loads only honour the wildcard; queries that already
+                # undefer a group need the columns named one by one
+                options.append(undefer('*'))
+                options.extend(undefer(column) for column in deferred_columns(mapper.class_))
+            # Selectin loads take their column options from the parent query
+            for relationship in mapper.relationships:
+                target = relationship.mapper.class_
+                if target in DEFERRED_MODELS:
+                    options.extend(
+                        defaultload(relationship.class_attribute).undefer(column)
+                        for column in deferred_columns(target)
+                    )
+        if options:
+            state.statement = state.statement.options(*options)
+
+
+def row_bytes(statements):
+    """Total size of the values returned by the captured statements"""
+    total = 0
+    with db.engine.connect() as conn:
+        for statement, parameters in statements:
+            for row in conn.exec_driver_sql(statement, parameters):
+                for value in row:
+                    if value is None:
+                        continue
+                    total += len(value) if isinstance(value, bytes) else len(str(value).encode('utf-8'))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure bytes fetched by prescription pages')
+    parser.add_argument('--prescriptions', type=int, default=20, help='doctor prescriptions on the patient')
+    args = parser.parse_args()
+
+    capture = Capture()
+    with app.app_context():
+        doctor_id, patient_id, appointment_id, prescription_id = create_fixture(args.prescriptions)
+        engine = db.engine
+
+    pages = {
+        'admin_patient_view': f'/admin/patient/{patient_id}',
+        'admin_appointment_view': f'/admin/appointment/{appointment_id}',
+        'print_combined_prescription': f'/print-combined-prescription/{patient_id}',
+        'print_prescription (doctor)': f'/print-prescription/doctor/{prescription_id}',
+    }
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = f'doctor_{doctor_id}'
+        session['_fresh'] = True
+
+    captured = {}
+    event.listen(engine, 'before_cursor_execute', capture.before_cursor_execute)
+    event.listen(db.session, 'do_orm_execute', capture.do_orm_execute)
+    try:
+        for mode in ('eager', 'deferred'):
+            capture.eager = mode == 'eager'
+            for name, url in pages.items():
+                capture.statements = []
+                response = client.get(url)
+                if response.status_code != 200:
+                    print(f'{name}: HTTP {response.status_code}')
+                    continue
+                captured[(name, mode)] = capture.statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture.before_cursor_execute)
+        event.remove(db.session, 'do_orm_execute', capture.do_orm_execute)
+
+    # Re-run the statements once capture is off so they are not recorded themselves
+    with app.app_context():
+        results = {key: (len(statements), row_bytes(statements)) for key, statements in captured.items()}
+        remove_fixture(patient_id, appointment_id)
+
+    print(f'{args.prescriptions} doctor prescriptions, {len(NARRATIVE)} characters per narrative field\n')
+    print(f"{'page':<30} {'eager':>18} {'deferred':>18}")
+    for name in pages:
+        if (name, 'eager') not in results or (name, 'deferred') not in results:
+            continue
+        eager_queries, eager_bytes = results[(name, 'eager')]
+        deferred_queries, deferred_bytes = results[(name, 'deferred')]
+        print(f"{name:<30} {eager_bytes:>9,} B {eager_queries:>2} q {deferred_bytes:>9,} B {deferred_queries:>2} q")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Worker startup time
+
+Starts fresh Python processes the way gunicorn boots workers and reports,
+for each one, how long `import app` takes and how long the first request
+takes after that (the first request also starts the background jobs). Run
+bootstrap.py first so the database is ready.
+
+Runs against DATABASE_URL; requests are anonymous GETs.
+
+    python benchmark_startup.py --workers 4 --path /
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Printed by each worker in front of its timings
+MARKER = 'STARTUP_TIMINGS '
+
+WORKER = '''
+import json, sys, time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+status = app.test_client().get(sys.argv[1]).status_code
+served = time.perf_counter()
+print({marker!r} + json.dumps({{
+    'import_ms': 1000 * (imported - start),
+    'first_request_ms': 1000 * (served - imported),
+    'status': status,
+}}), flush=True)
+'''.format(marker=MARKER)
+
+
+def boot_worker(path):
+    """Timings from one freshly started worker process"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', WORKER, path],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    wall_ms = 1000 * (time.perf_counter() - started)
+
+    for line in result.stdout.splitlines():
+        if line.startswith(MARKER):
+            timings = json.loads(line[len(MARKER):])
+            timings['process_ms'] = wall_ms
+            return timings
+
+    print(result.stdout[-2000:])
+    print(result.stderr[-2000:])
+    raise RuntimeError(f'Worker exited with status {result.returncode} without reporting timings')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure worker import time and time to first request')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes to start one after another')
+    parser.add_argument('--path', default='/', help='URL of the first request')
+    args = parser.parse_args()
+
+    results = [boot_worker(args.path) for _ in range(args.workers)]
+
+    print(f"{'worker':<8} {'import':>10} {'first request':>15} {'process':>10}  status")
+    for number, timings in enumerate(results, 1):
+        print(f"{number:<8} {timings['import_ms']:>7.0f} ms {timings['first_request_ms']:>12.0f} ms "
+              f"{timings['process_ms']:>7.0f} ms  {timings['status']}")
+
+    print(f"{'median':<8} {statistics.median(r['import_ms'] for r in results):>7.0f} ms "
+          f"{statistics.median(r['first_request_ms'] for r in results):>12.0f} ms "
+          f"{statistics.median(r['process_ms'] for r in results):>7.0f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
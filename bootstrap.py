@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+One-shot database bootstrap
+
+Creates missing tables, brings existing ones up to date (columns, indexes,
+refraction migration, search structures, counters, daily revenue, payroll
+summaries) and adds the default doctor and optometrist accounts. Everything
+here is idempotent.
+
+This used to run on every import of app.py, so each gunicorn worker repeated
+it on boot. Run it once per deploy before starting the workers:
+
+    python bootstrap.py
+    flask --app app bootstrap
+
+`python app.py` runs it automatically for local development. Unlike
+init_db.py, it never drops tables.
+"""
+
+import os
+import sys
+from datetime import date
+
+
+def report_environment():
+    """Print which optional settings were found in the environment"""
+    print(f"GOOGLE_CLIENT_ID loaded: {'Yes' if os.environ.get('GOOGLE_CLIENT_ID') else 'No'}")
+    print(f"GOOGLE_CLIENT_SECRET loaded: {'Yes' if os.environ.get('GOOGLE_CLIENT_SECRET') else 'No'}")
+    print(f"SESSION_SECRET loaded: {'Yes' if os.environ.get('SESSION_SECRET') else 'No'}")
+
+
+def bootstrap():
+    """Initialize database tables and default accounts (inside an app context)"""
+    from app import db
+    from models import Doctor, Assistant
+
+    try:
+        # Create all tables first
+        db.create_all()
+        print('Database tables initialized')
+
+        # Add columns and indexes declared after the tables were first created
+        from schema import ensure_columns, ensure_indexes, ensure_refractions_migrated, dedupe_payments, backfill_review_dates
+        ensure_columns()
+        # Review lists page on created_at, which must not be NULL
+        backfill_review_dates()
+        # One payment per appointment: clear old duplicates so the unique index can be built
+        dedupe_payments()
+        ensure_indexes()
+
+        # Move refraction strings into structured storage after upgrading
+        ensure_refractions_migrated()
+
+        # Trigram/FTS structures backing the patient typeahead
+        from search import ensure_search_indexes
+        ensure_search_indexes()
+
+        # Seed the dashboard counters on first start
+        from dashboard_stats import ensure_counters
+        ensure_counters()
+
+        # Backfill the daily revenue table on first start
+        from revenue import ensure_daily_revenue
+        ensure_daily_revenue()
+
+        # Backfill the payroll summaries on first start
+        from payroll import ensure_salary_summaries
+        ensure_salary_summaries()
+
+        # Check if we need to create default accounts
+        try:
+            # Create default doctor account if it doesn't exist
+            doctor = Doctor.query.filter_by(username='drricha').first()
+            if not doctor:
+                doctor = Doctor(
+                    username='drricha',
+                    email='drricha@eyeclinic.com',
+                    full_name='Dr. Richa Sharma',
+                    mobile_number='9876543210',
+                    qualifications='MBBS, MS, FPOS',
+                    specialization='Ophthalmology, Pediatric Eye Care'
+                )
+                doctor.set_password('admin123')
+                db.session.add(doctor)
+                print('Default doctor account created')
+
+            # Create optometrist account if it doesn't exist
+            assistant = Assistant.query.filter_by(username='assistant').first()
+            if not assistant:
+                assistant = Assistant(
+                    username='assistant',
+                    email='assistant@eyeclinic.com',
+                    full_name='Clinic Optometrist',
+                    mobile_number='9876543211',
+                    position='Optometrist',
+                    joining_date=date.today()
+                )
+                assistant.set_password('assistant123')
+                db.session.add(assistant)
+                print('Default optometrist account created')
+
+            # Commit changes
+            db.session.commit()
+            print('Database initialization completed successfully')
+
+        except Exception as query_error:
+            # If there's an issue with queries, just create tables and continue
+            print(f'Note: {str(query_error)}')
+            print('Tables created successfully. You may need to run init_db.py separately.')
+
+    except Exception as e:
+        db.session.rollback()
+        print(f'Error initializing database: {str(e)}')
+        return False
+
+    return True
+
+
+def main():
+    from app import app
+
+    report_environment()
+    with app.app_context():
+        return 0 if bootstrap() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
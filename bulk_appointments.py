@@ -0,0 +1,168 @@
+"""
+Bulk appointment confirmation and cancellation
+
+The front desk confirms or cancels a selection of appointments in one
+request instead of one POST each. bulk_update_appointments() does the whole
+selection in a single transaction:
+
+  1. one SELECT reads the selected appointments with their patients
+     (row-locked on PostgreSQL so a concurrent change waits)
+  2. one UPDATE moves every eligible appointment to its new status; the
+     WHERE clause repeats the allowed current statuses, so a row another
+     request changed first is left alone and reported as skipped
+  3. one UPDATE sets the status of their payments, as the single-appointment
+     view does (confirm -> completed, cancel -> cancelled)
+  4. the data the ORM events normally maintain is adjusted with set-based
+     writes: dashboard status counters, daily revenue, the slot reservation
+     ledger and occupancy cache, and the reminder scheduler
+  5. every notification is rendered and added to the outbox with one
+     batched INSERT, and everything commits together
+
+Emails go out through the outbox worker after the commit, so the request
+returns as soon as the transaction is done.
+"""
+
+from sqlalchemy import select
+from app import db
+from models import Appointment, Patient, Payment
+from dashboard_stats import adjust_status_counts
+from notifications import queue_notifications
+from reminder_system import describe_offsets, mark_appointments_changed
+from revenue import adjust_payment_statuses
+from slots import release_cancelled
+
+MAX_BULK_APPOINTMENTS = 200
+
+# action -> (new status, statuses it applies to, new payment status, notification template)
+BULK_ACTIONS = {
+    'confirm': ('confirmed', ('scheduled',), 'completed', 'appointment_confirmed'),
+    'cancel': ('cancelled', ('scheduled', 'confirmed'), 'cancelled', 'appointment_cancelled'),
+}
+
+
+class BulkActionError(ValueError):
+    """Raised for an unknown action or an unusable selection"""
+
+
+def parse_ids(values):
+    """Distinct integer ids in the order given; raises BulkActionError on junk"""
+    ids = []
+    for value in values:
+        try:
+            appointment_id = int(value)
+        except (TypeError, ValueError):
+            raise BulkActionError(f'Invalid appointment id: {value!r}')
+        if appointment_id not in ids:
+            ids.append(appointment_id)
+    if not ids:
+        raise BulkActionError('Select at least one appointment.')
+    if len(ids) > MAX_BULK_APPOINTMENTS:
+        raise BulkActionError(f'Select at most {MAX_BULK_APPOINTMENTS} appointments at a time.')
+    return ids
+
+
+def bulk_update_appointments(appointment_ids, action):
+    """Confirm or cancel appointments in one transaction; returns a result per id
+
+    Each result has the appointment id, `result` (updated, unchanged,
+    not_allowed or not_found), the appointment's status afterwards and
+    whether a notification was queued.
+    """
+    if action not in BULK_ACTIONS:
+        raise BulkActionError(f'Unknown action: {action!r}')
+    new_status, from_statuses, payment_status, template = BULK_ACTIONS[action]
+    table = Appointment.__table__
+
+    # Current state of the selection, with what the emails need
+    query = (
+        select(table.c.id, table.c.status, table.c.appointment_date, table.c.appointment_time,
+               table.c.primary_issue, Patient.full_name, Patient.email)
+        .join(Patient, Patient.id == table.c.patient_id)
+        .where(table.c.id.in_(appointment_ids))
+    )
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update(of=table)
+    rows = {row.id: row for row in db.session.execute(query)}
+
+    results = {}
+    eligible = []
+    for appointment_id in appointment_ids:
+        row = rows.get(appointment_id)
+        if row is None:
+            results[appointment_id] = {'id': appointment_id, 'result': 'not_found', 'status': None, 'notified': False}
+        elif row.status == new_status:
+            results[appointment_id] = {'id': appointment_id, 'result': 'unchanged', 'status': row.status, 'notified': False}
+        elif row.status not in from_statuses:
+            results[appointment_id] = {'id': appointment_id, 'result': 'not_allowed', 'status': row.status, 'notified': False}
+        else:
+            eligible.append(appointment_id)
+
+    changed = []
+    if eligible:
+        stmt = (
+            table.update()
+            .where(table.c.id.in_(eligible), table.c.status.in_(from_statuses))
+            .values(status=new_status)
+        )
+        if db.engine.dialect.update_returning:
+            changed_ids = set(db.session.execute(stmt.returning(table.c.id)).scalars())
+        else:
+            db.session.execute(stmt)
+            changed_ids = set(eligible)
+        changed = [rows[appointment_id] for appointment_id in eligible if appointment_id in changed_ids]
+        for appointment_id in eligible:
+            if appointment_id not in changed_ids:
+                # Changed by someone else between the SELECT and the UPDATE
+                results[appointment_id] = {'id': appointment_id, 'result': 'not_allowed', 'status': None, 'notified': False}
+
+    if changed:
+        changed_ids = [row.id for row in changed]
+        connection = db.session.connection()
+
+        # Payments follow their appointment; revenue totals follow the payments
+        payments = Payment.__table__
+        previous_payments = db.session.execute(
+            select(payments.c.status, payments.c.amount, payments.c.created_at)
+            .where(payments.c.appointment_id.in_(changed_ids), payments.c.status != payment_status)
+        ).all()
+        if previous_payments:
+            db.session.execute(
+                payments.update()
+                .where(payments.c.appointment_id.in_(changed_ids), payments.c.status != payment_status)
+                .values(status=payment_status)
+            )
+            adjust_payment_statuses(connection, previous_payments, payment_status)
+
+        # What the Appointment ORM events would have done row by row
+        adjust_status_counts(connection, [row.status for row in changed], new_status)
+        if new_status == 'cancelled':
+            release_cancelled(db.session, [
+                (row.appointment_date, row.appointment_time) for row in changed if row.status != 'cancelled'
+            ])
+        mark_appointments_changed(db.session, changed_ids)
+
+        # Every notification joins the same transaction in one batched INSERT
+        reminder_offsets = describe_offsets()
+        queue_notifications([
+            (row.email, template, {
+                'patient_name': row.full_name,
+                'appointment_date': row.appointment_date,
+                'appointment_time': row.appointment_time,
+                'primary_issue': row.primary_issue,
+                'reminder_offsets': reminder_offsets,
+            })
+            for row in changed if row.email
+        ])
+        for row in changed:
+            results[row.id] = {'id': row.id, 'result': 'updated', 'status': new_status, 'notified': bool(row.email)}
+
+    db.session.commit()
+    return [results[appointment_id] for appointment_id in appointment_ids]
+
+
+def summarize(results):
+    """Count of results by outcome"""
+    summary = {}
+    for result in results:
+        summary[result['result']] = summary.get(result['result'], 0) + 1
+    return summary
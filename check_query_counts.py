@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Query count check for the staff list pages
+
+Renders admin_appointments and admin_revenue as a doctor with N and then
+10N extra appointments (each with a patient, a payment and a treatment)
+and exits non-zero if either page runs a different number of statements
+at the two sizes, which would mean a query per row has crept back in.
+Statements sent to the read replica are counted as well.
+
+Runs against DATABASE_URL and removes everything it creates.
+
+    python check_query_counts.py --rows 10
+"""
+
+import argparse
+import sys
+from datetime import datetime, timedelta, time
+from app import app, db
+from models import Doctor, Patient, Appointment, Payment, Treatment, SlotReservation
+from queries import count_queries
+
+PAGES = {
+    'admin_appointments': '/admin/appointments',
+    'admin_revenue': '/admin/revenue',
+}
+
+FIXTURE_NAME = 'Query Count Check'
+
+
+def add_rows(count, slot_date, slot_time):
+    """Add `count` patients, each with an appointment, a payment and a treatment"""
+    today = datetime.now().date()
+    for _ in range(count):
+        patient = Patient(full_name=FIXTURE_NAME, mobile_number='0000000000', age=1, is_registered=False)
+        appointment = Appointment(
+            patient=patient,
+            appointment_date=slot_date,
+            appointment_time=slot_time,
+            primary_issue=FIXTURE_NAME,
+            status='scheduled'
+        )
+        # Every fixture shares one slot
+        appointment.allow_overbooking = True
+        db.session.add(appointment)
+        db.session.flush()
+        db.session.add(Payment(appointment_id=appointment.id, amount=100, payment_method='cash', status='pending'))
+        db.session.add(Treatment(patient_id=patient.id, treatment_name=FIXTURE_NAME, treatment_date=today, amount=100))
+    db.session.commit()
+
+
+def remove_rows(slot_date, slot_time):
+    """Delete the fixtures through the ORM so the ledger and counters stay consistent"""
+    for patient in Patient.query.filter_by(full_name=FIXTURE_NAME).all():
+        for appointment in Appointment.query.filter_by(patient_id=patient.id).all():
+            for payment in Payment.query.filter_by(appointment_id=appointment.id).all():
+                db.session.delete(payment)
+            db.session.delete(appointment)
+        for treatment in Treatment.query.filter_by(patient_id=patient.id).all():
+            db.session.delete(treatment)
+        db.session.delete(patient)
+    db.session.commit()
+    SlotReservation.query.filter_by(slot_date=slot_date, slot_time=slot_time).delete()
+    db.session.commit()
+
+
+def page_counts(client):
+    """Statements each page runs, after a warm-up request fills per-process caches"""
+    counts = {}
+    for name, url in PAGES.items():
+        client.get(url)
+        with count_queries() as statements:
+            response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} returned {response.status_code}')
+        counts[name] = len(statements)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10, help='rows for the smaller run (N)')
+    args = parser.parse_args()
+
+    # A weekday evening slot far enough ahead not to collide with real bookings
+    slot_date = datetime.now().date() + timedelta(days=3650)
+    while slot_date.weekday() == 6:
+        slot_date += timedelta(days=1)
+    slot_time = time(17, 30)
+
+    created_doctor = False
+    with app.app_context():
+        doctor = Doctor.query.first()
+        if doctor is None:
+            doctor = Doctor(username='query_count_check', email='query-count-check@example.com',
+                            full_name=FIXTURE_NAME, mobile_number='0000000000')
+            doctor.set_password('query-count-check')
+            db.session.add(doctor)
+            db.session.commit()
+            created_doctor = True
+        doctor_id = doctor.id
+        user_id = doctor.get_id()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = user_id
+        session['_fresh'] = True
+
+    results = {}
+    try:
+        with app.app_context():
+            for rows in (args.rows, args.rows * 10):
+                add_rows(rows - sum(results), slot_date, slot_time)
+                results[rows] = page_counts(client)
+    finally:
+        with app.app_context():
+            remove_rows(slot_date, slot_time)
+            if created_doctor:
+                db.session.delete(db.session.get(Doctor, doctor_id))
+                db.session.commit()
+
+    small, large = results.values()
+    failures = []
+    for name in PAGES:
+        print(f"{name}: {small[name]} statements with {args.rows} rows, "
+              f"{large[name]} with {args.rows * 10} rows")
+        if small[name] != large[name]:
+            failures.append(name)
+
+    if failures:
+        print(f"\n❌ Query count grows with row count in: {', '.join(failures)}")
+        return 1
+
+    print("\n✅ Staff list pages run a fixed number of queries")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
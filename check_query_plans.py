@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Query plan check for the appointment hot paths
+
+Runs EXPLAIN on the appointment queries issued by admin_dashboard,
+available_slots, the reminder scheduler and patient_dashboard and exits
+non-zero if any of them falls back to a sequential scan of the appointment
+table. The statements come from the same helpers the routes call, so the
+check follows the routes when they change.
+
+Plans depend on table size, so the check first seeds --rows appointments
+(a few years of history plus the coming weeks) and refreshes the planner
+statistics. Seeding, ANALYZE and EXPLAIN share one transaction that is
+rolled back at the end, leaving the database as it was.
+
+    python check_query_plans.py --rows 20000
+"""
+
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, func, text
+from app import app, db
+from models import Patient, Appointment
+from dashboard_stats import dashboard_stats_statement
+from queries import appointments_on_date_query, patient_appointments_query
+from reminder_system import confirmed_appointments_query
+from slots import occupancy_query, slots_for_day, MAX_RANGE_DAYS
+
+HISTORY_DAYS = 3 * 365
+FUTURE_DAYS = 60
+APPOINTMENTS_PER_PATIENT = 4
+
+
+def seed(rows):
+    """Insert `rows` appointments spread over past and upcoming days; returns a seeded patient id"""
+    today = datetime.now().date()
+    now = datetime.utcnow()
+    patients = max(1, rows // APPOINTMENTS_PER_PATIENT)
+    first_id = (db.session.execute(select(func.max(Patient.id))).scalar() or 0) + 1
+
+    # Core inserts: the rows never commit, so the ORM counters need not see them
+    db.session.execute(insert(Patient), [
+        {'id': first_id + i, 'full_name': f'Plan Check {i}', 'mobile_number': '0000000000', 'age': 30,
+         'is_registered': False, 'created_at': now}
+        for i in range(patients)
+    ])
+
+    appointments = []
+    for i in range(rows):
+        day = today + timedelta(days=random.randint(-HISTORY_DAYS, FUTURE_DAYS))
+        if day < today:
+            status = random.choices(('completed', 'cancelled'), weights=(9, 1))[0]
+        else:
+            status = random.choices(('scheduled', 'confirmed', 'cancelled'), weights=(6, 3, 1))[0]
+        appointments.append({
+            'patient_id': first_id + i % patients,
+            'appointment_date': day,
+            'appointment_time': datetime.strptime(random.choice(slots_for_day(day)), '%H:%M').time(),
+            'status': status,
+            'created_at': now,
+            'updated_at': now,
+            'consultation_fee': 500.0,
+            'payment_status': 'pending',
+        })
+    db.session.execute(insert(Appointment), appointments)
+
+    db.session.execute(text('ANALYZE'))
+    return first_id
+
+
+def hot_path_queries(patient_id):
+    """The appointment statements the busiest routes build"""
+    today = datetime.now().date()
+
+    return {
+        'admin_dashboard (counts)': dashboard_stats_statement(),
+        'admin_dashboard (today)': appointments_on_date_query(today, status='scheduled'),
+        'available_slots': occupancy_query(today, today + timedelta(days=MAX_RANGE_DAYS - 1)),
+        'reminder scheduler': confirmed_appointments_query(today, today + timedelta(days=2)),
+        'patient_dashboard': patient_appointments_query(patient_id),
+    }
+
+
+def explain(query):
+    """Return the plan lines for a query or statement on the current database"""
+    statement = getattr(query, 'statement', query)
+    sql = str(statement.compile(
+        dialect=db.engine.dialect,
+        compile_kwargs={'literal_binds': True}
+    ))
+
+    if db.engine.dialect.name == 'postgresql':
+        rows = db.session.execute(text(f'EXPLAIN {sql}')).fetchall()
+        return [row[0] for row in rows]
+
+    rows = db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}')).fetchall()
+    return [row[-1] for row in rows]
+
+
+def is_sequential_scan(plan_line):
+    """Check whether a plan line is a full scan of the appointment table"""
+    if 'Seq Scan on appointment' in plan_line:
+        return True
+    # SQLite reports indexed access as "SCAN appointment USING INDEX ..."
+    return plan_line.strip() == 'SCAN appointment'
+
+
+def main():
+    """Check every hot path query and report any sequential scans"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000, help='appointments to seed before EXPLAIN')
+    args = parser.parse_args()
+
+    failures = []
+
+    with app.app_context():
+        try:
+            patient_id = seed(args.rows)
+            print(f"Seeded {args.rows} appointments")
+
+            for name, query in hot_path_queries(patient_id).items():
+                plan = explain(query)
+
+                print(f"\n{name}:")
+                for line in plan:
+                    print(f"    {line}")
+
+                if any(is_sequential_scan(line) for line in plan):
+                    failures.append(name)
+        finally:
+            db.session.rollback()
+
+    if failures:
+        print(f"\n❌ Sequential scan on appointment in: {', '.join(failures)}")
+        return 1
+
+    print("\n✅ All appointment hot paths use an index")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
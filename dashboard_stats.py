@@ -0,0 +1,183 @@
+"""
+Dashboard statistics
+
+Staff dashboards show a handful of counts. Global totals (patients,
+appointments, appointments per status) are kept in the stat_counter table
+and adjusted by ORM events in the same transaction as the write that changes
+them, so reading them costs a primary-key lookup however large the history
+grows. Date-dependent counts are computed from indexed columns. All of them
+are fetched with a single SELECT.
+
+Every booking and status change adjusts the same few totals, and the row an
+UPDATE touches stays locked until its transaction commits. To keep busy
+writers from queueing behind one another, each total is spread over
+STAT_COUNTER_SHARDS rows: a write adjusts one shard picked at random and the
+dashboard sums the shards.
+
+Counters only see writes made through the ORM unit of work. Bulk
+query.update()/delete() calls bypass the events; a bulk status change calls
+adjust_status_counts() in its own transaction (see bulk_appointments.py),
+and other maintenance should run rebuild_counters() afterwards.
+"""
+
+import os
+import random
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import event, func, inspect, select
+from app import db
+from models import Patient, Appointment, Review, OptometristPrescription, StatCounter
+from orm_history import track_previous
+
+PATIENTS = 'patients'
+APPOINTMENTS = 'appointments'
+APPOINTMENT_STATUSES = ('scheduled', 'confirmed', 'completed', 'cancelled')
+
+STAT_COUNTER_SHARDS = max(1, int(os.environ.get('STAT_COUNTER_SHARDS', 8)))
+
+
+def status_counter(status):
+    """Counter name for appointments in a given status"""
+    return f'appointments:{status}'
+
+
+def _bump_shard(connection, name, shard, delta):
+    table = StatCounter.__table__
+    return connection.execute(
+        table.update()
+        .where(table.c.name == name, table.c.shard == shard)
+        .values(value=table.c.value + delta, updated_at=datetime.utcnow())
+    ).rowcount
+
+
+def _bump(connection, name, delta):
+    """Adjust one shard of a counter inside the current transaction"""
+    shard = random.randrange(STAT_COUNTER_SHARDS)
+    if _bump_shard(connection, name, shard, delta) == 0 and shard:
+        # Shard 0 always exists, even after STAT_COUNTER_SHARDS was raised
+        _bump_shard(connection, name, 0, delta)
+
+
+@event.listens_for(Patient, 'after_insert')
+def _patient_inserted(mapper, connection, target):
+    _bump(connection, PATIENTS, 1)
+
+
+@event.listens_for(Patient, 'after_delete')
+def _patient_deleted(mapper, connection, target):
+    _bump(connection, PATIENTS, -1)
+
+
+@event.listens_for(Appointment, 'after_insert')
+def _appointment_inserted(mapper, connection, target):
+    _bump(connection, APPOINTMENTS, 1)
+    _bump(connection, status_counter(target.status or 'scheduled'), 1)
+
+
+@event.listens_for(Appointment, 'after_delete')
+def _appointment_deleted(mapper, connection, target):
+    _bump(connection, APPOINTMENTS, -1)
+    _bump(connection, status_counter(target.status), -1)
+
+
+# The update handler below needs the previous status to decrement its counter
+track_previous(Appointment.status)
+
+
+@event.listens_for(Appointment, 'after_update')
+def _appointment_updated(mapper, connection, target):
+    history = inspect(target).attrs.status.history
+    if not history.has_changes():
+        return
+    for old_status in history.deleted:
+        _bump(connection, status_counter(old_status), -1)
+    for new_status in history.added:
+        _bump(connection, status_counter(new_status), 1)
+
+
+def adjust_status_counts(connection, old_statuses, new_status):
+    """Move appointments between status counters after a bulk status UPDATE
+
+    `old_statuses` holds the previous status of each appointment that changed.
+    """
+    for old_status, count in Counter(old_statuses).items():
+        _bump(connection, status_counter(old_status), -count)
+    if old_statuses:
+        _bump(connection, status_counter(new_status), len(old_statuses))
+
+
+def rebuild_counters():
+    """Recompute every counter from the base tables"""
+    counts = {
+        PATIENTS: db.session.query(func.count(Patient.id)).scalar(),
+        APPOINTMENTS: db.session.query(func.count(Appointment.id)).scalar(),
+    }
+    for status in APPOINTMENT_STATUSES:
+        counts[status_counter(status)] = 0
+    for status, count in db.session.query(Appointment.status, func.count(Appointment.id)).group_by(Appointment.status):
+        counts[status_counter(status)] = count
+
+    # The total goes in shard 0 and the other shards start from zero
+    db.session.query(StatCounter).delete(synchronize_session=False)
+    db.session.add_all(
+        StatCounter(name=name, shard=shard, value=value if shard == 0 else 0)
+        for name, value in counts.items()
+        for shard in range(STAT_COUNTER_SHARDS)
+    )
+    db.session.commit()
+    return counts
+
+
+def ensure_counters():
+    """Seed the counters table the first time the application starts"""
+    table = StatCounter.__table__
+    columns = {column['name'] for column in db.inspect(db.engine).get_columns(table.name)}
+    if 'shard' not in columns:
+        # Counters from before sharding were keyed by name alone; the table
+        # only holds derived totals, so recreate it and count again
+        table.drop(bind=db.engine)
+        table.create(bind=db.engine)
+    if db.session.get(StatCounter, (PATIENTS, 0)) is None:
+        rebuild_counters()
+        print('Dashboard counters initialized')
+
+
+def _counter(name):
+    return select(func.sum(StatCounter.value)).where(StatCounter.name == name).scalar_subquery()
+
+
+def _count(model, *criteria):
+    return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+
+def dashboard_stats_statement(assistant_id=None):
+    """The SELECT behind dashboard_stats()"""
+    today = datetime.now().date()
+    columns = [
+        _counter(PATIENTS).label('total_patients'),
+        _counter(APPOINTMENTS).label('total_appointments'),
+        _count(
+            Appointment,
+            Appointment.appointment_date >= today,
+            Appointment.status == 'scheduled'
+        ).label('upcoming_appointments'),
+        _count(Review, Review.is_approved == False).label('pending_reviews'),
+    ]
+    columns += [_counter(status_counter(status)).label(status) for status in APPOINTMENT_STATUSES]
+    if assistant_id is not None:
+        columns.append(_count(
+            OptometristPrescription,
+            OptometristPrescription.assistant_id == assistant_id
+        ).label('prescriptions_count'))
+    return select(*columns)
+
+
+def dashboard_stats(assistant_id=None):
+    """Return the dashboard counts in one round trip
+
+    Includes the optometrist's own prescription count when assistant_id is given.
+    """
+    row = db.session.execute(dashboard_stats_statement(assistant_id)).one()
+    stats = {key: value or 0 for key, value in row._mapping.items()}
+    stats['appointments_by_status'] = {status: stats.pop(status) for status in APPOINTMENT_STATUSES}
+    return stats
@@ -0,0 +1,150 @@
+"""
+Database connection pool configuration and metrics
+
+Pool settings come from the environment so they can be tuned per deployment
+without code changes:
+
+    DB_POOL_SIZE          connections kept open per worker (default 5)
+    DB_MAX_OVERFLOW       extra connections allowed under load (default 10)
+    DB_POOL_TIMEOUT       seconds to wait for a free connection (default 30)
+    DB_POOL_RECYCLE       seconds before a connection is replaced (default 1800)
+    DB_POOL_PRE_PING      test connections before use (default true)
+    DB_POOL_SLOW_WAIT     log checkouts that wait longer than this (default 0.5)
+    DB_PGBOUNCER          set to true behind PgBouncer in transaction mode
+
+Pre-ping and recycle stop requests failing on connections that died when
+PostgreSQL restarted or a firewall dropped them. Behind PgBouncer in
+transaction pooling mode PgBouncer owns the pool, so the application opens a
+connection per checkout (NullPool) instead of holding server connections.
+
+Each gunicorn worker has its own pool per engine (the primary and, when
+configured, the read replica bind); pool_stats() reports the current
+worker's checked-out connections, overflow and checkout wait times for one
+of them.
+"""
+
+import os
+import threading
+import time
+from sqlalchemy.pool import NullPool, QueuePool
+
+SLOW_WAIT = float(os.environ.get('DB_POOL_SLOW_WAIT', 0.5))
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() == 'true'
+
+
+class _WaitStats:
+    """Checkout wait times for one of this worker's pools"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, waited, timed_out=False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': round(1000 * self.total_wait / self.checkouts, 2) if self.checkouts else 0.0,
+                'max_wait_ms': round(1000 * self.max_wait, 2),
+            }
+
+
+# bind key (None for the primary) -> checkout wait times of that engine's pool
+_wait_stats = {}
+# bind key -> the options engine_options() returned for it
+_engine_options = {}
+
+
+def wait_stats_for(bind=None):
+    """Checkout wait times of one bind's pool in this worker"""
+    return _wait_stats.setdefault(bind, _WaitStats())
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection
+
+    engine_options() subclasses it per bind so each engine's waits are
+    recorded separately; `bind` survives pool.recreate().
+    """
+
+    bind = None
+
+    def _do_get(self):
+        stats = wait_stats_for(self.bind)
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            waited = time.perf_counter() - start
+            stats.record(waited, timed_out=True)
+            print(f"[db pool] pid {os.getpid()}: no connection after {waited:.2f}s ({self.status()})")
+            raise
+        waited = time.perf_counter() - start
+        stats.record(waited)
+        if waited > SLOW_WAIT:
+            print(f"[db pool] pid {os.getpid()}: waited {waited:.2f}s for a connection ({self.status()})")
+        return connection
+
+
+def engine_options(database_url, bind=None):
+    """SQLALCHEMY_ENGINE_OPTIONS for the given database URL from the environment
+
+    `bind` is the Flask-SQLAlchemy bind key the options are for, None for
+    the primary database.
+    """
+    if _env_bool('DB_PGBOUNCER', False):
+        # PgBouncer pools server connections; holding them here would pin them
+        options = {'poolclass': NullPool}
+    else:
+        options = {'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', True)}
+        if not database_url.startswith('sqlite'):
+            # SQLite file/memory pools take no sizing arguments
+            options.update({
+                'poolclass': type('TimedQueuePool', (TimedQueuePool,), {'bind': bind}),
+                'pool_size': _env_int('DB_POOL_SIZE', 5),
+                'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+                'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+                'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+            })
+    _engine_options[bind] = options
+    return options
+
+
+def pool_stats(engine, bind=None):
+    """Connection pool usage for this worker's pool of one bind"""
+    pool = engine.pool
+    stats = {
+        'pid': os.getpid(),
+        'bind': bind or 'primary',
+        'pool': type(pool).__name__,
+    }
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': _engine_options.get(bind, {}).get('max_overflow'),
+            'timeout': pool.timeout(),
+        })
+    stats.update(wait_stats_for(bind).snapshot())
+    return stats
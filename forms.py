@@ -13,6 +13,8 @@ class AppointmentForm(FlaskForm):
     appointment_time = TimeField('Appointment Time', validators=[DataRequired()])
     primary_issue = TextAreaField('Primary Eye Issue', validators=[Optional(), Length(max=500)])
     referral_info = StringField('Referral Information (if any)', validators=[Optional(), Length(max=255)])
+    # Issued with the form; a resubmission with the same key returns the first booking
+    idempotency_key = HiddenField('Idempotency Key', validators=[Optional(), Length(max=64)])
     submit = SubmitField('Book Appointment')
 
 class FindAppointmentForm(FlaskForm):
@@ -0,0 +1,113 @@
+"""
+Idempotent booking and payment creation
+
+A slow response invites a second click or a browser retry, and each used to
+write another appointment and another payment. Two guards make the repeat a
+cheap no-op instead:
+
+  - The booking form carries an idempotency key issued when the form is
+    rendered (or an Idempotency-Key header from API clients). The key is
+    stored in booking_request with the appointment, in the same transaction.
+    A resubmission finds the row and returns the first appointment; two
+    submissions racing each other collide on the primary key, and the loser
+    rolls back and returns the winner's appointment.
+  - payment.appointment_id is unique. ensure_payment() returns the existing
+    payment when there is one and inserts inside a savepoint otherwise, so a
+    concurrent insert loses the race without undoing the rest of the
+    transaction.
+
+Keys are kept for BOOKING_KEY_TTL_HOURS; older ones are deleted from time to
+time while new bookings are recorded.
+"""
+
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import BookingRequest, Payment
+
+BOOKING_KEY_TTL_HOURS = int(os.environ.get('BOOKING_KEY_TTL_HOURS', '24'))
+BOOKING_KEY_PURGE_INTERVAL = 600  # seconds between purges in a worker
+
+_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+_last_purge = 0.0
+
+
+def new_booking_key():
+    """A fresh idempotency key for a booking form"""
+    return uuid.uuid4().hex
+
+
+def clean_key(value):
+    """The key if it is well formed, otherwise None (the submission is not deduplicated)"""
+    if value and _KEY_PATTERN.match(value):
+        return value
+    return None
+
+
+def booking_details(appointment):
+    """What the payment and success pages show about a booking, kept in the session"""
+    return {
+        'patient_name': appointment.patient.full_name,
+        'appointment_date': appointment.appointment_date.strftime('%A, %B %d, %Y'),
+        'appointment_time': appointment.appointment_time.strftime('%I:%M %p'),
+    }
+
+
+def find_booking(key):
+    """Appointment id an earlier submission with this key created, or None"""
+    if not key:
+        return None
+    cutoff = datetime.utcnow() - timedelta(hours=BOOKING_KEY_TTL_HOURS)
+    return db.session.query(BookingRequest.appointment_id).filter(
+        BookingRequest.idempotency_key == key,
+        BookingRequest.created_at >= cutoff
+    ).scalar()
+
+
+def record_booking(key, appointment):
+    """Store the key with a new appointment in the current transaction"""
+    if not key:
+        return
+    _purge_expired_keys()
+    db.session.add(BookingRequest(idempotency_key=key, appointment=appointment))
+
+
+def is_duplicate_key_error(error, key):
+    """Whether a failed commit lost a race on this booking key"""
+    return bool(key) and isinstance(error, IntegrityError) and 'booking_request' in str(error.orig).lower()
+
+
+def _purge_expired_keys():
+    global _last_purge
+    now = time.monotonic()
+    if now - _last_purge < BOOKING_KEY_PURGE_INTERVAL:
+        return
+    _last_purge = now
+    cutoff = datetime.utcnow() - timedelta(hours=BOOKING_KEY_TTL_HOURS)
+    # Leave the pending booking unflushed; the caller flushes it where it handles slot errors
+    with db.session.no_autoflush:
+        deleted = BookingRequest.query.filter(BookingRequest.created_at < cutoff).delete(synchronize_session=False)
+    if deleted:
+        print(f"Purged {deleted} expired booking keys")
+
+
+def ensure_payment(appointment, amount, payment_method='cash', status='pending'):
+    """The appointment's payment, created if it has none; returns (payment, created)"""
+    existing = Payment.query.filter_by(appointment_id=appointment.id).first()
+    if existing is not None:
+        return existing, False
+
+    payment = Payment(appointment_id=appointment.id, amount=amount,
+                      payment_method=payment_method, status=status)
+    try:
+        with db.session.begin_nested():
+            db.session.add(payment)
+    except IntegrityError:
+        # A concurrent request inserted it after our lookup
+        return Payment.query.filter_by(appointment_id=appointment.id).one(), False
+    return payment, True
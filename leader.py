@@ -0,0 +1,160 @@
+"""
+Leader election for background jobs
+
+Every worker process starts the background jobs on its first request, so
+without coordination N gunicorn workers send each reminder N times. Jobs
+that must run in one place take a lease: a job_lease row naming the holder
+(hostname:pid) and when the lease expires. A process becomes leader with a
+conditional
+    UPDATE job_lease SET holder = :me, expires_at = now + LEASE_TTL
+    WHERE name = :job AND (holder = :me OR expires_at < now)
+so at most one process matches while a lease is live. The leader renews
+every LEASE_RENEW_INTERVAL seconds, and the others retry on the same
+interval. The lease table lives in the application database, so this works
+across hosts and on SQLite as well as PostgreSQL.
+
+Failover: a leader that exits cleanly releases its lease and another worker
+takes over within LEASE_RENEW_INTERVAL. One that dies is replaced once its
+lease expires, within LEASE_TTL + LEASE_RENEW_INTERVAL. A leader that cannot
+renew (database down, process stalled) treats itself as demoted once the
+lease would have expired, so two processes never both believe they lead.
+Expiry times come from each host's clock, so hosts need NTP-level agreement
+well inside LEASE_TTL.
+"""
+
+import atexit
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import case, or_
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import JobLease
+
+LEASE_TTL = float(os.environ.get('LEASE_TTL', 30))
+LEASE_RENEW_INTERVAL = float(os.environ.get('LEASE_RENEW_INTERVAL', LEASE_TTL / 3))
+
+# Leases started in this process, by job name
+_leases = {}
+
+
+def holder_id():
+    # Read when used, not at import, so forked workers each get their own pid
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def try_acquire(name, holder, ttl=LEASE_TTL):
+    """Take or renew the lease on `name`; returns whether `holder` now has it"""
+    now = datetime.utcnow()
+    if db.session.get(JobLease, name) is None:
+        db.session.add(JobLease(name=name, expires_at=now))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another process created the row first
+            db.session.rollback()
+
+    taken = JobLease.query.filter(
+        JobLease.name == name,
+        or_(JobLease.holder == holder, JobLease.expires_at < now)
+    ).update({
+        JobLease.acquired_at: case((JobLease.holder == holder, JobLease.acquired_at), else_=now),
+        JobLease.holder: holder,
+        JobLease.renewed_at: now,
+        JobLease.expires_at: now + timedelta(seconds=ttl),
+    }, synchronize_session=False)
+    db.session.commit()
+    return bool(taken)
+
+
+def release(name, holder):
+    """Expire the lease now if `holder` has it, so another process can take over"""
+    JobLease.query.filter(JobLease.name == name, JobLease.holder == holder).update(
+        {JobLease.expires_at: datetime.utcnow() - timedelta(seconds=1)}, synchronize_session=False
+    )
+    db.session.commit()
+
+
+class LeaderLease:
+    """Keeps trying to hold the lease on one job name in a background thread"""
+
+    def __init__(self, app, name, on_elected=None):
+        self.app = app
+        self.name = name
+        self.on_elected = on_elected
+        self.holder = None
+        self.valid_until = 0.0
+        self.elected_at = None
+        self.stopping = threading.Event()
+
+    def is_leader(self):
+        # Trust the lease only until it would have expired without a renewal
+        return time.monotonic() < self.valid_until
+
+    def _attempt(self):
+        started = time.monotonic()
+        was_leader = self.is_leader()
+        try:
+            with self.app.app_context():
+                acquired = try_acquire(self.name, self.holder)
+        except Exception as e:
+            print(f"Could not renew the {self.name} lease: {str(e)}")
+            with self.app.app_context():
+                db.session.rollback()
+            acquired = False
+
+        if acquired:
+            self.valid_until = started + LEASE_TTL
+            if not was_leader:
+                self.elected_at = datetime.utcnow()
+                print(f"{self.holder} is now running {self.name}")
+                if self.on_elected is not None:
+                    self.on_elected()
+        elif was_leader:
+            self.valid_until = 0.0
+            self.elected_at = None
+            print(f"{self.holder} stopped running {self.name}")
+
+    def _loop(self):
+        while not self.stopping.is_set():
+            self._attempt()
+            self.stopping.wait(LEASE_RENEW_INTERVAL)
+
+    def start(self):
+        self.holder = holder_id()
+        _leases[self.name] = self
+        lease_thread = threading.Thread(target=self._loop, daemon=True)
+        lease_thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop renewing and hand the lease over straight away"""
+        self.stopping.set()
+        if not self.is_leader():
+            return
+        self.valid_until = 0.0
+        try:
+            with self.app.app_context():
+                release(self.name, self.holder)
+        except Exception as e:
+            print(f"Could not release the {self.name} lease: {str(e)}")
+
+
+def lease_status():
+    """Every job lease in the database, and what this process holds"""
+    now = datetime.utcnow()
+    leases = []
+    for lease in JobLease.query.order_by(JobLease.name).all():
+        local = _leases.get(lease.name)
+        leases.append({
+            'name': lease.name,
+            'holder': lease.holder,
+            'active': lease.holder is not None and lease.expires_at > now,
+            'acquired_at': lease.acquired_at.isoformat() if lease.acquired_at else None,
+            'renewed_at': lease.renewed_at.isoformat() if lease.renewed_at else None,
+            'expires_at': lease.expires_at.isoformat(),
+            'held_by_this_process': bool(local and local.is_leader()),
+        })
+    return {'process': holder_id(), 'leases': leases}
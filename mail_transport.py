@@ -0,0 +1,291 @@
+"""
+Shared SMTP transport
+
+Every email the application sends (the outbox worker, appointment
+reminders) goes through a small per-process pool of authenticated SMTP
+connections instead of a fresh connect, STARTTLS and login per message.
+
+Connections are kept open between sends. One idle for more than
+MAIL_NOOP_AFTER seconds is checked with NOOP before reuse, and one idle for
+more than MAIL_MAX_IDLE seconds is replaced, since servers drop quiet
+sessions. A connection that fails mid-send is reopened and the message
+retried once. At most MAIL_POOL_SIZE connections are open per process.
+
+send_messages() sends a batch over one pooled connection, so a reminder run
+of hundreds of messages costs one or two handshakes. Settings are the
+MAIL_* values from the app config; SMTP_EMAIL and SMTP_PASSWORD, which the
+reminder service used to read, are accepted as fallbacks (see app.py).
+"""
+
+import os
+import smtplib
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from flask import current_app
+
+MAIL_POOL_SIZE = int(os.environ.get('MAIL_POOL_SIZE', 2))
+MAIL_POOL_TIMEOUT = float(os.environ.get('MAIL_POOL_TIMEOUT', 30))
+MAIL_NOOP_AFTER = float(os.environ.get('MAIL_NOOP_AFTER', 30))
+MAIL_MAX_IDLE = float(os.environ.get('MAIL_MAX_IDLE', 240))
+SMTP_TIMEOUT = 30
+
+MailSettings = namedtuple('MailSettings', 'server port username password use_tls')
+
+# Rejections of one message; the session stays usable for the next
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def is_connection_error(error):
+    """Whether the session cannot be trusted after this error"""
+    # SMTPException subclasses OSError, so message rejections are excluded explicitly
+    return isinstance(error, OSError) and not isinstance(error, MESSAGE_ERRORS)
+
+
+def mail_settings(config=None):
+    """SMTP settings from the app config"""
+    config = config if config is not None else current_app.config
+    return MailSettings(
+        config['MAIL_SERVER'],
+        int(config['MAIL_PORT']),
+        config.get('MAIL_USERNAME'),
+        config.get('MAIL_PASSWORD'),
+        bool(config.get('MAIL_USE_TLS')),
+    )
+
+
+def build_message(to_email, subject, body, subtype='plain', sender=None, html=None, images=()):
+    """A MIME message ready for send_messages()
+
+    With `html`, `body` is the plain-text alternative and `images` are inline
+    parts the HTML refers to by Content-ID.
+    """
+    if html is None:
+        msg = MIMEMultipart()
+        msg.attach(MIMEText(body, subtype))
+    else:
+        alternative = MIMEMultipart('alternative')
+        alternative.attach(MIMEText(body, 'plain'))
+        alternative.attach(MIMEText(html, 'html'))
+        if images:
+            msg = MIMEMultipart('related')
+            msg.attach(alternative)
+            for image in images:
+                msg.attach(image)
+        else:
+            msg = alternative
+    msg['From'] = sender if sender is not None else current_app.config['MAIL_USERNAME']
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    return msg
+
+
+class _PooledConnection:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.last_used = time.monotonic()
+
+
+class SMTPPool:
+    """A bounded pool of open SMTP sessions for one server and account"""
+
+    def __init__(self, settings, size=MAIL_POOL_SIZE):
+        self.settings = settings
+        self.size = size
+        self.idle = []
+        self.open_count = 0
+        self.condition = threading.Condition()
+        self.stats = {'connects': 0, 'reconnects': 0, 'noops': 0, 'sent': 0, 'failed': 0}
+
+    def _count(self, name, amount=1):
+        with self.condition:
+            self.stats[name] += amount
+
+    def _connect(self):
+        settings = self.settings
+        smtp = smtplib.SMTP(settings.server, settings.port, timeout=SMTP_TIMEOUT)
+        try:
+            if settings.use_tls:
+                smtp.starttls()
+            if settings.password:
+                smtp.login(settings.username, settings.password)
+        except Exception:
+            _close_quietly(smtp)
+            raise
+        self._count('connects')
+        return _PooledConnection(smtp)
+
+    def _healthy(self, connection):
+        """Whether an idle connection can be reused as it is"""
+        idle_for = time.monotonic() - connection.last_used
+        if idle_for > MAIL_MAX_IDLE:
+            return False
+        if idle_for > MAIL_NOOP_AFTER:
+            self._count('noops')
+            try:
+                return connection.smtp.noop()[0] == 250
+            except OSError:
+                return False
+        return True
+
+    def checkout(self):
+        """An open connection, waiting up to MAIL_POOL_TIMEOUT for a free slot"""
+        deadline = time.monotonic() + MAIL_POOL_TIMEOUT
+        with self.condition:
+            while not self.idle and self.open_count >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    raise TimeoutError(f'No SMTP connection free after {MAIL_POOL_TIMEOUT:.0f}s')
+            if self.idle:
+                connection = self.idle.pop()
+            else:
+                connection = None
+                self.open_count += 1
+
+        try:
+            if connection is None:
+                return self._connect()
+            if self._healthy(connection):
+                return connection
+            _close_quietly(connection.smtp)
+            self._count('reconnects')
+            return self._connect()
+        except Exception:
+            self._release_slot()
+            raise
+
+    def checkin(self, connection, broken=False):
+        if broken:
+            _close_quietly(connection.smtp)
+            self._release_slot()
+            return
+        connection.last_used = time.monotonic()
+        with self.condition:
+            self.idle.append(connection)
+            self.condition.notify()
+
+    def _release_slot(self):
+        with self.condition:
+            self.open_count -= 1
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self):
+        connection = self.checkout()
+        try:
+            yield connection
+        except Exception as e:
+            self.checkin(connection, broken=is_connection_error(e))
+            raise
+        else:
+            self.checkin(connection)
+
+    def send_batch(self, messages):
+        """Send messages over one connection; returns an error (or None) per message"""
+        results = []
+        if not messages:
+            return results
+
+        connection = self.checkout()
+        broken = False
+        try:
+            for index, msg in enumerate(messages):
+                try:
+                    connection.smtp.send_message(msg)
+                    results.append(None)
+                    continue
+                except Exception as e:
+                    if not is_connection_error(e):
+                        results.append(e)
+                        continue
+
+                # Dropped session: reopen it and retry this message once
+                _close_quietly(connection.smtp)
+                self._count('reconnects')
+                try:
+                    connection = self._connect()
+                except Exception as e:
+                    # Server unreachable; fail the rest of the batch now
+                    broken = True
+                    results.extend([e] * (len(messages) - index))
+                    break
+                try:
+                    connection.smtp.send_message(msg)
+                    results.append(None)
+                except Exception as e:
+                    results.append(e)
+        except BaseException:
+            broken = True
+            raise
+        finally:
+            self.checkin(connection, broken=broken)
+
+        failed = sum(1 for error in results if error is not None)
+        self._count('sent', len(results) - failed)
+        self._count('failed', failed)
+        return results
+
+    def close(self):
+        """Close idle connections (checked-out ones close on checkin)"""
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.open_count -= len(idle)
+            self.condition.notify_all()
+        for connection in idle:
+            _close_quietly(connection.smtp)
+
+    def snapshot(self):
+        with self.condition:
+            return dict(self.stats, open=self.open_count, idle=len(self.idle), size=self.size)
+
+
+def _close_quietly(smtp):
+    try:
+        smtp.quit()
+    except Exception:
+        try:
+            smtp.close()
+        except Exception:
+            pass
+
+
+# One pool per distinct settings in this process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(settings=None):
+    settings = settings or mail_settings()
+    with _pools_lock:
+        pool = _pools.get(settings)
+        if pool is None:
+            pool = _pools[settings] = SMTPPool(settings)
+        return pool
+
+
+def send_messages(messages):
+    """Send built messages over a pooled connection; returns an error (or None) per message"""
+    try:
+        return get_pool().send_batch(messages)
+    except Exception as e:
+        # No connection could be opened at all
+        return [e] * len(messages)
+
+
+def send_email(to_email, subject, body, subtype='plain'):
+    """Send one email through the pool, returning whether it was accepted"""
+    error = send_messages([build_message(to_email, subject, body, subtype)])[0]
+    if error is not None:
+        print(f"Error sending email to {to_email}: {str(error)}")
+        return False
+    return True
+
+
+def transport_stats():
+    """Connection counts and send totals for this process's SMTP pools"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {f'{pool.settings.server}:{pool.settings.port}': pool.snapshot() for pool in pools}
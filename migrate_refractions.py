@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Refraction data migration
+
+Optometrist prescriptions used to keep every sph/cyl/axis/prism/VA value and
+the IOP readings in separate string columns. This parses whatever is left in
+those columns into refraction_reading rows and the numeric IOP columns. The
+application runs it once on its first start after upgrading; run it by hand
+to re-check, and with --drop-legacy to remove the old columns once the
+migrated prescriptions have been verified.
+
+    python migrate_refractions.py [--drop-legacy]
+"""
+
+import argparse
+import sys
+from app import app
+from schema import migrate_legacy_refractions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parse legacy refraction strings into structured storage')
+    parser.add_argument('--drop-legacy', action='store_true', help='drop the legacy string columns afterwards')
+    args = parser.parse_args()
+
+    with app.app_context():
+        migrate_legacy_refractions(drop=args.drop_legacy)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,5 @@
+import json
+import re
 from datetime import datetime
 from app import db
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -5,7 +7,7 @@ from flask_login import UserMixin
 
 class Patient(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    full_name = db.Column(db.String(100), nullable=False)
+    full_name = db.Column(db.String(100), nullable=False, index=True)
     mobile_number = db.Column(db.String(15), nullable=False)
     email = db.Column(db.String(100), nullable=True)
     age = db.Column(db.Integer, nullable=False)
@@ -30,12 +32,23 @@ class Patient(UserMixin, db.Model):
     def is_active(self):
         return self.is_registered
 
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'full_name': self.full_name,
+            'mobile_number': self.mobile_number,
+            'email': self.email,
+            'age': self.age,
+            'sex': self.sex,
+            'is_registered': self.is_registered,
+        }
+
     def __repr__(self):
         return f'<Patient {self.full_name}>'
 
 class Appointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, index=True)
     appointment_date = db.Column(db.Date, nullable=False)
     appointment_time = db.Column(db.Time, nullable=False)
     primary_issue = db.Column(db.Text, nullable=True)
@@ -44,31 +57,62 @@ class Appointment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     consultation_fee = db.Column(db.Float, nullable=False, default=500.0)
     payment_status = db.Column(db.String(20), default='pending')  # pending, paid
+    # When the latest reminder went out; every offset due at or before it is done
+    reminder_sent_at = db.Column(db.DateTime, nullable=True)
+    # Last write, ORM or bulk UPDATE; incremental payment reconciliation starts from it
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    # Staff may book past a slot's capacity (walk-ins, reinstated bookings);
+    # checked by the reservation ledger in slots.py, not stored
+    allow_overbooking = False
+
+    # Indexes for the staff dashboards, slot availability and reminder lookups
+    __table_args__ = (
+        db.Index('ix_appointment_date_status_time', 'appointment_date', 'status', 'appointment_time'),
+        db.Index('ix_appointment_scheduled_date_time', 'appointment_date', 'appointment_time',
+                 postgresql_where=(status == 'scheduled'), sqlite_where=(status == 'scheduled')),
+        db.Index('ix_appointment_confirmed_date_time', 'appointment_date', 'appointment_time',
+                 postgresql_where=(status == 'confirmed'), sqlite_where=(status == 'confirmed')),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'patient_id': self.patient_id,
+            'patient_name': self.patient.full_name if self.patient else None,
+            'appointment_date': self.appointment_date.isoformat(),
+            'appointment_time': self.appointment_time.strftime('%H:%M'),
+            'primary_issue': self.primary_issue,
+            'status': self.status,
+            'payment_status': self.payment_status,
+        }
 
     def __repr__(self):
         return f'<Appointment {self.id} for Patient {self.patient_id}>'
 
 class MedicalRecord(db.Model):
+    # Narrative fields are deferred in groups and load on first access;
+    # detail pages undefer the groups they show (see MEDICAL_RECORD_GROUPS)
     id = db.Column(db.Integer, primary_key=True)
     appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False)
     appointment = db.relationship('Appointment', backref='medical_record', uselist=False)
 
     # Optometrist Review
-    left_eye_assessment = db.Column(db.Text, nullable=True)
-    right_eye_assessment = db.Column(db.Text, nullable=True)
+    left_eye_assessment = db.deferred(db.Column(db.Text, nullable=True), group='review')
+    right_eye_assessment = db.deferred(db.Column(db.Text, nullable=True), group='review')
 
     # Doctor Review
-    doctor_notes = db.Column(db.Text, nullable=True)
-    left_eye_findings = db.Column(db.Text, nullable=True)
-    right_eye_findings = db.Column(db.Text, nullable=True)
-    additional_remarks = db.Column(db.Text, nullable=True)
+    doctor_notes = db.deferred(db.Column(db.Text, nullable=True), group='review')
+    left_eye_findings = db.deferred(db.Column(db.Text, nullable=True), group='review')
+    right_eye_findings = db.deferred(db.Column(db.Text, nullable=True), group='review')
+    additional_remarks = db.deferred(db.Column(db.Text, nullable=True), group='review')
 
     # Prescription and Treatment
     diagnosis = db.Column(db.Text, nullable=True)
-    prescribed_medications = db.Column(db.Text, nullable=True)
-    prescribed_eyewear = db.Column(db.Text, nullable=True)
-    follow_up_instructions = db.Column(db.Text, nullable=True)
-    next_appointment_recommendation = db.Column(db.Text, nullable=True)
+    prescribed_medications = db.deferred(db.Column(db.Text, nullable=True), group='treatment')
+    prescribed_eyewear = db.deferred(db.Column(db.Text, nullable=True), group='treatment')
+    follow_up_instructions = db.deferred(db.Column(db.Text, nullable=True), group='treatment')
+    next_appointment_recommendation = db.deferred(db.Column(db.Text, nullable=True), group='treatment')
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -76,6 +120,9 @@ class MedicalRecord(db.Model):
     def __repr__(self):
         return f'<MedicalRecord {self.id} for Appointment {self.appointment_id}>'
 
+# Deferred column groups, all shown on the appointment and prescription pages
+MEDICAL_RECORD_GROUPS = ('review', 'treatment')
+
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False)
@@ -85,58 +132,82 @@ class Payment(db.Model):
     transaction_id = db.Column(db.String(100), nullable=True)
     upi_id = db.Column(db.String(100), nullable=True)
     status = db.Column(db.String(20), default='pending')  # pending, completed, failed
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    # One payment per appointment; a retried /payment request finds the first one
+    __table_args__ = (
+        db.Index('uq_payment_appointment_id', 'appointment_id', unique=True),
+    )
 
     def __repr__(self):
         return f'<Payment {self.id} for Appointment {self.appointment_id}>'
 
+class BookingRequest(db.Model):
+    """Idempotency key of a booking form submission and the appointment it created"""
+    __tablename__ = 'booking_request'
+
+    idempotency_key = db.Column(db.String(64), primary_key=True)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id', ondelete='CASCADE'), nullable=False)
+    appointment = db.relationship('Appointment', backref=db.backref('booking_requests', cascade='all, delete-orphan'))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<BookingRequest {self.idempotency_key} -> Appointment {self.appointment_id}>'
+
 class DoctorPrescription(db.Model):
+    # Lists load the headline columns (date, diagnosis, doctor); the narrative
+    # fields are deferred in groups (see DOCTOR_PRESCRIPTION_GROUPS)
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
     prescription_date = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Examination findings
-    left_eye_findings = db.Column(db.Text, nullable=True)
-    right_eye_findings = db.Column(db.Text, nullable=True)
+    left_eye_findings = db.deferred(db.Column(db.Text, nullable=True), group='examination')
+    right_eye_findings = db.deferred(db.Column(db.Text, nullable=True), group='examination')
     
     # Clinical information
     diagnosis = db.Column(db.Text, nullable=True)
-    complaints = db.Column(db.Text, nullable=True)
-    history = db.Column(db.Text, nullable=True)
-    examination_notes = db.Column(db.Text, nullable=True)
+    complaints = db.deferred(db.Column(db.Text, nullable=True), group='examination')
+    history = db.deferred(db.Column(db.Text, nullable=True), group='examination')
+    examination_notes = db.deferred(db.Column(db.Text, nullable=True), group='examination')
     
     # Investigation and tests
-    investigation = db.Column(db.Text, nullable=True)
-    fall_risk = db.Column(db.Text, nullable=True)
-    immunization = db.Column(db.Text, nullable=True)
+    investigation = db.deferred(db.Column(db.Text, nullable=True), group='examination')
+    fall_risk = db.deferred(db.Column(db.Text, nullable=True), group='examination')
+    immunization = db.deferred(db.Column(db.Text, nullable=True), group='examination')
     
     # Treatment plan
-    medications = db.Column(db.Text, nullable=True)
-    prescribed_eyewear = db.Column(db.Text, nullable=True)
-    prognosis = db.Column(db.Text, nullable=True)
-    nutritional_advice = db.Column(db.Text, nullable=True)
-    plan_of_care = db.Column(db.Text, nullable=True)
+    medications = db.deferred(db.Column(db.Text, nullable=True), group='summary')
+    prescribed_eyewear = db.deferred(db.Column(db.Text, nullable=True), group='care_plan')
+    prognosis = db.deferred(db.Column(db.Text, nullable=True), group='care_plan')
+    nutritional_advice = db.deferred(db.Column(db.Text, nullable=True), group='care_plan')
+    plan_of_care = db.deferred(db.Column(db.Text, nullable=True), group='care_plan')
     
     # Instructions and follow-up
-    instructions = db.Column(db.Text, nullable=True)
-    follow_up = db.Column(db.Text, nullable=True)
-    referral_reason = db.Column(db.Text, nullable=True)
-    referred_to_cc = db.Column(db.String(200), nullable=True)
+    instructions = db.deferred(db.Column(db.Text, nullable=True), group='summary')
+    follow_up = db.deferred(db.Column(db.Text, nullable=True), group='summary')
+    referral_reason = db.deferred(db.Column(db.Text, nullable=True), group='care_plan')
+    referred_to_cc = db.deferred(db.Column(db.String(200), nullable=True), group='care_plan')
     
     # Additional notes
-    comments = db.Column(db.Text, nullable=True)
-    remarks_for_counselor = db.Column(db.Text, nullable=True)
+    comments = db.deferred(db.Column(db.Text, nullable=True), group='care_plan')
+    remarks_for_counselor = db.deferred(db.Column(db.Text, nullable=True), group='care_plan')
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return f'<DoctorPrescription {self.id} for Patient {self.patient_id}>'
 
+# Deferred column groups: 'summary' is shown on prescription lists,
+# 'examination' on the combined print, all of them on the full print
+DOCTOR_PRESCRIPTION_GROUPS = ('summary', 'examination', 'care_plan')
+
 class OptometristPrescription(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
-    assistant_id = db.Column(db.Integer, db.ForeignKey('assistant.id'), nullable=False)
+    assistant_id = db.Column(db.Integer, db.ForeignKey('assistant.id'), nullable=False, index=True)
     prescription_date = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Primary Examination Details
@@ -157,77 +228,20 @@ class OptometristPrescription(db.Model):
     current_medication_eye = db.Column(db.String(20), nullable=True)
     current_medication_remarks = db.Column(db.Text, nullable=True)
     
-    # Undilated Acceptance - Right Eye
-    undilated_re_sph = db.Column(db.String(20), nullable=True)
-    undilated_re_cyl = db.Column(db.String(20), nullable=True)
-    undilated_re_axis = db.Column(db.String(20), nullable=True)
-    undilated_re_prism = db.Column(db.String(20), nullable=True)
-    undilated_re_va = db.Column(db.String(20), nullable=True)
-    undilated_re_nv = db.Column(db.String(20), nullable=True)
-    
-    # Undilated Acceptance - Left Eye
-    undilated_le_sph = db.Column(db.String(20), nullable=True)
-    undilated_le_cyl = db.Column(db.String(20), nullable=True)
-    undilated_le_axis = db.Column(db.String(20), nullable=True)
-    undilated_le_prism = db.Column(db.String(20), nullable=True)
-    undilated_le_va = db.Column(db.String(20), nullable=True)
-    undilated_le_nv = db.Column(db.String(20), nullable=True)
-    
-    # Dilated Acceptance - Right Eye
-    dilated_re_sph = db.Column(db.String(20), nullable=True)
-    dilated_re_cyl = db.Column(db.String(20), nullable=True)
-    dilated_re_axis = db.Column(db.String(20), nullable=True)
-    dilated_re_prism = db.Column(db.String(20), nullable=True)
-    dilated_re_va = db.Column(db.String(20), nullable=True)
-    dilated_re_nv = db.Column(db.String(20), nullable=True)
-    
-    # Dilated Acceptance - Left Eye
-    dilated_le_sph = db.Column(db.String(20), nullable=True)
-    dilated_le_cyl = db.Column(db.String(20), nullable=True)
-    dilated_le_axis = db.Column(db.String(20), nullable=True)
-    dilated_le_prism = db.Column(db.String(20), nullable=True)
-    dilated_le_va = db.Column(db.String(20), nullable=True)
-    dilated_le_nv = db.Column(db.String(20), nullable=True)
-    
+    # Refraction for each stage and eye is stored in RefractionReading rows
+    # (see the undilated_re_sph style properties defined below the class)
+
     # IOP Details
     iop_time = db.Column(db.String(20), nullable=True)
     iop_method = db.Column(db.String(50), nullable=True)
-    iop_od = db.Column(db.String(20), nullable=True)
-    iop_os = db.Column(db.String(20), nullable=True)
+    iop_od_mmhg = db.Column(db.Numeric(4, 1, asdecimal=False), nullable=True)
+    iop_os_mmhg = db.Column(db.Numeric(4, 1, asdecimal=False), nullable=True)
     iop_dl = db.Column(db.String(20), nullable=True)
-    iop_pachy = db.Column(db.String(20), nullable=True)
+    pachy_um = db.Column(db.Integer, nullable=True)
     iop_remarks = db.Column(db.Text, nullable=True)
-    
-    # Final Glasses - Right Eye
-    final_re_sph = db.Column(db.String(20), nullable=True)
-    final_re_cyl = db.Column(db.String(20), nullable=True)
-    final_re_axis = db.Column(db.String(20), nullable=True)
-    final_re_prism = db.Column(db.String(20), nullable=True)
-    final_re_va = db.Column(db.String(20), nullable=True)
-    final_re_nv = db.Column(db.String(20), nullable=True)
-    
-    # Final Glasses - Left Eye
-    final_le_sph = db.Column(db.String(20), nullable=True)
-    final_le_cyl = db.Column(db.String(20), nullable=True)
-    final_le_axis = db.Column(db.String(20), nullable=True)
-    final_le_prism = db.Column(db.String(20), nullable=True)
-    final_le_va = db.Column(db.String(20), nullable=True)
-    final_le_nv = db.Column(db.String(20), nullable=True)
-    
-    # Old Glasses - Distance
-    old_distance_re_sph = db.Column(db.String(20), nullable=True)
-    old_distance_re_cyl = db.Column(db.String(20), nullable=True)
-    old_distance_re_axis = db.Column(db.String(20), nullable=True)
-    old_distance_re_va = db.Column(db.String(20), nullable=True)
-    old_distance_le_sph = db.Column(db.String(20), nullable=True)
-    old_distance_le_cyl = db.Column(db.String(20), nullable=True)
-    old_distance_le_axis = db.Column(db.String(20), nullable=True)
-    old_distance_le_va = db.Column(db.String(20), nullable=True)
-    
-    # Old Glasses - Add
-    old_add_re = db.Column(db.String(20), nullable=True)
-    old_add_le = db.Column(db.String(20), nullable=True)
-    
+    # Original text of IOP entries that are not plain numbers, as JSON
+    iop_unparsed = db.Column(db.Text, nullable=True)
+
     # Glass Type and Usage
     type_of_glasses = db.Column(db.String(100), nullable=True)
     glass_usage = db.Column(db.String(100), nullable=True)
@@ -249,12 +263,179 @@ class OptometristPrescription(db.Model):
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    readings = db.relationship('RefractionReading', backref='prescription', cascade='all, delete-orphan')
+
+    def reading(self, stage, eye, create=False):
+        """The refraction for one stage and eye, optionally creating it"""
+        for reading in self.readings:
+            if reading.stage == stage and reading.eye == eye:
+                return reading
+        if create:
+            reading = RefractionReading(stage=stage, eye=eye)
+            self.readings.append(reading)
+            return reading
+        return None
+
+    def _iop_value(self, field):
+        value = getattr(self, IOP_FIELDS[field])
+        if value is None:
+            return json.loads(self.iop_unparsed or '{}').get(field)
+        return f'{value:g}'
+
+    def _set_iop_value(self, field, text):
+        unparsed = json.loads(self.iop_unparsed or '{}')
+        unparsed.pop(field, None)
+        value = None
+        if text is not None and str(text).strip():
+            try:
+                value = float(str(text).strip().upper().replace('MMHG', '').replace('UM', '').replace('µM', ''))
+            except ValueError:
+                unparsed[field] = str(text).strip()
+        if field == 'iop_pachy' and value is not None:
+            value = int(round(value))
+        setattr(self, IOP_FIELDS[field], value)
+        self.iop_unparsed = json.dumps(unparsed) if unparsed else None
+
+
+# Refraction stages and the values recorded for each eye at that stage
+REFRACTION_STAGES = {
+    'undilated': ('sph', 'cyl', 'axis', 'prism', 'va', 'nv'),
+    'dilated': ('sph', 'cyl', 'axis', 'prism', 'va', 'nv'),
+    'final': ('sph', 'cyl', 'axis', 'prism', 'va', 'nv'),
+    'old_distance': ('sph', 'cyl', 'axis', 'va', 'add'),
+}
+REFRACTION_EYES = ('re', 'le')
+
+# IOP entries and the numeric columns holding them
+IOP_FIELDS = {'iop_od': 'iop_od_mmhg', 'iop_os': 'iop_os_mmhg', 'iop_pachy': 'pachy_um'}
+
+_DIOPTRE_RE = re.compile(r'^([+-]?\d*\.?\d+)\s*(?:DS|DC|D)?$')
+_AXIS_RE = re.compile(r'^(\d{1,3})\s*°?$')
+_PRISM_RE = re.compile(r'^(\d*\.?\d+)\s*(?:Δ|PD)?\s*(BI|BO|BU|BD)?$')
+
+
+def _parse_dioptre(text):
+    text = text.upper().replace(' ', '')
+    if text in ('PL', 'PLANO', 'PLANE'):
+        return 0.0
+    match = _DIOPTRE_RE.match(text)
+    if not match or abs(float(match.group(1))) > 40:
+        raise ValueError(text)
+    return float(match.group(1))
+
+
+class RefractionReading(db.Model):
+    """One eye's refraction at one examination stage of an optometrist prescription"""
+    __tablename__ = 'refraction_reading'
+
+    id = db.Column(db.Integer, primary_key=True)
+    prescription_id = db.Column(db.Integer, db.ForeignKey('optometrist_prescription.id'), nullable=False, index=True)
+    stage = db.Column(db.String(12), nullable=False)  # undilated, dilated, final, old_distance
+    eye = db.Column(db.String(2), nullable=False)  # re, le
+    sph = db.Column(db.Numeric(5, 2, asdecimal=False), nullable=True)
+    cyl = db.Column(db.Numeric(5, 2, asdecimal=False), nullable=True)
+    axis = db.Column(db.SmallInteger, nullable=True)
+    prism = db.Column(db.Numeric(4, 2, asdecimal=False), nullable=True)
+    prism_base = db.Column(db.String(2), nullable=True)  # BI, BO, BU, BD
+    add_power = db.Column(db.Numeric(4, 2, asdecimal=False), nullable=True)
+    va = db.Column(db.String(12), nullable=True)
+    nv = db.Column(db.String(12), nullable=True)
+    # Original text of entries that are not valid numbers, as JSON
+    unparsed = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('prescription_id', 'stage', 'eye', name='uq_refraction_reading_stage_eye'),
+    )
+
+    def get_text(self, field):
+        """A value formatted for display, or None if not recorded"""
+        if field in ('sph', 'cyl', 'add'):
+            value = self.add_power if field == 'add' else getattr(self, field)
+            if value is not None:
+                return f'{value:+.2f}' if value else '0.00'
+        elif field == 'axis':
+            if self.axis is not None:
+                return str(self.axis)
+        elif field == 'prism':
+            if self.prism is not None:
+                return f'{self.prism:g} {self.prism_base or ""}'.strip()
+        else:
+            return getattr(self, field)
+        return json.loads(self.unparsed or '{}').get(field)
+
+    def set_text(self, field, text):
+        """Store a value entered as text, keeping the original if it is not numeric"""
+        unparsed = json.loads(self.unparsed or '{}')
+        unparsed.pop(field, None)
+        text = str(text).strip() if text is not None else ''
+
+        if field in ('va', 'nv'):
+            if len(text) > 12:
+                unparsed[field] = text
+                text = ''
+            setattr(self, field, text or None)
+        else:
+            values = {}
+            try:
+                if not text:
+                    values = {}
+                elif field in ('sph', 'cyl', 'add'):
+                    values = {'add_power' if field == 'add' else field: _parse_dioptre(text)}
+                elif field == 'axis':
+                    match = _AXIS_RE.match(text)
+                    if not match or int(match.group(1)) > 180:
+                        raise ValueError(text)
+                    values = {'axis': int(match.group(1))}
+                elif field == 'prism':
+                    match = _PRISM_RE.match(text.upper())
+                    if not match:
+                        raise ValueError(text)
+                    values = {'prism': float(match.group(1)), 'prism_base': match.group(2)}
+            except ValueError:
+                unparsed[field] = text
+            columns = {'add': ('add_power',), 'prism': ('prism', 'prism_base')}.get(field, (field,))
+            for column in columns:
+                setattr(self, column, values.get(column))
+
+        self.unparsed = json.dumps(unparsed) if unparsed else None
+
+    def __repr__(self):
+        return f'<RefractionReading {self.prescription_id} {self.stage} {self.eye}>'
+
+
+def _refraction_property(stage, eye, field):
+    def getter(self):
+        reading = self.reading(stage, eye)
+        return reading.get_text(field) if reading else None
+
+    def setter(self, text):
+        reading = self.reading(stage, eye, create=text not in (None, ''))
+        if reading:
+            reading.set_text(field, text)
+
+    return property(getter, setter)
+
+
+# Keep the flat attribute names used by forms and templates, e.g.
+# prescription.final_re_sph and prescription.old_add_le
+for _stage, _fields in REFRACTION_STAGES.items():
+    for _eye in REFRACTION_EYES:
+        for _field in _fields:
+            _name = f'old_add_{_eye}' if _field == 'add' else f'{_stage}_{_eye}_{_field}'
+            setattr(OptometristPrescription, _name, _refraction_property(_stage, _eye, _field))
+
+for _field in IOP_FIELDS:
+    setattr(OptometristPrescription, _field, property(
+        lambda self, field=_field: self._iop_value(field),
+        lambda self, text, field=_field: self._set_iop_value(field, text),
+    ))
+
 class Treatment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     patient = db.relationship('Patient', backref='treatments')
     treatment_name = db.Column(db.String(200), nullable=False)
-    treatment_date = db.Column(db.Date, nullable=False)
+    treatment_date = db.Column(db.Date, nullable=False, index=True)
     amount = db.Column(db.Float, nullable=False)
     notes = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -267,7 +448,22 @@ class Review(db.Model):
     rating = db.Column(db.Integer, nullable=False)
     review_text = db.Column(db.Text, nullable=False)
     is_approved = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Leading keyset sort key for the review lists, so it must never be NULL
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_review_approved_created', 'is_approved', 'created_at'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'patient_name': self.patient_name,
+            'rating': self.rating,
+            'review_text': self.review_text,
+            'is_approved': self.is_approved,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
 
     def __repr__(self):
         return f'<Review {self.id} by {self.patient_name}>'
@@ -330,6 +526,22 @@ class Salary(db.Model):
     description = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_salary_assistant_payment_date', 'assistant_id', 'payment_date'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'assistant_id': self.assistant_id,
+            'assistant_name': self.assistant.full_name if self.assistant else None,
+            'amount': self.amount,
+            'payment_date': self.payment_date.isoformat(),
+            'payment_method': self.payment_method,
+            'status': self.status,
+            'description': self.description,
+        }
+
     def __repr__(self):
         return f'<Salary {self.id} for Assistant {self.assistant_id}>'
 
@@ -354,6 +566,75 @@ class Admin(UserMixin, db.Model):
         return f'<Admin {self.username}>'
 
 
+class SalarySummary(db.Model):
+    """Per-assistant salary totals by month and by year, maintained as salaries are written"""
+    __tablename__ = 'salary_summary'
+
+    assistant_id = db.Column(db.Integer, db.ForeignKey('assistant.id'), primary_key=True)
+    period = db.Column(db.String(10), primary_key=True)  # month, year
+    period_start = db.Column(db.Date, primary_key=True)  # first day of the month or year
+    paid_amount = db.Column(db.Float, nullable=False, default=0.0)
+    paid_count = db.Column(db.Integer, nullable=False, default=0)
+    pending_amount = db.Column(db.Float, nullable=False, default=0.0)
+    pending_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Every assistant's row for one month or year
+        db.Index('ix_salary_summary_period_start', 'period', 'period_start'),
+    )
+
+    def __repr__(self):
+        return f'<SalarySummary {self.assistant_id} {self.period} {self.period_start}>'
+
+class DailyRevenue(db.Model):
+    """Per-day revenue totals maintained as payments and treatments are written"""
+    __tablename__ = 'daily_revenue'
+
+    day = db.Column(db.Date, primary_key=True)
+    appointment_revenue = db.Column(db.Float, nullable=False, default=0.0)
+    treatment_revenue = db.Column(db.Float, nullable=False, default=0.0)
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    treatment_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def total_revenue(self):
+        return self.appointment_revenue + self.treatment_revenue
+
+    def __repr__(self):
+        return f'<DailyRevenue {self.day}>'
+
+
+class SlotReservation(db.Model):
+    """Booked places per appointment slot, claimed atomically when booking"""
+    __tablename__ = 'slot_reservation'
+
+    slot_date = db.Column(db.Date, primary_key=True)
+    slot_time = db.Column(db.Time, primary_key=True)
+    capacity = db.Column(db.Integer, nullable=False, default=3)
+    booked = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SlotReservation {self.slot_date} {self.slot_time} {self.booked}/{self.capacity}>'
+
+
+class StatCounter(db.Model):
+    """Incrementally maintained totals read by the staff dashboards
+
+    Each total is split over several shard rows that are summed on read, so
+    concurrent writers rarely wait on the same row.
+    """
+    name = db.Column(db.String(64), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, default=0, autoincrement=False)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StatCounter {self.name}[{self.shard}]={self.value}>'
+
+
 class OTP(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(100), nullable=False, index=True)
@@ -362,8 +643,117 @@ class OTP(db.Model):
     expires_at = db.Column(db.DateTime, nullable=False)
     is_verified = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        # Latest unused code for an address; expiry drives the purge job
+        db.Index('ix_otp_email_verified_created', 'email', 'is_verified', 'created_at'),
+        db.Index('ix_otp_expires_at', 'expires_at'),
+    )
+
     def __repr__(self):
         return f'<OTP for {self.email}>'
 
     def is_expired(self):
-        return datetime.utcnow() > self.expires_at
\ No newline at end of file
+        return datetime.utcnow() > self.expires_at
+
+class EmailOutbox(db.Model):
+    """Emails written with the request's transaction and delivered by the outbox worker"""
+    __tablename__ = 'email_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    subtype = db.Column(db.String(10), nullable=False, default='plain')  # plain, html
+    # HTML alternative to a plain body; images it refers to by cid: are attached when sent
+    html_body = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # Due messages for the worker, oldest first
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return f'<EmailOutbox {self.id} to {self.to_email} ({self.status})>'
+
+class ReconciliationRun(db.Model):
+    """One pass of the payment reconciliation rules (see reconciliation.py)"""
+    __tablename__ = 'reconciliation_run'
+
+    id = db.Column(db.Integer, primary_key=True)
+    mode = db.Column(db.String(20), nullable=False)  # full, incremental
+    status = db.Column(db.String(20), nullable=False, default='requested')  # requested, running, completed, failed
+    # Incremental runs only look at payments and appointments written at or after this
+    since = db.Column(db.DateTime, nullable=True)
+    changed = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    requested_by = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    changes = db.relationship('ReconciliationChange', backref='run', lazy='dynamic', cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.Index('ix_reconciliation_run_status_started', 'status', 'started_at'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'mode': self.mode,
+            'status': self.status,
+            'since': self.since.isoformat() if self.since else None,
+            'changed': self.changed,
+            'error': self.error,
+            'requested_by': self.requested_by,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<ReconciliationRun {self.id} {self.mode} ({self.status})>'
+
+class ReconciliationChange(db.Model):
+    """A payment status the reconciliation changed, and the rule that changed it"""
+    __tablename__ = 'reconciliation_change'
+
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('reconciliation_run.id'), nullable=False, index=True)
+    payment_id = db.Column(db.Integer, nullable=False, index=True)
+    appointment_id = db.Column(db.Integer, nullable=False)
+    rule = db.Column(db.String(50), nullable=False)
+    old_status = db.Column(db.String(20), nullable=True)
+    new_status = db.Column(db.String(20), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'payment_id': self.payment_id,
+            'appointment_id': self.appointment_id,
+            'rule': self.rule,
+            'old_status': self.old_status,
+            'new_status': self.new_status,
+            'changed_at': self.changed_at.isoformat(),
+        }
+
+    def __repr__(self):
+        return f'<ReconciliationChange payment {self.payment_id} {self.old_status} -> {self.new_status}>'
+
+class JobLease(db.Model):
+    """Which process currently runs a background job (see leader.py)"""
+    __tablename__ = 'job_lease'
+
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(120), nullable=True)  # hostname:pid
+    acquired_at = db.Column(db.DateTime, nullable=True)
+    renewed_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<JobLease {self.name} held by {self.holder}>'
@@ -0,0 +1,161 @@
+"""
+Email notification templates
+
+Every email the application sends is a Jinja template pair in
+templates/email/: NAME.txt for the plain-text body (which also sets
+`subject`) and an optional NAME.html. Templates are compiled on first use
+and kept for the life of the process; auto_reload is off, so later renders
+do not stat the files again. The environment is separate from Flask's, so
+templates render outside a request (the reminder scheduler, the outbox
+worker) without an app context.
+
+Images are sent as CID attachments rather than inline base64. An HTML
+template refers to `cid:clinic_logo`, and each file listed in INLINE_ASSETS
+is read and base64-encoded once per process. The outbox stores only the
+text and HTML bodies; inline_images() attaches the cached parts when a
+message is built.
+"""
+
+import base64
+import os
+import re
+import threading
+from email.mime.nonmultipart import MIMENonMultipart
+from jinja2 import Environment, FileSystemLoader, TemplateNotFound, select_autoescape
+from mail_transport import build_message
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'email')
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# Content-ID -> file under static/
+INLINE_ASSETS = {
+    'clinic_logo': os.path.join('img', 'clinic_logo.jpg'),
+}
+
+# Values every template can use
+CLINIC = {
+    'clinic_name': "Dr. Richa's Eye Clinic",
+    'clinic_email': 'drrichaeyeclinic@gmail.com',
+    'clinic_phone': '+91 98765 43210',
+    'clinic_address_line': 'First floor, DVR Town Centre, near to IGUS private limited, '
+                           'Mandur, Budigere Road (New Airport Road), Bengaluru, Karnataka 560049',
+}
+
+_env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(['html']),
+    auto_reload=False,
+    cache_size=-1,
+    trim_blocks=True,
+    keep_trailing_newline=True,
+)
+_env.globals.update(CLINIC)
+
+# Content-ID -> (MIME subtype, base64 text), or None when the file is missing
+_assets = {}
+_assets_lock = threading.Lock()
+
+# Template name -> whether it has an HTML variant
+_has_html = {}
+
+_CID_PATTERN = re.compile(r'cid:([\w.-]+)')
+
+
+def _encoded_asset(cid):
+    with _assets_lock:
+        if cid not in _assets:
+            path = os.path.join(STATIC_DIR, INLINE_ASSETS[cid])
+            try:
+                with open(path, 'rb') as asset_file:
+                    data = asset_file.read()
+            except FileNotFoundError:
+                print(f"Email asset not found: {path}")
+                _assets[cid] = None
+            else:
+                subtype = os.path.splitext(path)[1].lstrip('.').lower().replace('jpg', 'jpeg')
+                _assets[cid] = (subtype, base64.encodebytes(data).decode('ascii'))
+        return _assets[cid]
+
+
+def asset_available(cid):
+    return cid in INLINE_ASSETS and _encoded_asset(cid) is not None
+
+
+def inline_images(html):
+    """MIME parts for the cid: images an HTML body refers to, from the encoded cache"""
+    parts = []
+    if not html:
+        return parts
+    for cid in dict.fromkeys(_CID_PATTERN.findall(html)):
+        asset = _encoded_asset(cid) if cid in INLINE_ASSETS else None
+        if asset is None:
+            continue
+        subtype, encoded = asset
+        # Reuse the encoded text; only the small headers are built per message
+        part = MIMENonMultipart('image', subtype)
+        part.set_payload(encoded)
+        part['Content-Transfer-Encoding'] = 'base64'
+        part['Content-ID'] = f'<{cid}>'
+        part['Content-Disposition'] = f'inline; filename="{os.path.basename(INLINE_ASSETS[cid])}"'
+        parts.append(part)
+    return parts
+
+
+def _html_template(name):
+    if name not in _has_html:
+        try:
+            _env.get_template(f'{name}.html')
+            _has_html[name] = True
+        except TemplateNotFound:
+            _has_html[name] = False
+    return _env.get_template(f'{name}.html') if _has_html[name] else None
+
+
+def render(template_name, **context):
+    """Subject, plain-text body and HTML body (or None) of a notification"""
+    module = _env.get_template(f'{template_name}.txt').make_module(context)
+    subject = ' '.join(str(module.subject).split())
+    text = str(module).strip() + '\n'
+
+    html = None
+    html_template = _html_template(template_name)
+    if html_template is not None:
+        context.setdefault('logo_cid', 'clinic_logo' if asset_available('clinic_logo') else None)
+        html = html_template.render(context)
+    return subject, text, html
+
+
+def queue_notification(to_email, template_name, **context):
+    """Render a notification and add it to the outbox with the current transaction"""
+    from outbox import queue_email
+
+    subject, text, html = render(template_name, **context)
+    return queue_email(to_email, subject, text, html=html)
+
+
+def queue_notifications(notifications):
+    """Render notifications and add them all to the outbox in one batched INSERT
+
+    `notifications` holds (to_email, template_name, context) tuples.
+    """
+    from outbox import queue_emails
+
+    emails = []
+    for to_email, template_name, context in notifications:
+        subject, text, html = render(template_name, **context)
+        emails.append((to_email, subject, text, html))
+    return queue_emails(emails)
+
+
+def build_notification(to_email, template_name, **context):
+    """Render a notification as a message ready for send_messages()"""
+    subject, text, html = render(template_name, **context)
+    return build_message(to_email, subject, text, html=html, images=inline_images(html))
+
+
+def precompile():
+    """Compile every email template now rather than on first use"""
+    names = _env.list_templates(extensions=['txt', 'html'])
+    for template_name in names:
+        _env.get_template(template_name)
+    return len(names)
@@ -0,0 +1,31 @@
+"""
+Previous attribute values for ORM event handlers
+
+Derived tables (dashboard counters, slot reservations, daily revenue, salary
+summaries) are kept up to date by after_update handlers that take the old
+contribution out and put the new one in. The old value is only in the
+attribute history when it was loaded before being overwritten, which is
+not the case on an expired instance (after a commit, say). track_previous()
+turns on active history for the attributes a handler reads, so the old value
+is loaded on assignment, and previous() reads it back during the flush.
+"""
+
+from sqlalchemy import event, inspect
+
+
+def _keep_value(target, value, oldvalue, initiator):
+    return value
+
+
+def track_previous(*attributes):
+    """Load the old value of each attribute when it is overwritten, even on expired instances"""
+    for attribute in attributes:
+        event.listen(attribute, 'set', _keep_value, active_history=True)
+
+
+def previous(target, attribute):
+    """Value of an attribute before the pending flush"""
+    history = inspect(target).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(target, attribute)
@@ -0,0 +1,294 @@
+"""
+One-time password storage
+
+Registration and Gmail login email a six-digit code that is checked on the
+next page. Codes live in one of three stores, chosen with OTP_STORE:
+
+    sql      the otp table (default). Lookups use the composite
+             (email, is_verified, created_at) index and a background job
+             deletes used and expired rows every OTP_PURGE_INTERVAL seconds,
+             so verification cost does not grow with history.
+    memory   a dict in this process with per-code expiry. Only suitable for
+             a single worker; codes are lost on restart.
+    redis    any server speaking the Redis protocol with Lua scripting
+             (Redis, Valkey, KeyDB), at OTP_REDIS_URL or REDIS_URL. Keys
+             expire on their own.
+
+Only the latest code sent to an address is valid, and a code can be used
+once. Codes expire after OTP_TTL_MINUTES (default 30).
+"""
+
+import hmac
+import os
+import random
+import socket
+import string
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+from sqlalchemy import desc, or_
+from app import db
+from models import OTP
+
+OTP_TTL_MINUTES = int(os.environ.get('OTP_TTL_MINUTES', 30))
+OTP_PURGE_INTERVAL = int(os.environ.get('OTP_PURGE_INTERVAL', 600))
+
+# Outcomes of checking a code
+OTP_VALID = 'valid'
+OTP_INVALID = 'invalid'
+OTP_EXPIRED = 'expired'
+OTP_MISSING = 'missing'
+
+
+def generate_code():
+    return ''.join(random.choices(string.digits, k=6))
+
+
+def _matches(stored, submitted):
+    return hmac.compare_digest(str(stored), str(submitted or ''))
+
+
+class SqlOTPStore:
+    """Codes in the otp table"""
+
+    def issue(self, email, code, ttl):
+        db.session.add(OTP(email=email, otp_code=code, expires_at=datetime.utcnow() + ttl))
+        db.session.commit()
+
+    def check(self, email, code):
+        # Served by ix_otp_email_verified_created: one index probe per check
+        otp_record = OTP.query.filter_by(
+            email=email,
+            is_verified=False
+        ).order_by(desc(OTP.created_at)).first()
+
+        if not otp_record:
+            return OTP_MISSING
+        if otp_record.is_expired():
+            return OTP_EXPIRED
+        if not _matches(otp_record.otp_code, code):
+            return OTP_INVALID
+
+        # Only the request whose UPDATE marks the code used may use it
+        consumed = OTP.query.filter_by(id=otp_record.id, is_verified=False).update(
+            {'is_verified': True}, synchronize_session=False
+        )
+        if consumed != 1:
+            db.session.rollback()
+            return OTP_MISSING
+
+        # Earlier unused codes for the address go with it
+        OTP.query.filter_by(email=email, is_verified=False).update({'is_verified': True}, synchronize_session=False)
+        db.session.commit()
+        return OTP_VALID
+
+    def purge(self):
+        """Delete used and expired codes"""
+        deleted = OTP.query.filter(
+            or_(OTP.is_verified.is_(True), OTP.expires_at < datetime.utcnow())
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+
+class MemoryOTPStore:
+    """Codes in a per-process dict"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # email -> (code, expires_at as time.monotonic())
+        self.codes = {}
+
+    def issue(self, email, code, ttl):
+        with self.lock:
+            self.codes[email] = (code, time.monotonic() + ttl.total_seconds())
+
+    def check(self, email, code):
+        with self.lock:
+            entry = self.codes.get(email)
+            if entry is None:
+                return OTP_MISSING
+            if time.monotonic() > entry[1]:
+                del self.codes[email]
+                return OTP_EXPIRED
+            if not _matches(entry[0], code):
+                return OTP_INVALID
+            del self.codes[email]
+            return OTP_VALID
+
+    def purge(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [email for email, (_, expires_at) in self.codes.items() if now > expires_at]
+            for email in expired:
+                del self.codes[email]
+        return len(expired)
+
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+
+class RespClient:
+    """Minimal Redis protocol (RESP2) client over one socket"""
+
+    def __init__(self, url, timeout=5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.database = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sock = None
+        self.reader = None
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.reader = self.sock.makefile('rb')
+        if self.password:
+            self._call('AUTH', self.password)
+        if self.database:
+            self._call('SELECT', self.database)
+
+    def _close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.reader = None
+
+    def _call(self, *args):
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            data = str(arg).encode('utf-8')
+            parts.append(f'${len(data)}\r\n'.encode() + data + b'\r\n')
+        self.sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by server')
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b'+':
+            return payload.decode()
+        if prefix == b'-':
+            raise RespError(payload.decode())
+        if prefix == b':':
+            return int(payload)
+        if prefix == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            return self.reader.read(length + 2)[:-2].decode('utf-8')
+        if prefix == b'*':
+            count = int(payload)
+            return None if count < 0 else [self._read_reply() for _ in range(count)]
+        raise ConnectionError(f'Unexpected reply from server: {line!r}')
+
+    def execute(self, *args):
+        """Run one command, reconnecting once if the connection was dropped"""
+        with self.lock:
+            for attempt in (1, 2):
+                try:
+                    if self.sock is None:
+                        self._connect()
+                    return self._call(*args)
+                except (ConnectionError, OSError):
+                    self._close()
+                    if attempt == 2:
+                        raise
+
+
+class RedisOTPStore:
+    """Codes as expiring keys on a Redis-protocol server"""
+
+    KEY_PREFIX = 'otp:'
+
+    # Compare and delete in one step on the server: a code issued between a
+    # separate GET and DEL would otherwise be deleted while the old one is
+    # accepted. A wrong guess leaves the key alone.
+    CHECK_SCRIPT = """
+local stored = redis.call('GET', KEYS[1])
+if not stored then return 0 end
+if stored ~= ARGV[1] then return -1 end
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+    def __init__(self, url):
+        self.client = RespClient(url)
+
+    def issue(self, email, code, ttl):
+        self.client.execute('SET', self.KEY_PREFIX + email, code, 'PX', int(ttl.total_seconds() * 1000))
+
+    def check(self, email, code):
+        outcome = self.client.execute('EVAL', self.CHECK_SCRIPT, 1, self.KEY_PREFIX + email, str(code or ''))
+        if outcome == 1:
+            return OTP_VALID
+        if outcome == -1:
+            return OTP_INVALID
+        # The server drops the key once it expires
+        return OTP_MISSING
+
+    def purge(self):
+        return 0
+
+
+def _create_store():
+    backend = os.environ.get('OTP_STORE', 'sql').lower()
+    if backend == 'memory':
+        return MemoryOTPStore()
+    if backend == 'redis':
+        url = os.environ.get('OTP_REDIS_URL') or os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+        return RedisOTPStore(url)
+    return SqlOTPStore()
+
+
+otp_store = _create_store()
+
+
+def issue_otp(email):
+    """Create and store a new code for an email address, replacing earlier ones"""
+    code = generate_code()
+    otp_store.issue(email, code, timedelta(minutes=OTP_TTL_MINUTES))
+    return code
+
+
+def check_otp(email, code):
+    """OTP_VALID and consume the code, or why it was rejected"""
+    return otp_store.check(email, code)
+
+
+def purge_expired_otps():
+    """Remove used and expired codes from the store"""
+    deleted = otp_store.purge()
+    if deleted:
+        print(f"Purged {deleted} used or expired OTP codes")
+    return deleted
+
+
+def start_otp_purge(app):
+    """Purge used and expired codes every OTP_PURGE_INTERVAL seconds"""
+    lease = None
+    if isinstance(otp_store, SqlOTPStore):
+        # The table is shared, so one worker purging it is enough
+        from leader import LeaderLease
+        lease = LeaderLease(app, 'otp_purge')
+        lease.start()
+
+    def purge_loop():
+        while True:
+            time.sleep(OTP_PURGE_INTERVAL)
+            if lease is not None and not lease.is_leader():
+                continue
+            try:
+                with app.app_context():
+                    purge_expired_otps()
+            except Exception as e:
+                print(f"Error purging OTP codes: {str(e)}")
+
+    purge_thread = threading.Thread(target=purge_loop, daemon=True)
+    purge_thread.start()
+    print("OTP purge job started")
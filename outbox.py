@@ -0,0 +1,191 @@
+"""
+Transactional email outbox
+
+Request handlers call queue_email(), which adds an email_outbox row to the
+current session. The row is committed (or rolled back) with the rest of the
+request's changes, so a booking that fails sends nothing and a committed
+one is never left without its email. The request itself never talks to the
+mail server.
+
+A background worker drains due rows in batches of OUTBOX_BATCH_SIZE over one
+pooled SMTP connection (see mail_transport.py). It wakes as soon as a commit
+queues mail, and otherwise polls every OUTBOX_POLL_INTERVAL seconds. A failed send is retried with
+exponential backoff (OUTBOX_BACKOFF_BASE seconds, doubling, at most
+OUTBOX_BACKOFF_MAX) and given up as 'failed' after OUTBOX_MAX_ATTEMPTS.
+Every worker process runs the loop, so a message is claimed before it is
+sent: a conditional UPDATE sets it to 'sending' only if it is still due,
+and only rows whose UPDATE changed them go out. The claims commit before
+the SMTP conversation, so no transaction is held open while mail is sent.
+A claim lasts OUTBOX_CLAIM_TIMEOUT seconds; if the worker dies mid-send the
+row becomes due again after that. On PostgreSQL the candidate SELECT also
+uses FOR UPDATE SKIP LOCKED so workers pick different rows.
+
+Mail goes out through MAIL_SERVER/MAIL_PORT. The transport skips STARTTLS
+when MAIL_USE_TLS is false and login when MAIL_PASSWORD is empty, so a local
+SMTP stand-in (for example `python -m aiosmtpd -n -l localhost:1025`) can receive
+everything during development.
+"""
+
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import and_, event, insert
+from app import db
+from mail_transport import build_message, send_messages
+from models import EmailOutbox
+from notifications import inline_images
+
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 20))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 5))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 6))
+OUTBOX_BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE', 30))
+OUTBOX_BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX', 3600))
+OUTBOX_CLAIM_TIMEOUT = float(os.environ.get('OUTBOX_CLAIM_TIMEOUT', 300))
+
+# Set when a commit queues mail so the worker does not wait for its next poll
+_wake = threading.Event()
+
+
+def queue_email(to_email, subject, body, subtype='plain', html=None):
+    """Add an email to the outbox; it is sent after the current transaction commits"""
+    if not to_email:
+        return None
+    message = EmailOutbox(to_email=to_email, subject=subject, body=body, subtype=subtype, html_body=html)
+    db.session.add(message)
+    db.session.info['outbox_queued'] = True
+    return message
+
+
+def queue_emails(emails):
+    """Add several (to_email, subject, body, html) emails to the outbox in one batched INSERT"""
+    rows = [
+        {'to_email': to_email, 'subject': subject, 'body': body, 'subtype': 'plain', 'html_body': html}
+        for to_email, subject, body, html in emails
+        if to_email
+    ]
+    if rows:
+        db.session.execute(insert(EmailOutbox), rows)
+        db.session.info['outbox_queued'] = True
+    return len(rows)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_after_commit(session):
+    if session.info.pop('outbox_queued', False):
+        _wake.set()
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_after_rollback(session, previous_transaction):
+    session.info.pop('outbox_queued', None)
+
+
+def backoff_delay(attempts):
+    """Seconds to wait before the next try after `attempts` failures"""
+    delay = min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+    # Jitter keeps messages that failed together from retrying in lockstep
+    return delay * random.uniform(0.9, 1.1)
+
+
+def _due(now):
+    """Pending messages whose time has come, and claims abandoned by a dead worker"""
+    return and_(
+        EmailOutbox.status.in_(('pending', 'sending')),
+        EmailOutbox.next_attempt_at <= now,
+    )
+
+
+def _claim_due_messages(batch_size):
+    """Claim up to `batch_size` due messages for this worker and commit the claims"""
+    now = datetime.utcnow()
+    query = (
+        db.session.query(EmailOutbox.id)
+        .filter(_due(now))
+        .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+        .limit(batch_size)
+    )
+    if db.engine.dialect.name == 'postgresql':
+        # Rows another worker is claiming are skipped rather than waited on
+        query = query.with_for_update(skip_locked=True)
+    candidates = [row.id for row in query.all()]
+
+    claimed = []
+    for message_id in candidates:
+        # Only the worker whose UPDATE changes the row sends it
+        if EmailOutbox.query.filter(EmailOutbox.id == message_id, _due(now)).update(
+            {EmailOutbox.status: 'sending',
+             EmailOutbox.next_attempt_at: now + timedelta(seconds=OUTBOX_CLAIM_TIMEOUT)},
+            synchronize_session=False
+        ) == 1:
+            claimed.append(message_id)
+    db.session.commit()
+
+    if not claimed:
+        return []
+    return EmailOutbox.query.filter(EmailOutbox.id.in_(claimed)).order_by(EmailOutbox.id).all()
+
+
+def deliver_pending(batch_size=OUTBOX_BATCH_SIZE):
+    """Send one batch of due messages; returns (sent, failed) counts"""
+    messages = _claim_due_messages(batch_size)
+    if not messages:
+        return 0, 0
+
+    # One pooled connection for the whole batch
+    errors = send_messages([
+        build_message(message.to_email, message.subject, message.body, message.subtype,
+                      html=message.html_body, images=inline_images(message.html_body))
+        for message in messages
+    ])
+    sent = failed = 0
+
+    for message, error in zip(messages, errors):
+        if error is None:
+            message.status = 'sent'
+            message.sent_at = datetime.utcnow()
+            message.last_error = None
+            sent += 1
+            continue
+
+        failed += 1
+        message.attempts += 1
+        message.last_error = str(error)[:1000]
+        if message.attempts >= OUTBOX_MAX_ATTEMPTS:
+            message.status = 'failed'
+            print(f"Giving up on email {message.id} to {message.to_email}: {str(error)}")
+        else:
+            message.status = 'pending'
+            message.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff_delay(message.attempts))
+            print(f"Email {message.id} to {message.to_email} failed (attempt {message.attempts}): {str(error)}")
+
+    db.session.commit()
+    return sent, failed
+
+
+def drain_outbox():
+    """Send batches until nothing is due; returns (sent, failed) counts"""
+    total_sent = total_failed = 0
+    while True:
+        sent, failed = deliver_pending()
+        total_sent += sent
+        total_failed += failed
+        if sent + failed < OUTBOX_BATCH_SIZE:
+            return total_sent, total_failed
+
+
+def start_outbox_worker(app):
+    """Deliver queued email in a background thread"""
+    def outbox_loop():
+        while True:
+            _wake.wait(OUTBOX_POLL_INTERVAL)
+            _wake.clear()
+            try:
+                with app.app_context():
+                    drain_outbox()
+            except Exception as e:
+                print(f"Error in email outbox worker: {str(e)}")
+
+    outbox_thread = threading.Thread(target=outbox_loop, daemon=True)
+    outbox_thread.start()
+    print("Email outbox worker started")
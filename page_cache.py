@@ -0,0 +1,264 @@
+"""
+Public page cache
+
+The home, services, location and reviews pages are the same for every
+visitor apart from the CSRF token in the review form, yet each request
+renders its template from scratch, and the home and reviews pages query
+the reviews table. Views wrapped in @cached_page store their rendered HTML
+in a cache chosen with PAGE_CACHE:
+
+    memory   an LRU of at most PAGE_CACHE_SIZE pages in this process
+             (default). Invalidation reaches only this worker; other
+             workers serve their copy until it expires.
+    redis    any server speaking the Redis protocol, at PAGE_CACHE_REDIS_URL
+             or REDIS_URL, shared by every worker
+    none     caching off
+
+Entries live for PAGE_CACHE_TTL seconds. Keys are the endpoint plus whether
+the visitor is logged in, so a page that starts to differ for signed-in
+users never leaks across.
+
+Only plain GET/HEAD requests without a query string are served from the
+cache. Requests with flash messages waiting are rendered normally, because
+the layout shows them. Only 200 HTML responses are stored. The request's
+CSRF token is swapped for a placeholder before a page is stored, and a hit
+gets a freshly issued token stitched back in, so cached forms still
+validate.
+
+Writes that change what the pages show call invalidate_pages() with the
+tag the pages are registered under: review submission, approval and
+deletion drop every page tagged 'reviews'. page_cache_stats() reports this
+worker's hits, misses and bypasses.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, g, make_response, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+from otp_store import RespClient
+
+PAGE_CACHE_TTL = float(os.environ.get('PAGE_CACHE_TTL', 300))
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 128))
+
+KEY_PREFIX = 'page:'
+CSRF_PLACEHOLDER = '__page_cache_csrf_token__'
+VISITOR_STATES = ('anonymous', 'authenticated')
+
+# tag -> endpoints whose cached pages depend on it
+_tagged_endpoints = {}
+
+
+class _CacheStats:
+    """Hit and miss counts for this worker's page cache"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.stores = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'bypasses': self.bypasses,
+                'stores': self.stores,
+                'invalidations': self.invalidations,
+                'errors': self.errors,
+            }
+
+
+cache_stats = _CacheStats()
+
+
+class MemoryPageCache:
+    """Least recently used pages in this process, each with an expiry"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, body = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return body
+
+    def set(self, key, body, ttl):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, body)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def size(self):
+        with self.lock:
+            return len(self.entries)
+
+
+class RedisPageCache:
+    """Pages as expiring keys on a Redis-protocol server shared by all workers"""
+
+    name = 'redis'
+
+    def __init__(self, url):
+        self.client = RespClient(url)
+
+    def get(self, key):
+        return self.client.execute('GET', key)
+
+    def set(self, key, body, ttl):
+        self.client.execute('SET', key, body, 'PX', int(ttl * 1000))
+
+    def delete(self, keys):
+        if keys:
+            self.client.execute('DEL', *keys)
+
+    def size(self):
+        return None
+
+
+def _create_cache():
+    backend = os.environ.get('PAGE_CACHE', 'memory').lower()
+    if backend == 'none' or PAGE_CACHE_TTL <= 0:
+        return None
+    if backend == 'redis':
+        url = os.environ.get('PAGE_CACHE_REDIS_URL') or os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+        return RedisPageCache(url)
+    return MemoryPageCache(PAGE_CACHE_SIZE)
+
+
+page_cache = _create_cache()
+
+
+def page_key(endpoint, state):
+    return f'{KEY_PREFIX}{endpoint}:{state}'
+
+
+def _visitor_state():
+    return 'authenticated' if current_user.is_authenticated else 'anonymous'
+
+
+def _cacheable_request():
+    return (
+        page_cache is not None
+        and request.method in ('GET', 'HEAD')
+        and not request.query_string
+        and '_flashes' not in session
+    )
+
+
+def _csrf_field():
+    return current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token')
+
+
+def _cached_response(body):
+    if CSRF_PLACEHOLDER in body:
+        body = body.replace(CSRF_PLACEHOLDER, generate_csrf())
+    response = make_response(body)
+    response.headers['X-Page-Cache'] = 'HIT'
+    return response
+
+
+def _store(key, response):
+    body = response.get_data(as_text=True)
+    # The token belongs to this visitor; a hit gets its own
+    token = g.get(_csrf_field())
+    if token:
+        body = body.replace(token, CSRF_PLACEHOLDER)
+    page_cache.set(key, body, PAGE_CACHE_TTL)
+    cache_stats.count('stores')
+
+
+def cached_page(*tags):
+    """Serve a public view from the page cache; `tags` name what invalidates it"""
+    def decorator(view):
+        for tag in tags:
+            _tagged_endpoints.setdefault(tag, set()).add(view.__name__)
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not _cacheable_request():
+                if page_cache is not None:
+                    cache_stats.count('bypasses')
+                return view(*args, **kwargs)
+
+            key = page_key(request.endpoint, _visitor_state())
+            try:
+                body = page_cache.get(key)
+            except Exception as e:
+                print(f"Page cache read failed: {str(e)}")
+                cache_stats.count('errors')
+                body = None
+            if body is not None:
+                cache_stats.count('hits')
+                return _cached_response(body)
+
+            cache_stats.count('misses')
+            response = make_response(view(*args, **kwargs))
+            response.headers['X-Page-Cache'] = 'MISS'
+            if response.status_code == 200 and response.mimetype == 'text/html' and not response.direct_passthrough:
+                try:
+                    _store(key, response)
+                except Exception as e:
+                    print(f"Page cache write failed: {str(e)}")
+                    cache_stats.count('errors')
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate_pages(*tags):
+    """Drop the cached pages registered under any of `tags`"""
+    if page_cache is None:
+        return 0
+    endpoints = set()
+    for tag in tags:
+        endpoints.update(_tagged_endpoints.get(tag, ()))
+    keys = [page_key(endpoint, state) for endpoint in sorted(endpoints) for state in VISITOR_STATES]
+    try:
+        page_cache.delete(keys)
+    except Exception as e:
+        print(f"Page cache invalidation failed: {str(e)}")
+        cache_stats.count('errors')
+        return 0
+    cache_stats.count('invalidations')
+    return len(keys)
+
+
+def page_cache_stats():
+    """Backend, entry count and hit rate of the page cache for this worker"""
+    stats = cache_stats.snapshot()
+    stats['backend'] = page_cache.name if page_cache is not None else 'none'
+    stats['ttl'] = PAGE_CACHE_TTL
+    stats['entries'] = page_cache.size() if page_cache is not None else 0
+    stats['tags'] = {tag: sorted(endpoints) for tag, endpoints in _tagged_endpoints.items()}
+    return stats
@@ -0,0 +1,195 @@
+"""
+Keyset (cursor) pagination for staff list pages
+
+Pages are fetched with a WHERE clause on the sort keys of the last row seen
+instead of OFFSET, so every page costs the same regardless of depth and rows
+inserted while a user is paging never shift or duplicate entries. Each sort
+must end with a unique column (normally the primary key) so the key of a row
+identifies exactly one position.
+
+Cursors are opaque url-safe strings. HTML views get next/prev links through
+page.next_url and page.prev_url; JSON callers get next_cursor/prev_cursor.
+"""
+
+import base64
+import json
+from datetime import date, datetime, time
+from flask import request, url_for
+from sqlalchemy import and_, or_
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor cannot be decoded for the given sort keys"""
+
+
+def encode_cursor(values):
+    """Encode a row's sort key values as an opaque cursor string"""
+    payload = [value.isoformat() if isinstance(value, (date, time, datetime)) else value for value in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, order_by):
+    """Decode a cursor back into typed values for the given sort keys"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f'Malformed cursor: {e}')
+
+    if not isinstance(payload, list) or len(payload) != len(order_by):
+        raise InvalidCursor('Cursor does not match the sort order')
+
+    values = []
+    for value, (column, _) in zip(payload, order_by):
+        if value is None:
+            values.append(None)
+            continue
+        python_type = column.type.python_type
+        try:
+            if python_type in (date, time, datetime):
+                values.append(python_type.fromisoformat(value))
+            else:
+                values.append(python_type(value))
+        except (ValueError, TypeError) as e:
+            raise InvalidCursor(f'Bad cursor value for {column.key}: {e}')
+    return values
+
+
+def _seek_condition(order_by, values, forward):
+    """Build the WHERE clause selecting rows after (or before) the given key
+
+    For keys (k1, k2, k3) this expands to
+        k1 > v1 OR (k1 = v1 AND k2 > v2) OR (k1 = v1 AND k2 = v2 AND k3 > v3)
+    with > and < swapped per column direction, which works for mixed
+    ascending/descending sorts where a row-value comparison would not.
+    """
+    clauses = []
+    for i, (column, direction) in enumerate(order_by):
+        ascending = (direction == 'asc') == forward
+        comparison = column > values[i] if ascending else column < values[i]
+        equal_prefix = [order_by[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*equal_prefix, comparison))
+    return or_(*clauses)
+
+
+def _order_clauses(order_by, forward):
+    """ORDER BY clauses for the sort keys, reversed when paging backwards"""
+    clauses = []
+    for column, direction in order_by:
+        ascending = (direction == 'asc') == forward
+        clauses.append(column.asc() if ascending else column.desc())
+    return clauses
+
+
+class KeysetPage:
+    """One page of results with cursors for the neighbouring pages"""
+
+    def __init__(self, items, order_by, per_page, has_next, has_prev):
+        self.items = items
+        self.order_by = order_by
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_url = None
+        self.prev_url = None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _key(self, item):
+        return [getattr(item, column.key) for column, _ in self.order_by]
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.items:
+            return None
+        return encode_cursor(self._key(self.items[-1]))
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev or not self.items:
+            return None
+        return encode_cursor(self._key(self.items[0]))
+
+    def to_dict(self, serialize=None):
+        """JSON-ready representation, using item.to_dict() unless `serialize` is given"""
+        serialize = serialize or (lambda item: item.to_dict())
+        return {
+            'items': [serialize(item) for item in self.items],
+            'per_page': self.per_page,
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+        }
+
+
+def paginate(query, order_by, after=None, before=None, per_page=DEFAULT_PER_PAGE):
+    """Fetch one page of `query` sorted by `order_by`
+
+    order_by is a list of (column, 'asc' | 'desc') pairs ending with a unique
+    column. Pass `after` to fetch the page following a cursor or `before` to
+    fetch the page preceding it; with neither the first page is returned.
+    """
+    per_page = max(1, min(int(per_page), MAX_PER_PAGE))
+    forward = before is None
+
+    cursor = after if forward else before
+    if cursor:
+        query = query.filter(_seek_condition(order_by, decode_cursor(cursor, order_by), forward))
+
+    rows = query.order_by(*_order_clauses(order_by, forward)).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if forward:
+        return KeysetPage(rows, order_by, per_page, has_next=has_more, has_prev=bool(after))
+
+    rows.reverse()
+    return KeysetPage(rows, order_by, per_page, has_next=True, has_prev=has_more)
+
+
+def paginate_request(query, order_by, prefix='', link_args=None):
+    """Paginate using the cursor and page size in the current request
+
+    Reads `<prefix>after`, `<prefix>before` and `per_page` from the query
+    string and fills in next_url/prev_url for the current endpoint. The
+    prefix lets one page carry several independent lists. `link_args` are
+    added to the next/prev links (e.g. which tab to open). An invalid cursor
+    falls back to the first page.
+    """
+    try:
+        per_page = int(request.args.get('per_page', DEFAULT_PER_PAGE))
+    except ValueError:
+        per_page = DEFAULT_PER_PAGE
+
+    after = request.args.get(f'{prefix}after')
+    before = request.args.get(f'{prefix}before')
+    try:
+        page = paginate(query, order_by, after=after, before=before, per_page=per_page)
+    except InvalidCursor:
+        page = paginate(query, order_by, per_page=per_page)
+
+    def page_url(**cursor_args):
+        args = request.args.to_dict()
+        args.pop(f'{prefix}after', None)
+        args.pop(f'{prefix}before', None)
+        args.update(link_args or {})
+        args.update(cursor_args)
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    if page.next_cursor:
+        page.next_url = page_url(**{f'{prefix}after': page.next_cursor})
+    if page.prev_cursor:
+        page.prev_url = page_url(**{f'{prefix}before': page.prev_cursor})
+    return page
+
+
+def wants_json():
+    """Whether the current request asked for the JSON variant of a listing"""
+    return request.args.get('format') == 'json'
@@ -0,0 +1,235 @@
+"""
+Assistant payroll
+
+The salary ledger is read one page at a time with the assistant joined in
+the same query (salary_ledger_page). Totals come from the salary_summary
+table instead of being summed from the ledger. It holds one row per
+assistant per month and per year, with paid (completed) and pending
+amounts. ORM events on Salary adjust the affected month and year rows in the
+same transaction as the write, so the payroll page and the assistant
+dashboard read a handful of summary rows however long the ledger gets.
+Failed payments count in neither total.
+
+As with daily revenue, bulk query.update()/delete() calls on Salary bypass
+the events; run rebuild_salary_summaries() after that kind of maintenance.
+"""
+
+from datetime import date, datetime
+from sqlalchemy import event, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload
+from app import db
+from models import Assistant, Salary, SalarySummary
+from orm_history import previous, track_previous
+from pagination import paginate_request
+from queries import SALARY_ORDER
+
+SUMMARY_MONTHS = 12
+
+_AMOUNT_COLUMNS = ('paid_amount', 'paid_count', 'pending_amount', 'pending_count')
+
+
+def _period_starts(payment_date):
+    return (('month', payment_date.replace(day=1)), ('year', payment_date.replace(month=1, day=1)))
+
+
+def _add_to_periods(connection, assistant_id, payment_date, **amounts):
+    """Add amounts to the month and year rows containing `payment_date`, creating them if needed"""
+    table = SalarySummary.__table__
+    now = datetime.utcnow()
+    dialect = connection.dialect.name
+    for period, period_start in _period_starts(payment_date):
+        values = {column: amounts.get(column, 0) for column in _AMOUNT_COLUMNS}
+        values.update(assistant_id=assistant_id, period=period, period_start=period_start, updated_at=now)
+
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            stmt = insert(table).values(**values)
+            update_values = {column: table.c[column] + stmt.excluded[column] for column in _AMOUNT_COLUMNS}
+            update_values['updated_at'] = stmt.excluded.updated_at
+            connection.execute(stmt.on_conflict_do_update(
+                index_elements=[table.c.assistant_id, table.c.period, table.c.period_start], set_=update_values
+            ))
+            continue
+
+        result = connection.execute(
+            table.update()
+            .where(table.c.assistant_id == assistant_id, table.c.period == period, table.c.period_start == period_start)
+            .values(**{column: table.c[column] + values[column] for column in _AMOUNT_COLUMNS}, updated_at=now)
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**values))
+
+
+def _contribution(assistant_id, status, amount, payment_date):
+    if payment_date is None or status not in ('completed', 'pending'):
+        return None
+    prefix = 'paid' if status == 'completed' else 'pending'
+    return assistant_id, payment_date, prefix, amount or 0.0
+
+
+def _apply(connection, contribution, sign):
+    if contribution:
+        assistant_id, payment_date, prefix, amount = contribution
+        _add_to_periods(connection, assistant_id, payment_date,
+                        **{f'{prefix}_amount': sign * amount, f'{prefix}_count': sign})
+
+
+# The update handler removes the old contribution
+track_previous(Salary.assistant_id, Salary.status, Salary.amount, Salary.payment_date)
+
+
+@event.listens_for(Salary, 'after_insert')
+def _salary_inserted(mapper, connection, target):
+    _apply(connection, _contribution(target.assistant_id, target.status, target.amount, target.payment_date), 1)
+
+
+@event.listens_for(Salary, 'after_update')
+def _salary_updated(mapper, connection, target):
+    old = _contribution(previous(target, 'assistant_id'), previous(target, 'status'),
+                        previous(target, 'amount'), previous(target, 'payment_date'))
+    new = _contribution(target.assistant_id, target.status, target.amount, target.payment_date)
+    if old != new:
+        _apply(connection, old, -1)
+        _apply(connection, new, 1)
+
+
+@event.listens_for(Salary, 'after_delete')
+def _salary_deleted(mapper, connection, target):
+    _apply(connection, _contribution(target.assistant_id, target.status, target.amount, target.payment_date), -1)
+
+
+def rebuild_salary_summaries():
+    """Recompute the salary_summary table from the salary ledger"""
+    totals = {}
+    rows = (
+        db.session.query(Salary.assistant_id, Salary.payment_date, Salary.status,
+                         func.sum(Salary.amount), func.count(Salary.id))
+        .filter(Salary.status.in_(('completed', 'pending')))
+        .group_by(Salary.assistant_id, Salary.payment_date, Salary.status)
+        .all()
+    )
+    for assistant_id, payment_date, status, amount, count in rows:
+        prefix = 'paid' if status == 'completed' else 'pending'
+        for period, period_start in _period_starts(payment_date):
+            key = (assistant_id, period, period_start)
+            summary = totals.setdefault(key, SalarySummary(
+                assistant_id=assistant_id, period=period, period_start=period_start,
+                paid_amount=0.0, paid_count=0, pending_amount=0.0, pending_count=0,
+            ))
+            setattr(summary, f'{prefix}_amount', getattr(summary, f'{prefix}_amount') + (amount or 0.0))
+            setattr(summary, f'{prefix}_count', getattr(summary, f'{prefix}_count') + count)
+
+    SalarySummary.query.delete()
+    db.session.add_all(totals.values())
+    db.session.commit()
+    return len(totals)
+
+
+def ensure_salary_summaries():
+    """Backfill salary_summary the first time it is deployed on existing data"""
+    if SalarySummary.query.first() is None and Salary.query.first():
+        rebuilt = rebuild_salary_summaries()
+        print(f'Salary summaries rebuilt ({rebuilt} rows)')
+
+
+def salary_ledger_page(assistant_id=None):
+    """One page of salary records, newest first, with their assistants loaded in the same query"""
+    query = Salary.query.options(joinedload(Salary.assistant))
+    if assistant_id is not None:
+        query = query.filter(Salary.assistant_id == assistant_id)
+    return paginate_request(query, SALARY_ORDER)
+
+
+def _summary_dict(row):
+    return {
+        'paid_amount': row.paid_amount if row else 0.0,
+        'paid_count': row.paid_count if row else 0,
+        'pending_amount': row.pending_amount if row else 0.0,
+        'pending_count': row.pending_count if row else 0,
+    }
+
+
+def _month_starts(today, months):
+    year, month = today.year, today.month
+    starts = []
+    for _ in range(months):
+        starts.append(date(year, month, 1))
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return starts
+
+
+def assistant_salary_summary(assistant_id, today=None, months=SUMMARY_MONTHS):
+    """An assistant's totals for the current month and year, the last `months` months and every year"""
+    today = today or datetime.now().date()
+    month_starts = _month_starts(today, months)
+    rows = (
+        SalarySummary.query
+        .filter(
+            SalarySummary.assistant_id == assistant_id,
+            db.or_(
+                db.and_(SalarySummary.period == 'month', SalarySummary.period_start >= month_starts[-1]),
+                SalarySummary.period == 'year',
+            ),
+        )
+        .all()
+    )
+    by_key = {(row.period, row.period_start): row for row in rows}
+    years = sorted((row for row in rows if row.period == 'year'), key=lambda row: row.period_start, reverse=True)
+
+    return {
+        'this_month': _summary_dict(by_key.get(('month', month_starts[0]))),
+        'this_year': _summary_dict(by_key.get(('year', today.replace(month=1, day=1)))),
+        'months': [dict(_summary_dict(by_key.get(('month', start))), period=start.isoformat()) for start in month_starts],
+        'years': [dict(_summary_dict(row), year=row.period_start.year) for row in years],
+        'all_time': {
+            column: sum(getattr(row, column) for row in years) for column in _AMOUNT_COLUMNS
+        },
+    }
+
+
+def payroll_totals(today=None):
+    """Every assistant's paid and pending totals for the current month, current year and all time"""
+    today = today or datetime.now().date()
+    month_start = today.replace(day=1)
+    year_start = today.replace(month=1, day=1)
+
+    def period_sum(column, period, period_start=None):
+        condition = SalarySummary.period == period
+        if period_start is not None:
+            condition = db.and_(condition, SalarySummary.period_start == period_start)
+        return func.coalesce(func.sum(db.case((condition, column), else_=0)), 0)
+
+    # One pass over the summary rows, with every assistant listed even without salaries
+    rows = (
+        db.session.query(
+            Assistant.id, Assistant.full_name, Assistant.email,
+            period_sum(SalarySummary.paid_amount, 'month', month_start),
+            period_sum(SalarySummary.pending_amount, 'month', month_start),
+            period_sum(SalarySummary.paid_amount, 'year', year_start),
+            period_sum(SalarySummary.pending_amount, 'year', year_start),
+            period_sum(SalarySummary.paid_amount, 'year'),
+            period_sum(SalarySummary.paid_count, 'year'),
+        )
+        .outerjoin(SalarySummary, db.and_(
+            SalarySummary.assistant_id == Assistant.id,
+            db.or_(
+                db.and_(SalarySummary.period == 'month', SalarySummary.period_start == month_start),
+                SalarySummary.period == 'year',
+            ),
+        ))
+        .group_by(Assistant.id, Assistant.full_name, Assistant.email)
+        .order_by(Assistant.full_name)
+        .all()
+    )
+    return [{
+        'assistant_id': row[0],
+        'full_name': row[1],
+        'email': row[2],
+        'month_paid': float(row[3]),
+        'month_pending': float(row[4]),
+        'year_paid': float(row[5]),
+        'year_pending': float(row[6]),
+        'all_time_paid': float(row[7]),
+        'all_time_payments': int(row[8]),
+    } for row in rows]
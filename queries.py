@@ -0,0 +1,212 @@
+"""
+Read queries for staff list pages
+
+Templates read appointment.patient and treatment.patient on every row.
+The backrefs in models.py are lazy, so each row would issue its own Patient
+SELECT. The queries here load the related rows up front so a page costs the
+same number of round trips no matter how many rows it renders.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, selectinload, undefer_group
+from app import db
+from models import (
+    Patient, Appointment, Payment, Treatment, Review, Salary, OptometristPrescription, RefractionReading,
+    DoctorPrescription, MedicalRecord, DOCTOR_PRESCRIPTION_GROUPS, MEDICAL_RECORD_GROUPS
+)
+
+# Sort keys for keyset pagination, each ending with the primary key
+APPOINTMENT_ORDER = [
+    (Appointment.appointment_date, 'desc'),
+    (Appointment.appointment_time, 'desc'),
+    (Appointment.id, 'desc'),
+]
+# Upcoming bookings run soonest first
+UPCOMING_APPOINTMENT_ORDER = [
+    (Appointment.appointment_date, 'asc'),
+    (Appointment.appointment_time, 'asc'),
+    (Appointment.id, 'asc'),
+]
+PATIENT_ORDER = [(Patient.full_name, 'asc'), (Patient.id, 'asc')]
+REVIEW_ORDER = [(Review.created_at, 'desc'), (Review.id, 'desc')]
+SALARY_ORDER = [(Salary.payment_date, 'desc'), (Salary.id, 'desc')]
+
+
+def appointment_list_query():
+    """Unsorted appointment query with patient loaded"""
+    return Appointment.query.options(joinedload(Appointment.patient))
+
+
+def appointment_tab_queries(today):
+    """Unsorted queries and sort keys for each tab of the appointments page"""
+    return {
+        'upcoming': (
+            appointment_list_query().filter(Appointment.status == 'scheduled', Appointment.appointment_date >= today),
+            UPCOMING_APPOINTMENT_ORDER,
+        ),
+        'completed': (appointment_list_query().filter(Appointment.status == 'completed'), APPOINTMENT_ORDER),
+        'all': (appointment_list_query(), APPOINTMENT_ORDER),
+    }
+
+
+def appointments_on_date_query(day, status=None):
+    """Query for a single day's appointments ordered by time, with patient loaded"""
+    query = Appointment.query.options(joinedload(Appointment.patient)).filter(
+        Appointment.appointment_date == day
+    )
+    if status:
+        query = query.filter(Appointment.status == status)
+    return query.order_by(Appointment.appointment_time)
+
+
+def appointments_on_date(day, status=None):
+    """Appointments for a single day ordered by time, with patient loaded"""
+    return appointments_on_date_query(day, status).all()
+
+
+def patient_appointments_query(patient_id):
+    """A patient's appointments, newest first"""
+    return Appointment.query.filter_by(patient_id=patient_id).order_by(
+        Appointment.appointment_date.desc(), Appointment.appointment_time.desc()
+    )
+
+
+def patient_list_query(*relationships):
+    """Unsorted patient query with the given collections loaded"""
+    return Patient.query.options(*[selectinload(relationship) for relationship in relationships])
+
+
+def payments_with_patients(start=None, end=None):
+    """Non-cancelled payments with their patient, newest first
+
+    Returns (Payment, Patient) tuples as used by the revenue page, limited to
+    payments created between `start` and `end` (inclusive dates) when given.
+    """
+    query = (
+        db.session.query(Payment, Patient)
+        .join(Appointment, Payment.appointment_id == Appointment.id)
+        .join(Patient, Appointment.patient_id == Patient.id)
+        .filter(
+            Payment.status != 'cancelled',
+            Appointment.status != 'cancelled'
+        )
+    )
+    if start:
+        query = query.filter(Payment.created_at >= datetime.combine(start, time.min))
+    if end:
+        query = query.filter(Payment.created_at < datetime.combine(end + timedelta(days=1), time.min))
+    return query.order_by(Payment.created_at.desc()).all()
+
+
+def treatments_with_patients(start=None, end=None):
+    """Treatments between two dates (inclusive), newest first, with patient loaded"""
+    query = Treatment.query.options(joinedload(Treatment.patient))
+    if start:
+        query = query.filter(Treatment.treatment_date >= start)
+    if end:
+        query = query.filter(Treatment.treatment_date <= end)
+    return query.order_by(Treatment.treatment_date.desc()).all()
+
+
+def undefer_groups(*groups):
+    """Loader options that fetch the given deferred column groups with the row"""
+    return [undefer_group(group) for group in groups]
+
+
+def patient_with_prescription_summaries(patient_id):
+    """A patient with doctor prescriptions loaded for list cards (headline and summary fields)"""
+    return (
+        Patient.query
+        .options(selectinload(Patient.doctor_prescriptions).undefer_group('summary'))
+        .filter_by(id=patient_id)
+        .populate_existing()
+        .first_or_404()
+    )
+
+
+def doctor_prescription_detail(prescription_id, groups=DOCTOR_PRESCRIPTION_GROUPS):
+    """One doctor prescription with the deferred groups a detail page shows"""
+    return (
+        DoctorPrescription.query
+        .options(*undefer_groups(*groups))
+        .filter_by(id=prescription_id)
+        .first_or_404()
+    )
+
+
+def latest_doctor_prescription(patient_id, *groups):
+    """A patient's latest doctor prescription with the given deferred groups"""
+    return (
+        DoctorPrescription.query
+        .options(*undefer_groups(*groups))
+        .filter_by(patient_id=patient_id)
+        .order_by(DoctorPrescription.created_at.desc())
+        .first()
+    )
+
+
+def medical_record_for(appointment_id):
+    """The medical record of an appointment with all narrative fields"""
+    return (
+        MedicalRecord.query
+        .options(*undefer_groups(*MEDICAL_RECORD_GROUPS))
+        .filter_by(appointment_id=appointment_id)
+        .first()
+    )
+
+
+def latest_optometrist_prescription(patient_id, *stages):
+    """A patient's latest optometrist prescription with the refraction stages a page shows
+
+    With no stages given every stage is loaded.
+    """
+    readings = OptometristPrescription.readings
+    if stages:
+        readings = readings.and_(RefractionReading.stage.in_(stages))
+    return (
+        OptometristPrescription.query
+        .options(selectinload(readings))
+        .filter_by(patient_id=patient_id)
+        .order_by(OptometristPrescription.created_at.desc())
+        .first()
+    )
+
+
+@contextmanager
+def count_queries():
+    """Record every SQL statement executed inside the block
+
+    Listens on every configured engine, so statements that @replica_reads
+    views send to the replica are counted too. Yields a list that fills with
+    statements as they run, e.g.
+
+        with count_queries() as statements:
+            client.get('/admin/appointments')
+        assert len(statements) == 3
+    """
+    statements = []
+    engines = set(db.engines.values())
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@contextmanager
+def assert_query_count(expected):
+    """Fail if the block does not execute exactly `expected` statements"""
+    with count_queries() as statements:
+        yield statements
+    if len(statements) != expected:
+        raise AssertionError(
+            f"Expected {expected} queries, got {len(statements)}:\n" + "\n".join(statements)
+        )
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Payment reconciliation
+
+A payment's status should follow its appointment. Each rule in RULES names
+an appointment status, the payment statuses that disagree with it and the
+status to set. A run applies every rule with set-based statements in
+chunks of RECONCILE_CHUNK_SIZE payments. Each chunk is one SELECT of the
+candidate payments, one UPDATE, and one INSERT into reconciliation_change.
+The chunk commits on its own, so a large history never holds one long
+transaction.
+
+The UPDATE checks both statuses again, so a payment someone else fixed
+since the SELECT is left alone. Daily revenue is adjusted for the changed
+rows with adjust_payment_statuses(), because bulk statements bypass the
+Payment events.
+
+reconciliation_run records each run: its mode, when it ran and how many
+payments it changed. reconciliation_change records every change with the
+rule that made it.
+
+Runs are either:
+
+  full         every payment
+  incremental  only payments whose payment or appointment row was written
+               (updated_at) since the previous completed run started, less
+               RECONCILE_OVERLAP seconds for transactions that were still
+               open then
+
+The worker holding the 'payment_reconciliation' lease (see leader.py) runs
+an incremental pass every RECONCILE_INTERVAL seconds. It also picks up
+full runs requested from the revenue page within RECONCILE_POLL_INTERVAL.
+Without background jobs, run it from cron:
+
+    python reconciliation.py            # incremental
+    python reconciliation.py --full
+"""
+
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import exists, insert, select, union
+from app import db
+from leader import LeaderLease
+from models import Appointment, Payment, ReconciliationRun, ReconciliationChange
+from revenue import adjust_payment_statuses
+
+RECONCILE_INTERVAL = float(os.environ.get('RECONCILE_INTERVAL', 900))
+RECONCILE_POLL_INTERVAL = float(os.environ.get('RECONCILE_POLL_INTERVAL', 10))
+RECONCILE_CHUNK_SIZE = int(os.environ.get('RECONCILE_CHUNK_SIZE', 500))
+RECONCILE_OVERLAP = 60  # seconds
+
+# (rule, appointment status, payment statuses to fix or None for any other, new payment status)
+RULES = (
+    ('confirmed_payment_pending', 'confirmed', ('pending',), 'completed'),
+    ('cancelled_payment_open', 'cancelled', None, 'cancelled'),
+    ('scheduled_payment_completed', 'scheduled', ('completed',), 'pending'),
+)
+
+# Set when a full run is requested in this process so the worker starts it now
+_wake = threading.Event()
+
+
+def _payment_filter(payments, from_statuses, new_status):
+    if from_statuses is None:
+        return payments.c.status != new_status
+    return payments.c.status.in_(from_statuses)
+
+
+def _touched_since(since):
+    """Ids of payments whose payment or appointment row was written at or after `since`"""
+    payments = Payment.__table__
+    appointments = Appointment.__table__
+    return union(
+        select(payments.c.id).where(payments.c.updated_at >= since),
+        select(payments.c.id)
+        .join(appointments, appointments.c.id == payments.c.appointment_id)
+        .where(appointments.c.updated_at >= since),
+    )
+
+
+def _apply_rule(run, rule, since):
+    """Apply one rule chunk by chunk; returns the number of payments changed"""
+    name, appointment_status, from_statuses, new_status = rule
+    payments = Payment.__table__
+    appointments = Appointment.__table__
+    appointment_matches = exists().where(
+        appointments.c.id == payments.c.appointment_id,
+        appointments.c.status == appointment_status,
+    )
+
+    criteria = [appointment_matches, _payment_filter(payments, from_statuses, new_status)]
+    if since is not None:
+        criteria.append(payments.c.id.in_(_touched_since(since)))
+
+    changed = 0
+    last_id = 0
+    while True:
+        # Next chunk of candidates, walking the primary key
+        rows = db.session.execute(
+            select(payments.c.id, payments.c.appointment_id, payments.c.status, payments.c.amount, payments.c.created_at)
+            .where(payments.c.id > last_id, *criteria)
+            .order_by(payments.c.id)
+            .limit(RECONCILE_CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        # One UPDATE for the chunk, repeating the rule so concurrent fixes are skipped
+        stmt = (
+            payments.update()
+            .where(payments.c.id.in_([row.id for row in rows]), appointment_matches,
+                   _payment_filter(payments, from_statuses, new_status))
+            .values(status=new_status)
+        )
+        if db.engine.dialect.update_returning:
+            changed_ids = set(db.session.execute(stmt.returning(payments.c.id)).scalars())
+        else:
+            db.session.execute(stmt)
+            changed_ids = {row.id for row in rows}
+        fixed = [row for row in rows if row.id in changed_ids]
+
+        if fixed:
+            adjust_payment_statuses(db.session.connection(),
+                                    [(row.status, row.amount, row.created_at) for row in fixed], new_status)
+            now = datetime.utcnow()
+            db.session.execute(insert(ReconciliationChange), [
+                {'run_id': run.id, 'payment_id': row.id, 'appointment_id': row.appointment_id, 'rule': name,
+                 'old_status': row.status, 'new_status': new_status, 'changed_at': now}
+                for row in fixed
+            ])
+            db.session.execute(
+                ReconciliationRun.__table__.update()
+                .where(ReconciliationRun.__table__.c.id == run.id)
+                .values(changed=ReconciliationRun.__table__.c.changed + len(fixed))
+            )
+        db.session.commit()
+        changed += len(fixed)
+
+    return changed
+
+
+def _incremental_since():
+    """Start of the window for an incremental run, or None when a full run is needed"""
+    last = (
+        ReconciliationRun.query
+        .filter_by(status='completed')
+        .order_by(ReconciliationRun.started_at.desc())
+        .first()
+    )
+    if last is None:
+        return None
+    return last.started_at - timedelta(seconds=RECONCILE_OVERLAP)
+
+
+def execute_run(run):
+    """Apply every rule for a requested or new run and record the outcome"""
+    if run.mode == 'incremental':
+        run.since = _incremental_since()
+        if run.since is None:
+            # Nothing has been reconciled yet, so everything is new
+            run.mode = 'full'
+    run.status = 'running'
+    run.started_at = datetime.utcnow()
+    db.session.commit()
+    run_id = run.id
+
+    try:
+        counts = {}
+        for rule in RULES:
+            counts[rule[0]] = _apply_rule(run, rule, run.since)
+        run = db.session.get(ReconciliationRun, run_id)
+        run.status = 'completed'
+        run.finished_at = datetime.utcnow()
+        db.session.commit()
+        if run.changed:
+            print(f"Payment reconciliation run {run_id} ({run.mode}) changed {run.changed} payments: "
+                  + ', '.join(f'{name}={count}' for name, count in counts.items() if count))
+    except Exception as e:
+        db.session.rollback()
+        run = db.session.get(ReconciliationRun, run_id)
+        run.status = 'failed'
+        run.error = str(e)
+        run.finished_at = datetime.utcnow()
+        db.session.commit()
+        print(f"Payment reconciliation run {run_id} failed: {str(e)}")
+    return run
+
+
+def reconcile_payments(mode='incremental', requested_by=None):
+    """Run the reconciliation now in this process; returns the ReconciliationRun"""
+    run = ReconciliationRun(mode=mode, requested_by=requested_by)
+    db.session.add(run)
+    db.session.commit()
+    return execute_run(run)
+
+
+def request_full_run(requested_by=None):
+    """Queue a full run for the reconciliation worker; returns it, or the one already queued"""
+    pending = ReconciliationRun.query.filter_by(mode='full', status='requested').first()
+    if pending is not None:
+        return pending
+    run = ReconciliationRun(mode='full', status='requested', requested_by=requested_by)
+    db.session.add(run)
+    db.session.commit()
+    _wake.set()
+    return run
+
+
+def run_requested():
+    """Start each requested run that no other worker has claimed"""
+    table = ReconciliationRun.__table__
+    ran = 0
+    for run_id in db.session.execute(
+        select(table.c.id).where(table.c.status == 'requested').order_by(table.c.id)
+    ).scalars().all():
+        claimed = db.session.execute(
+            table.update().where(table.c.id == run_id, table.c.status == 'requested').values(status='running')
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            execute_run(db.session.get(ReconciliationRun, run_id))
+            ran += 1
+    return ran
+
+
+def recent_runs(limit=10):
+    """Latest runs with the number of changes each rule made"""
+    runs = ReconciliationRun.query.order_by(ReconciliationRun.id.desc()).limit(limit).all()
+    counts = {}
+    if runs:
+        rows = (
+            db.session.query(ReconciliationChange.run_id, ReconciliationChange.rule, db.func.count(ReconciliationChange.id))
+            .filter(ReconciliationChange.run_id.in_([run.id for run in runs]))
+            .group_by(ReconciliationChange.run_id, ReconciliationChange.rule)
+            .all()
+        )
+        for run_id, rule, count in rows:
+            counts.setdefault(run_id, {})[rule] = count
+    return [dict(run.to_dict(), rules=counts.get(run.id, {})) for run in runs]
+
+
+def start_payment_reconciliation(app):
+    """Reconcile payments in the background while this process holds the lease"""
+    lease = LeaderLease(app, 'payment_reconciliation')
+    lease.start()
+
+    def reconcile_loop():
+        next_incremental = time.monotonic() + RECONCILE_POLL_INTERVAL
+        while True:
+            _wake.wait(RECONCILE_POLL_INTERVAL)
+            _wake.clear()
+            if not lease.is_leader():
+                continue
+            try:
+                with app.app_context():
+                    run_requested()
+                    if time.monotonic() >= next_incremental:
+                        next_incremental = time.monotonic() + RECONCILE_INTERVAL
+                        reconcile_payments('incremental')
+            except Exception as e:
+                print(f"Error in payment reconciliation: {str(e)}")
+
+    reconcile_thread = threading.Thread(target=reconcile_loop, daemon=True)
+    reconcile_thread.start()
+    print("Payment reconciliation job started")
+
+
+def main():
+    import argparse
+    from app import app
+
+    parser = argparse.ArgumentParser(description='Bring payment statuses in line with their appointments')
+    parser.add_argument('--full', action='store_true', help='check every payment, not just recently written ones')
+    args = parser.parse_args()
+
+    with app.app_context():
+        run_requested()
+        run = reconcile_payments('full' if args.full else 'incremental', requested_by='command line')
+        print(f"Run {run.id} ({run.mode}) {run.status}: {run.changed} payments changed")
+        return 0 if run.status == 'completed' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,351 +1,389 @@
+"""
+Appointment reminders
+
+A scheduler thread keeps a heap of upcoming reminder due times, one entry
+per confirmed appointment: its next offset from REMINDER_OFFSETS (for
+example "24h,2h") before the appointment starts. The thread sleeps until the
+earliest entry is due rather than polling, so each reminder goes out at its
+offset whatever time of day (or side of midnight) that falls on.
+
+Appointments are loaded incrementally: on start, confirmed appointments
+starting within the largest offset plus REMINDER_RESYNC_INTERVAL; after that
+only the days newly entering that window. Commits in this process that
+confirm, cancel or reschedule an appointment refresh its entry right away.
+The whole window is reloaded every REMINDER_RESYNC_INTERVAL seconds to pick
+up changes committed by other workers.
+
+Only the worker holding the "reminders" lease (see leader.py) runs the
+scheduler; the others keep their thread idle until they are elected.
+Confirmations committed by other workers therefore reach the leader on its
+next resync.
+
+Sending sets Appointment.reminder_sent_at with a conditional UPDATE that only
+matches while the reminder is still outstanding, and queues the email in the
+outbox in the same transaction. A reminder is therefore sent once even when
+several processes run the scheduler. An offset counts as done once
+reminder_sent_at is at or after its due time. If the scheduler was down past
+a due time, the missed reminder is skipped when a later offset is still to
+come and otherwise sent late, once.
+"""
+
+import heapq
+import os
+import re
 import threading
 import time
-from datetime import datetime, timedelta
-from models import Appointment, Patient, db
+from datetime import date, datetime, timedelta
 from flask import current_app
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import os
-import logging
+from sqlalchemy import event, inspect, or_
+from sqlalchemy.orm import joinedload
+from models import Appointment, Patient, db
+from mail_transport import send_messages
+from notifications import build_notification, queue_notification
+from leader import LeaderLease, LEASE_RENEW_INTERVAL
+
+REMINDER_OFFSETS = os.environ.get('REMINDER_OFFSETS', '24h,2h')
+REMINDER_RESYNC_INTERVAL = float(os.environ.get('REMINDER_RESYNC_INTERVAL', 300))
+
+_OFFSET_UNITS = {'d': 'days', 'h': 'hours', 'm': 'minutes'}
+
+
+def parse_offsets(spec):
+    """Offsets such as "24h,2h,30m" as timedeltas, largest first"""
+    offsets = set()
+    for part in spec.split(','):
+        part = part.strip().lower()
+        if not part:
+            continue
+        match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([dhm]?)', part)
+        if not match:
+            raise ValueError(f'Invalid reminder offset {part!r}; use values like 24h, 90m or 1d')
+        offsets.add(timedelta(**{_OFFSET_UNITS[match.group(2) or 'h']: float(match.group(1))}))
+    return sorted(offsets, reverse=True)
+
+
+def describe_offsets(offsets=None):
+    """Offsets as text for emails, e.g. 24 hours and 2 hours"""
+    offsets = offsets if offsets is not None else parse_offsets(REMINDER_OFFSETS)
+    parts = []
+    for offset in offsets:
+        minutes = int(offset.total_seconds() // 60)
+        if minutes % 60:
+            parts.append(f"{minutes} minutes")
+        else:
+            hours = minutes // 60
+            parts.append(f"{hours} hour{'s' if hours != 1 else ''}")
+    if len(parts) < 2:
+        return ''.join(parts)
+    return f"{', '.join(parts[:-1])} and {parts[-1]}"
+
+
+def reminder_context(patient_name, appointment_date, appointment_time):
+    """Template values for the reminder email"""
+    # "today" or "tomorrow" for near appointments, otherwise the weekday
+    days_away = (appointment_date - date.today()).days
+    if days_away == 0:
+        when = 'today'
+    elif days_away == 1:
+        when = 'tomorrow'
+    else:
+        when = f"on {appointment_date.strftime('%A')}"
+    return {
+        'patient_name': patient_name,
+        'appointment_date': appointment_date,
+        'appointment_time': appointment_time,
+        'when': when,
+    }
+
+
+def build_reminder_email(patient_email, patient_name, appointment_date, appointment_time):
+    """A reminder email ready for send_messages()"""
+    return build_notification(patient_email, 'reminder',
+                              **reminder_context(patient_name, appointment_date, appointment_time))
 
-def send_email_notification(to_email, subject, message):
-    """Send email notification"""
-    try:
-        # Email configuration
-        smtp_server = "smtp.gmail.com"
-        smtp_port = 587
-        sender_email = os.getenv('SMTP_EMAIL')
-        sender_password = os.getenv('SMTP_PASSWORD')
 
-        if not sender_email or not sender_password:
-            print("Email credentials not configured")
-            return False
+def send_beautiful_reminder_email(patient_email, patient_name, appointment_date, appointment_time):
+    """Send a beautiful HTML reminder email with clinic logo"""
+    message = build_reminder_email(patient_email, patient_name, appointment_date, appointment_time)
+    error = send_messages([message])[0]
+    if error is not None:
+        print(f"Error sending email: {error}")
+        return False
+    print(f"Email sent successfully to {patient_email}")
+    return True
+
+
+def appointment_start(appointment):
+    return datetime.combine(appointment.appointment_date, appointment.appointment_time)
+
+
+def next_reminder_due(start, sent_at, now, offsets):
+    """When the next reminder for an appointment starting at `start` is due, or None"""
+    if start <= now:
+        return None
+    # Offsets not yet covered by the last reminder, earliest due first
+    pending = sorted(start - offset for offset in offsets if sent_at is None or start - offset > sent_at)
+    if not pending:
+        return None
+    upcoming = [due for due in pending if due > now]
+    if upcoming:
+        # Missed reminders are dropped in favour of one still to come
+        return upcoming[0]
+    # Every remaining offset was missed; send one reminder now
+    return now
+
+
+def confirmed_appointments_query(first_day, last_day):
+    """Confirmed appointments between two dates, as loaded into the reminder heap"""
+    return Appointment.query.filter(
+        Appointment.status == 'confirmed',
+        Appointment.appointment_date >= first_day,
+        Appointment.appointment_date <= last_day
+    )
+
+
+class ReminderScheduler:
+    """Heap of next reminder due times for confirmed appointments"""
+
+    def __init__(self, app, offsets=None, lease=None):
+        self.app = app
+        self.lease = lease
+        self.offsets = offsets if offsets is not None else parse_offsets(REMINDER_OFFSETS)
+        self.heap = []
+        # appointment id -> due time of its live heap entry; other entries are stale
+        self.next_due = {}
+        self.loaded_through = None
+        self.last_resync = 0.0
+        self.changed = set()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stats = {'sent': 0, 'skipped': 0, 'claimed_elsewhere': 0, 'loaded': 0}
+
+    def elected(self):
+        """Reload the whole window when this process takes over the lease"""
+        self.loaded_through = None
+        self.wake.set()
+
+    def notify(self, appointment_ids):
+        """Refresh these appointments on the scheduler thread"""
+        with self.lock:
+            self.changed.update(appointment_ids)
+        self.wake.set()
+
+    def _due_for(self, appointment, now, sent_at=None):
+        if appointment.status != 'confirmed':
+            return None
+        sent_at = sent_at or appointment.reminder_sent_at
+        return next_reminder_due(appointment_start(appointment), sent_at, now, self.offsets)
+
+    def _schedule(self, appointment_id, due):
+        if due is None:
+            self.next_due.pop(appointment_id, None)
+        elif self.next_due.get(appointment_id) != due:
+            self.next_due[appointment_id] = due
+            heapq.heappush(self.heap, (due, appointment_id))
+
+    def _load_days(self, first_day, last_day, now):
+        appointments = confirmed_appointments_query(first_day, last_day).all()
+        for appointment in appointments:
+            self._schedule(appointment.id, self._due_for(appointment, now))
+        self.stats['loaded'] += len(appointments)
+
+    def refill(self, now):
+        """Load the days entering the window, or the whole window when a resync is due"""
+        horizon = (now + self.offsets[0] + timedelta(seconds=REMINDER_RESYNC_INTERVAL)).date()
+        if self.loaded_through is None or time.monotonic() - self.last_resync >= REMINDER_RESYNC_INTERVAL:
+            # Full reload: rebuild the heap so entries cancelled elsewhere disappear
+            self.heap = []
+            self.next_due = {}
+            self._load_days(now.date(), horizon, now)
+            self.last_resync = time.monotonic()
+        elif horizon > self.loaded_through:
+            self._load_days(self.loaded_through + timedelta(days=1), horizon, now)
+        self.loaded_through = horizon
+
+    def apply_changes(self, now):
+        with self.lock:
+            changed, self.changed = self.changed, set()
+        if not changed:
+            return
+        found = Appointment.query.filter(Appointment.id.in_(changed)).all()
+        for appointment in found:
+            self._schedule(appointment.id, self._due_for(appointment, now))
+        for appointment_id in changed - {appointment.id for appointment in found}:
+            self.next_due.pop(appointment_id, None)
+
+    def _pop_due(self, now):
+        due_ids = []
+        while self.heap and self.heap[0][0] <= now:
+            due, appointment_id = heapq.heappop(self.heap)
+            if self.next_due.get(appointment_id) == due:
+                del self.next_due[appointment_id]
+                due_ids.append(appointment_id)
+        return due_ids
+
+    def send_due(self, now):
+        """Claim and queue every reminder due by `now`; returns how many were queued"""
+        due_ids = self._pop_due(now)
+        if not due_ids:
+            return 0
+
+        appointments = Appointment.query.options(joinedload(Appointment.patient)).filter(
+            Appointment.id.in_(due_ids)
+        ).all()
+        queued = []
+        # Next offset of each appointment reminded here, scheduled once the claims commit
+        follow_ups = {}
+        for appointment in appointments:
+            due = self._due_for(appointment, now)
+            if due is None or due > now:
+                # Cancelled, moved or already reminded since it was scheduled
+                self._schedule(appointment.id, due)
+                continue
+
+            # Only one process gets the row while the reminder is outstanding
+            claimed = Appointment.query.filter(
+                Appointment.id == appointment.id,
+                Appointment.status == 'confirmed',
+                or_(Appointment.reminder_sent_at.is_(None), Appointment.reminder_sent_at < due)
+            ).update({Appointment.reminder_sent_at: now}, synchronize_session=False)
+            if not claimed:
+                self.stats['claimed_elsewhere'] += 1
+                continue
+            follow_ups[appointment.id] = self._due_for(appointment, now, sent_at=now)
+
+            patient = appointment.patient
+            if patient.email:
+                queue_notification(patient.email, 'reminder', **reminder_context(
+                    patient.full_name, appointment.appointment_date, appointment.appointment_time
+                ))
+                queued.append(appointment)
+                print(f"Queued reminder to {patient.email} for appointment on {appointment.appointment_date} at {appointment.appointment_time}")
+            else:
+                self.stats['skipped'] += 1
+                print(f"No email found for patient {patient.full_name}")
+
+        db.session.commit()
+        self.stats['sent'] += len(queued)
+
+        for appointment_id, due in follow_ups.items():
+            self._schedule(appointment_id, due)
+        return len(queued)
+
+    def run_once(self):
+        """Refresh the heap and send whatever is due; returns seconds until the next wake-up"""
+        now = datetime.now()
+        self.refill(now)
+        self.apply_changes(now)
+        self.send_due(now)
+
+        until_resync = REMINDER_RESYNC_INTERVAL - (time.monotonic() - self.last_resync)
+        if self.heap:
+            until_due = (self.heap[0][0] - datetime.now()).total_seconds()
+            return max(0.0, min(until_due, until_resync))
+        return max(0.0, until_resync)
+
+    def run_forever(self):
+        while True:
+            if self.lease is not None and not self.lease.is_leader():
+                # Idle until elected; elected() sets the wake event
+                self.wake.wait(LEASE_RENEW_INTERVAL)
+                self.wake.clear()
+                continue
+            try:
+                with self.app.app_context():
+                    timeout = self.run_once()
+            except Exception as e:
+                print(f"Error in reminder scheduler: {str(e)}")
+                with self.app.app_context():
+                    db.session.rollback()
+                timeout = 300  # Wait 5 minutes before retrying
+            self.wake.wait(timeout)
+            self.wake.clear()
 
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = to_email
-        msg['Subject'] = subject
+    def snapshot(self):
+        upcoming = min(self.next_due.values()) if self.next_due else None
+        return dict(
+            self.stats,
+            leader=self.lease is None or self.lease.is_leader(),
+            scheduled=len(self.next_due),
+            next_due=upcoming.isoformat() if upcoming else None,
+            offsets=[offset.total_seconds() for offset in self.offsets],
+        )
 
-        msg.attach(MIMEText(message, 'html'))
 
-        # Send email
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(sender_email, sender_password)
-            server.send_message(msg)
+_scheduler = None
 
-        print(f"Email sent successfully to {to_email}")
-        return True
 
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        return False
+# Refresh the scheduler when a commit in this process confirms, cancels or moves an appointment
+def _changed_appointments(session):
+    return session.info.setdefault('reminder_appointments', set())
 
-def send_beautiful_reminder_email(patient_email, patient_name, appointment_date, appointment_time):
-    """Send a beautiful HTML reminder email with clinic logo"""
 
-    # Read and encode the logo image
-    logo_path = os.path.join('static', 'img', 'clinic_logo.jpg')
-    try:
-        with open(logo_path, 'rb') as img_file:
-            logo_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-    except FileNotFoundError:
-        logo_base64 = ""  # Fallback if logo not found
-
-    subject = "🔔 Appointment Reminder - Dr. Richa's Eye Clinic"
-
-    html_message = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Appointment Reminder</title>
-        <style>
-            body {{
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                line-height: 1.6;
-                margin: 0;
-                padding: 0;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            }}
-            .container {{
-                max-width: 600px;
-                margin: 40px auto;
-                background: white;
-                border-radius: 15px;
-                overflow: hidden;
-                box-shadow: 0 20px 40px rgba(0,0,0,0.1);
-            }}
-            .header {{
-                background: linear-gradient(135deg, #007bff, #0056b3);
-                color: white;
-                padding: 30px 20px;
-                text-align: center;
-            }}
-            .logo {{
-                max-width: 200px;
-                height: auto;
-                margin-bottom: 20px;
-                border-radius: 10px;
-            }}
-            .header h1 {{
-                margin: 0;
-                font-size: 24px;
-                font-weight: 300;
-            }}
-            .header p {{
-                margin: 10px 0 0 0;
-                font-size: 16px;
-                opacity: 0.9;
-            }}
-            .content {{
-                padding: 40px 30px;
-            }}
-            .greeting {{
-                font-size: 18px;
-                color: #333;
-                margin-bottom: 20px;
-            }}
-            .reminder-card {{
-                background: linear-gradient(135deg, #f8f9fa, #e9ecef);
-                border-left: 5px solid #007bff;
-                padding: 25px;
-                border-radius: 10px;
-                margin: 20px 0;
-            }}
-            .appointment-details {{
-                background: white;
-                border-radius: 10px;
-                padding: 25px;
-                margin: 20px 0;
-                box-shadow: 0 5px 15px rgba(0,0,0,0.08);
-            }}
-            .detail-row {{
-                display: flex;
-                justify-content: space-between;
-                align-items: center;
-                padding: 12px 0;
-                border-bottom: 1px solid #eee;
-            }}
-            .detail-row:last-child {{
-                border-bottom: none;
-            }}
-            .detail-label {{
-                font-weight: 600;
-                color: #555;
-            }}
-            .detail-value {{
-                color: #333;
-                font-weight: 500;
-            }}
-            .date-time {{
-                font-size: 20px;
-                color: #007bff;
-                font-weight: 700;
-            }}
-            .instructions {{
-                background: #fff3cd;
-                border: 1px solid #ffeaa7;
-                border-radius: 8px;
-                padding: 20px;
-                margin: 25px 0;
-            }}
-            .instructions h4 {{
-                color: #856404;
-                margin: 0 0 15px 0;
-            }}
-            .instructions ul {{
-                margin: 0;
-                padding-left: 20px;
-                color: #856404;
-            }}
-            .instructions li {{
-                margin: 8px 0;
-            }}
-            .footer {{
-                background: #f8f9fa;
-                padding: 30px;
-                text-align: center;
-                border-top: 1px solid #dee2e6;
-            }}
-            .contact-info {{
-                margin: 15px 0;
-                color: #6c757d;
-            }}
-            .clinic-address {{
-                font-style: italic;
-                color: #6c757d;
-                line-height: 1.4;
-            }}
-            .btn {{
-                display: inline-block;
-                background: linear-gradient(135deg, #28a745, #20c997);
-                color: white;
-                text-decoration: none;
-                padding: 12px 25px;
-                border-radius: 25px;
-                font-weight: 600;
-                margin: 15px 0;
-                transition: all 0.3s ease;
-            }}
-            .reminder-icon {{
-                font-size: 40px;
-                color: #007bff;
-                margin-bottom: 15px;
-            }}
-            @media (max-width: 600px) {{
-                .container {{ margin: 20px; }}
-                .content {{ padding: 20px; }}
-                .detail-row {{ flex-direction: column; align-items: flex-start; }}
-                .detail-value {{ margin-top: 5px; }}
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                {f'<img src="data:image/jpeg;base64,{logo_base64}" alt="Dr. Richa&#39;s Eye Clinic Logo" class="logo">' if logo_base64 else ''}
-                <h1>Dr. Richa's Eye Clinic</h1>
-                <p>Eyes that Shine, Care that matters</p>
-            </div>
-
-            <div class="content">
-                <div class="greeting">
-                    Dear {patient_name},
-                </div>
-
-                <div class="reminder-card">
-                    <div style="text-align: center;">
-                        <div class="reminder-icon">⏰</div>
-                        <h3 style="margin: 0; color: #007bff;">Appointment Reminder</h3>
-                        <p style="margin: 10px 0 0 0; color: #666;">Your appointment is scheduled for tomorrow</p>
-                    </div>
-                </div>
-
-                <div class="appointment-details">
-                    <h4 style="text-align: center; color: #007bff; margin-bottom: 20px;">Appointment Details</h4>
-
-                    <div class="detail-row">
-                        <span class="detail-label">📅 Date:</span>
-                        <span class="detail-value date-time">{appointment_date.strftime('%A, %B %d, %Y')}</span>
-                    </div>
-
-                    <div class="detail-row">
-                        <span class="detail-label">🕒 Time:</span>
-                        <span class="detail-value date-time">{appointment_time.strftime('%I:%M %p')}</span>
-                    </div>
-
-                    <div class="detail-row">
-                        <span class="detail-label">👩‍⚕️ Doctor:</span>
-                        <span class="detail-value">Dr. Richa Sharma</span>
-                    </div>
-
-                    <div class="detail-row">
-                        <span class="detail-label">💰 Consultation Fee:</span>
-                        <span class="detail-value">₹500</span>
-                    </div>
-                </div>
-
-                <div class="instructions">
-                    <h4>📋 Important Instructions:</h4>
-                    <ul>
-                        <li><strong>Arrive 15 minutes early</strong> for check-in and registration</li>
-                        <li><strong>Bring your previous prescriptions</strong> and any existing eyewear</li>
-                        <li><strong>Carry a valid ID proof</strong> for verification</li>
-                        <li><strong>Payment:</strong> Cash, UPI, or Card accepted at the clinic</li>
-                        <li><strong>Bring current medications list</strong> if you're taking any eye drops</li>
-                    </ul>
-                </div>
-
-                <div style="text-align: center; margin: 30px 0;">
-                    <p style="color: #666; margin-bottom: 15px;">Need to reschedule or have questions?</p>
-                    <a href="mailto:drrichaeyeclinic@gmail.com" class="btn">Contact Us</a>
-                </div>
-
-                <div style="background: #e3f2fd; padding: 20px; border-radius: 10px; text-align: center;">
-                    <h4 style="color: #1976d2; margin: 0 0 10px 0;">📍 Clinic Location</h4>
-                    <div class="clinic-address">
-                        First floor, DVR Town Centre<br>
-                        Near to IGUS Private Limited<br>
-                        Mandur, Budigere Road (New Airport Road)<br>
-                        Bengaluru, Karnataka 560049
-                    </div>
-                </div>
-            </div>
-
-            <div class="footer">
-                <div class="contact-info">
-                    📧 Email: drrichaeyeclinic@gmail.com<br>
-                    📱 Phone: +91 98765 43210<br>
-                    🌐 Website: Visit our clinic portal
-                </div>
-                <p style="color: #adb5bd; font-size: 12px; margin: 20px 0 0 0;">
-                    This is an automated reminder. Please do not reply to this email.
-                </p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-
-    return send_email_notification(patient_email, subject, html_message)
+def mark_appointments_changed(session, appointment_ids):
+    """Refresh these appointments' reminders after the session commits (for bulk UPDATEs)"""
+    _changed_appointments(session).update(appointment_ids)
+
+
+@event.listens_for(Appointment, 'after_insert')
+def _appointment_inserted(mapper, connection, target):
+    if target.status == 'confirmed':
+        _changed_appointments(inspect(target).session).add(target.id)
+
+
+@event.listens_for(Appointment, 'after_update')
+def _appointment_updated(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in ('appointment_date', 'appointment_time', 'status')):
+        _changed_appointments(state.session).add(target.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _notify_after_commit(session):
+    changed = session.info.pop('reminder_appointments', None)
+    if changed and _scheduler is not None:
+        _scheduler.notify(changed)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_after_rollback(session, previous_transaction):
+    session.info.pop('reminder_appointments', None)
+
+
+def reminder_status():
+    """Scheduler state in this process, or None if it has not started here"""
+    return _scheduler.snapshot() if _scheduler is not None else None
+
 
 def check_and_send_reminders():
-    """Check for appointments that need reminder emails"""
+    """Send every reminder due now in one pass (for cron or manual runs)"""
     try:
         from app import app
         with app.app_context():
-            # Calculate the target time (7-8 hours before appointment)
+            scheduler = ReminderScheduler(app)
             now = datetime.now()
-            target_start = now + timedelta(hours=7)
-            target_end = now + timedelta(hours=8)
+            scheduler.refill(now)
+            queued = scheduler.send_due(now)
+            print(f"Queued {queued} reminders")
+            return queued
+    except Exception as e:
+        print(f"Error in reminder check: {str(e)}")
+        return 0
 
-            print(f"Checking for appointments between {target_start} and {target_end}")
 
-            # Find confirmed appointments that need reminders
-            appointments_needing_reminders = Appointment.query.filter(
-                Appointment.status == 'confirmed',
-                Appointment.appointment_date == target_start.date(),
-                Appointment.appointment_time >= target_start.time(),
-                Appointment.appointment_time <= target_end.time()
-            ).all()
-
-            print(f"Found {len(appointments_needing_reminders)} appointments needing reminders")nders)} appointments needing reminders")
-
-            for appointment in appointments_needing_reminders:
-                if appointment.patient.email:
-                    print(f"Sending reminder to {appointment.patient.email} for appointment on {appointment.appointment_date} at {appointment.appointment_time}")
-                    send_beautiful_reminder_email(
-                        appointment.patient.email,
-                        appointment.patient.full_name,
-                        appointment.appointment_date,
-                        appointment.appointment_time
-                    )
-                else:
-                    print(f"No email found for patient {appointment.patient.full_name}")
-
-        except Exception as e:
-            print(f"Error in reminder check: {str(e)}")
-
-def start_reminder_service():
-    """Start the reminder service that checks every hour"""
-    def reminder_loop():
-        while True:
-            try:
-                check_and_send_reminders()
-                # Sleep for 1 hour (3600 seconds)
-                time.sleep(3600)
-            except Exception as e:
-                print(f"Error in reminder service: {str(e)}")
-                time.sleep(300)  # Wait 5 minutes before retrying
+def start_reminder_service(app):
+    """Start the scheduler thread; it sends reminders while this process holds the lease"""
+    global _scheduler
+    lease = LeaderLease(app, 'reminders')
+    _scheduler = ReminderScheduler(app, lease=lease)
+    lease.on_elected = _scheduler.elected
+    lease.start()
 
     # Start the reminder service in a separate thread
-    reminder_thread = threading.Thread(target=reminder_loop, daemon=True)
+    reminder_thread = threading.Thread(target=_scheduler.run_forever, daemon=True)
     reminder_thread.start()
-    print("Reminder service started successfully")
+    print(f"Reminder service started ({describe_offsets(_scheduler.offsets)} before each appointment)")
+
 
 # Manual trigger function for testing
 def send_test_reminder(appointment_id):
@@ -363,6 +401,4 @@ def send_test_reminder(appointment_id):
                 )
     except Exception as e:
         print(f"Error sending test reminder: {str(e)}")
-        return False_time
-            )
-        return False
\ No newline at end of file
+    return False
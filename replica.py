@@ -0,0 +1,95 @@
+"""
+Read-replica routing
+
+When DATABASE_REPLICA_URL is set, the database is registered as the
+'replica' bind and views decorated with @replica_reads run their GET queries
+on it, taking reporting load off the primary that handles bookings. Writes,
+and every query in undecorated views, still go to the primary.
+
+Replicas lag behind the primary, so a user who has just written something
+would not see it on the next page. Each commit that flushed changes stamps
+the user's session, and for REPLICA_STICKY_SECONDS afterwards that user's
+reads stay on the primary (read-your-writes).
+
+To try it locally point DATABASE_REPLICA_URL at a second PostgreSQL
+instance replicating the first, or at a copy of a SQLite database file.
+"""
+
+import os
+import time
+from functools import wraps
+from flask import g, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+REPLICA_BIND = 'replica'
+REPLICA_STICKY_SECONDS = float(os.environ.get('DB_REPLICA_STICKY_SECONDS', 10))
+
+# Session key holding the time of the user's last write
+LAST_WRITE_KEY = '_db_last_write'
+
+
+def replica_url():
+    """The replica database URL from the environment, if one is configured"""
+    url = os.environ.get('DATABASE_REPLICA_URL')
+    if url and url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+class RoutingSession(Session):
+    """Session that sends reads to the replica inside @replica_reads views"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _reading_from_replica():
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _reading_from_replica():
+    try:
+        return g.get('use_replica', False)
+    except RuntimeError:
+        # Outside a request or app context (startup, reminder thread)
+        return False
+
+
+def _recently_wrote():
+    last_write = session.get(LAST_WRITE_KEY)
+    return last_write is not None and time.time() - last_write < REPLICA_STICKY_SECONDS
+
+
+def replica_reads(view):
+    """Run the queries of a view's GET requests on the read replica
+
+    Falls back to the primary when no replica is configured or the current
+    user wrote something in the last REPLICA_STICKY_SECONDS.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD') and not _recently_wrote():
+            g.use_replica = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.use_replica = False
+    return wrapper
+
+
+def init_replica(app, db):
+    """Stamp the user's session after requests whose transaction wrote data"""
+
+    @event.listens_for(db.session, 'after_flush')
+    def _mark_write(flush_session, flush_context):
+        try:
+            g.db_wrote = True
+        except RuntimeError:
+            pass
+
+    @app.after_request
+    def _remember_write(response):
+        if g.pop('db_wrote', False):
+            session[LAST_WRITE_KEY] = time.time()
+        return response
@@ -0,0 +1,264 @@
+"""
+Revenue reporting
+
+Revenue totals are read from the daily_revenue table rather than summed from
+raw payments and treatments. ORM events on Payment and Treatment adjust the
+affected day in the same transaction as the write, so the revenue page costs
+one row per day in the requested range regardless of how much history the
+clinic has.
+
+Appointment revenue counts completed payments on the day they were created;
+treatment revenue counts treatments on their treatment date. Cancelling an
+appointment cancels its payment (see patient_cancel_appointment and
+admin_appointment_view), which removes it from the totals.
+
+Like the dashboard counters, bulk query.update()/delete() calls bypass the
+events; a bulk payment status change calls adjust_payment_statuses() in its
+own transaction, and other maintenance should run rebuild_daily_revenue().
+"""
+
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from sqlalchemy import Date, cast, event, func
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from models import Payment, Treatment, DailyRevenue
+from orm_history import previous, track_previous
+
+GRANULARITIES = ('day', 'week', 'month')
+DEFAULT_RANGE_DAYS = 30
+
+
+def _add_to_day(connection, day, appointment_revenue=0.0, treatment_revenue=0.0, payment_count=0, treatment_count=0):
+    """Add amounts to one day's totals, creating the row if needed"""
+    table = DailyRevenue.__table__
+    values = {
+        'day': day,
+        'appointment_revenue': appointment_revenue,
+        'treatment_revenue': treatment_revenue,
+        'payment_count': payment_count,
+        'treatment_count': treatment_count,
+        'updated_at': datetime.utcnow(),
+    }
+    increments = ('appointment_revenue', 'treatment_revenue', 'payment_count', 'treatment_count')
+
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        stmt = insert(table).values(**values)
+        update_values = {column: table.c[column] + stmt.excluded[column] for column in increments}
+        update_values['updated_at'] = stmt.excluded.updated_at
+        connection.execute(stmt.on_conflict_do_update(index_elements=[table.c.day], set_=update_values))
+        return
+
+    result = connection.execute(
+        table.update()
+        .where(table.c.day == day)
+        .values(**{column: table.c[column] + values[column] for column in increments}, updated_at=values['updated_at'])
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**values))
+
+
+def _payment_contribution(status, amount, created_at):
+    if status != 'completed' or created_at is None:
+        return None
+    return created_at.date(), amount or 0.0
+
+
+def _treatment_contribution(amount, treatment_date):
+    if treatment_date is None:
+        return None
+    return treatment_date, amount or 0.0
+
+
+def _apply_payment(connection, contribution, sign):
+    if contribution:
+        day, amount = contribution
+        _add_to_day(connection, day, appointment_revenue=sign * amount, payment_count=sign)
+
+
+def _apply_treatment(connection, contribution, sign):
+    if contribution:
+        day, amount = contribution
+        _add_to_day(connection, day, treatment_revenue=sign * amount, treatment_count=sign)
+
+
+# The update handlers remove the old contribution
+track_previous(Payment.status, Payment.amount, Payment.created_at, Treatment.amount, Treatment.treatment_date)
+
+
+@event.listens_for(Payment, 'after_insert')
+def _payment_inserted(mapper, connection, target):
+    _apply_payment(connection, _payment_contribution(target.status, target.amount, target.created_at), 1)
+
+
+@event.listens_for(Payment, 'after_update')
+def _payment_updated(mapper, connection, target):
+    old = _payment_contribution(
+        previous(target, 'status'), previous(target, 'amount'), previous(target, 'created_at')
+    )
+    new = _payment_contribution(target.status, target.amount, target.created_at)
+    if old != new:
+        _apply_payment(connection, old, -1)
+        _apply_payment(connection, new, 1)
+
+
+@event.listens_for(Payment, 'after_delete')
+def _payment_deleted(mapper, connection, target):
+    _apply_payment(connection, _payment_contribution(target.status, target.amount, target.created_at), -1)
+
+
+@event.listens_for(Treatment, 'after_insert')
+def _treatment_inserted(mapper, connection, target):
+    _apply_treatment(connection, _treatment_contribution(target.amount, target.treatment_date), 1)
+
+
+@event.listens_for(Treatment, 'after_update')
+def _treatment_updated(mapper, connection, target):
+    old = _treatment_contribution(previous(target, 'amount'), previous(target, 'treatment_date'))
+    new = _treatment_contribution(target.amount, target.treatment_date)
+    if old != new:
+        _apply_treatment(connection, old, -1)
+        _apply_treatment(connection, new, 1)
+
+
+@event.listens_for(Treatment, 'after_delete')
+def _treatment_deleted(mapper, connection, target):
+    _apply_treatment(connection, _treatment_contribution(target.amount, target.treatment_date), -1)
+
+
+def adjust_payment_statuses(connection, payments, new_status):
+    """Update daily totals after a bulk UPDATE set these payments to `new_status`
+
+    `payments` holds the (status, amount, created_at) of each payment before
+    the update. Changes are summed per day, so each affected day is written once.
+    """
+    days = defaultdict(lambda: [0.0, 0])
+    for status, amount, created_at in payments:
+        old = _payment_contribution(status, amount, created_at)
+        new = _payment_contribution(new_status, amount, created_at)
+        if old == new:
+            continue
+        for contribution, sign in ((old, -1), (new, 1)):
+            if contribution:
+                day, value = contribution
+                days[day][0] += sign * value
+                days[day][1] += sign
+    for day, (amount, count) in days.items():
+        if amount or count:
+            _add_to_day(connection, day, appointment_revenue=amount, payment_count=count)
+
+
+def rebuild_daily_revenue():
+    """Recompute the daily_revenue table from payments and treatments"""
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite's CAST(... AS DATE) yields a number, not a date
+        payment_day = func.date(Payment.created_at)
+    else:
+        payment_day = cast(Payment.created_at, Date)
+    payments = (
+        db.session.query(payment_day, func.sum(Payment.amount), func.count(Payment.id))
+        .filter(Payment.status == 'completed')
+        .group_by(payment_day)
+        .all()
+    )
+    treatments = (
+        db.session.query(Treatment.treatment_date, func.sum(Treatment.amount), func.count(Treatment.id))
+        .group_by(Treatment.treatment_date)
+        .all()
+    )
+
+    days = {}
+    for day, amount, count in payments:
+        row = days.setdefault(_as_date(day), DailyRevenue(day=_as_date(day), treatment_revenue=0.0, treatment_count=0))
+        row.appointment_revenue = amount or 0.0
+        row.payment_count = count
+    for day, amount, count in treatments:
+        row = days.setdefault(_as_date(day), DailyRevenue(day=_as_date(day), appointment_revenue=0.0, payment_count=0))
+        row.treatment_revenue = amount or 0.0
+        row.treatment_count = count
+
+    DailyRevenue.query.delete()
+    db.session.add_all(days.values())
+    db.session.commit()
+    return len(days)
+
+
+def ensure_daily_revenue():
+    """Backfill daily_revenue the first time it is deployed on existing data"""
+    if DailyRevenue.query.first() is None and (Payment.query.first() or Treatment.query.first()):
+        rebuilt = rebuild_daily_revenue()
+        print(f'Daily revenue rebuilt for {rebuilt} days')
+
+
+def _as_date(value):
+    """Normalise a date returned by the database (SQLite returns strings)"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def _period(granularity):
+    """SQL expression for the start of the day/week/month containing each row"""
+    if granularity == 'day':
+        return DailyRevenue.day
+    if db.engine.dialect.name == 'sqlite':
+        if granularity == 'week':
+            # Monday on or before the day
+            return func.date(DailyRevenue.day, '-6 days', 'weekday 1')
+        return func.strftime('%Y-%m-01', DailyRevenue.day)
+    return cast(func.date_trunc(granularity, DailyRevenue.day), Date)
+
+
+def _in_range(query, start, end):
+    if start:
+        query = query.filter(DailyRevenue.day >= start)
+    if end:
+        query = query.filter(DailyRevenue.day <= end)
+    return query
+
+
+def revenue_totals(start=None, end=None):
+    """Revenue totals between two dates (inclusive); open-ended if omitted"""
+    row = _in_range(db.session.query(
+        func.coalesce(func.sum(DailyRevenue.appointment_revenue), 0.0),
+        func.coalesce(func.sum(DailyRevenue.treatment_revenue), 0.0),
+        func.coalesce(func.sum(DailyRevenue.payment_count), 0),
+        func.coalesce(func.sum(DailyRevenue.treatment_count), 0),
+    ), start, end).one()
+    return {
+        'appointment_revenue': row[0],
+        'treatment_revenue': row[1],
+        'total_revenue': row[0] + row[1],
+        'payment_count': row[2],
+        'treatment_count': row[3],
+    }
+
+
+def revenue_rollup(granularity='day', start=None, end=None):
+    """Revenue grouped by day, week or month between two dates, oldest first"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'Unknown granularity: {granularity}')
+
+    period = _period(granularity).label('period')
+    rows = _in_range(db.session.query(
+        period,
+        func.sum(DailyRevenue.appointment_revenue),
+        func.sum(DailyRevenue.treatment_revenue),
+    ), start, end).group_by(period).order_by(period).all()
+
+    return [{
+        'period': _as_date(row[0]),
+        'appointment_revenue': row[1] or 0.0,
+        'treatment_revenue': row[2] or 0.0,
+        'total_revenue': (row[1] or 0.0) + (row[2] or 0.0),
+    } for row in rows]
+
+
+def default_range():
+    """The last DEFAULT_RANGE_DAYS days, ending today"""
+    today = datetime.now().date()
+    return today - timedelta(days=DEFAULT_RANGE_DAYS - 1), today
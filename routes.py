@@ -1,22 +1,43 @@
 import os
-import random
-import string
 from datetime import datetime, timedelta
 from flask import render_template, request, redirect, url_for, flash, jsonify, session
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from sqlalchemy import desc
+from sqlalchemy.orm import selectinload
 from flask_login import login_user, logout_user, current_user, login_required, LoginManager
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField
 from wtforms.validators import DataRequired, Email
 from app import app, db, login_manager
-from models import Patient, Appointment, MedicalRecord, Payment, Review, Admin, OTP, Doctor, Assistant, Salary, Treatment, DoctorPrescription, OptometristPrescription
+from models import Patient, Appointment, MedicalRecord, Payment, Review, Admin, Doctor, Assistant, Salary, Treatment, DoctorPrescription, OptometristPrescription, ReconciliationRun, ReconciliationChange
 from forms import (
     AppointmentForm, PaymentForm, ReviewForm, DoctorLoginForm, AssistantLoginForm, AdminLoginForm, PrescriptionForm, DoctorPrescriptionForm, OptometristPrescriptionForm, SalaryForm, FindAppointmentForm
 )
-import requests
+from queries import (
+    appointments_on_date, patient_appointments_query, payments_with_patients, treatments_with_patients,
+    appointment_tab_queries, patient_list_query, latest_optometrist_prescription, latest_doctor_prescription,
+    doctor_prescription_detail, patient_with_prescription_summaries, medical_record_for, PATIENT_ORDER, REVIEW_ORDER
+)
+from pagination import paginate_request, wants_json
+from search import search_patients, patient_match_clause, DEFAULT_LIMIT as SEARCH_DEFAULT_LIMIT
+from dashboard_stats import dashboard_stats
+from slots import (
+    available_slots as slot_availability, MAX_RANGE_DAYS as SLOT_MAX_RANGE_DAYS,
+    SlotUnavailable, invalidate_days as invalidate_slot_days
+)
+from db_pool import pool_stats
+from replica import replica_reads, REPLICA_BIND
+from user_cache import invalidate_user, user_cache_stats
+from notifications import queue_notification
+from bulk_appointments import bulk_update_appointments, parse_ids, summarize, BulkActionError
+from reconciliation import request_full_run, recent_runs
+from payroll import payroll_totals, assistant_salary_summary, salary_ledger_page
+from page_cache import cached_page, invalidate_pages, page_cache_stats
+from idempotency import new_booking_key, clean_key, find_booking, record_booking, booking_details, is_duplicate_key_error, ensure_payment
+from reminder_system import describe_offsets, reminder_status
+from leader import lease_status
+from mail_transport import transport_stats
+from otp_store import issue_otp, check_otp, OTP_EXPIRED, OTP_INVALID, OTP_MISSING, OTP_TTL_MINUTES
+from revenue import revenue_totals, revenue_rollup, default_range, GRANULARITIES as REVENUE_GRANULARITIES
 from urllib.parse import urlencode
 
 # Set the login view to the authentication selection page
@@ -28,6 +49,7 @@ def inject_now():
     return {'now': datetime.now()}
 
 @app.route('/')
+@cached_page('reviews')
 def index():
     """Home page route"""
 
@@ -37,16 +59,19 @@ def index():
     return render_template('index.html', reviews=recent_reviews)
 
 @app.route('/services')
+@cached_page()
 def services():
     """Services page route"""
     return render_template('services.html')
 
 @app.route('/location')
+@cached_page()
 def location():
     """Location page route"""
     return render_template('location.html')
 
 @app.route('/reviews', methods=['GET', 'POST'])
+@cached_page('reviews')
 def reviews():
     """Reviews page route with submission form"""
     form = ReviewForm()
@@ -62,6 +87,7 @@ def reviews():
         db.session.add(new_review)
         try:
             db.session.commit()
+            invalidate_pages('reviews')
             flash('Thank you for your review! It will be displayed after approval.', 'success')
             return redirect(url_for('reviews'))
         except Exception as e:
@@ -86,6 +112,15 @@ def appointment():
             form.age.data = current_user.age
 
     if form.validate_on_submit():
+        # A resubmitted form (double click, browser retry) gets the booking its first submission made
+        booking_key = clean_key(form.idempotency_key.data or request.headers.get('Idempotency-Key'))
+        previous_id = find_booking(booking_key)
+        if previous_id:
+            previous = db.session.get(Appointment, previous_id)
+            session['appointment_id'] = previous.id
+            session['appointment_details'] = booking_details(previous)
+            return redirect(url_for('payment'))
+
         if current_user.is_authenticated and isinstance(current_user, Patient):
             # Use the logged in patient
             patient = current_user
@@ -115,45 +150,43 @@ def appointment():
             status='scheduled'
         )
         db.session.add(new_appointment)
+        record_booking(booking_key, new_appointment)
 
         try:
+            # Queue the application email with the booking
+            queue_notification(patient.email, 'appointment_submitted',
+                               patient_name=patient.full_name,
+                               appointment_date=new_appointment.appointment_date,
+                               appointment_time=new_appointment.appointment_time,
+                               primary_issue=new_appointment.primary_issue)
+
             db.session.commit()
             # Store appointment ID and details in session for payment and success pages
             session['appointment_id'] = new_appointment.id
-            session['appointment_details'] = {
-                'patient_name': patient.full_name,
-                'appointment_date': new_appointment.appointment_date.strftime('%A, %B %d, %Y'),
-                'appointment_time': new_appointment.appointment_time.strftime('%I:%M %p')
-            }
-
-            # Send appointment application email
-            subject = "Appointment Application Submitted - Dr. Richa's Eye Clinic"
-            message = f"""
-Dear {patient.full_name},
-
-Thank you for submitting your appointment application. Your request has been received and is pending confirmation from our medical team.
-
-Appointment Details:
-- Date: {new_appointment.appointment_date.strftime('%d %B, %Y')}
-- Time: {new_appointment.appointment_time.strftime('%I:%M %p')}
-- Primary Issue: {new_appointment.primary_issue}
-
-We will send you a confirmation email once your appointment is approved by Dr. Richa.
-
-Location: First floor, DVR Town Centre, near to IGUS private limited, 
-Mandur, Budigere Road (New Airport Road), Bengaluru, Karnataka 560049
-
-Best regards,
-Dr. Richa's Eye Clinic
-"""
-            send_email_notification(patient.email, subject, message)
+            session['appointment_details'] = booking_details(new_appointment)
 
             return redirect(url_for('payment'))
+        except SlotUnavailable as e:
+            # Another booking took the last place while this form was open
+            db.session.rollback()
+            invalidate_slot_days([e.day])
+            flash(f'{str(e)}. Please choose another time.', 'warning')
+            return redirect(url_for('appointment'))
         except Exception as e:
             db.session.rollback()
+            previous_id = find_booking(booking_key) if is_duplicate_key_error(e, booking_key) else None
+            if previous_id:
+                # A concurrent submission of the same form committed first
+                session['appointment_id'] = previous_id
+                session['appointment_details'] = booking_details(db.session.get(Appointment, previous_id))
+                return redirect(url_for('payment'))
             flash(f'Error booking appointment: {str(e)}', 'danger')
             return redirect(url_for('appointment'))
 
+    # Each rendering of the form gets a key for its submission
+    if not form.idempotency_key.data:
+        form.idempotency_key.data = new_booking_key()
+
     # Pass default date (tomorrow) and available time slots to the template
     tomorrow = datetime.now() + timedelta(days=1)
     default_date = tomorrow.strftime('%Y-%m-%d')
@@ -174,18 +207,12 @@ def payment():
         appointment = Appointment.query.get_or_404(appointment_id)
         consultation_fee = 500.00
 
-        # Create payment record - cash payment at clinic
-        new_payment = Payment(
-            appointment_id=appointment_id,
-            amount=consultation_fee,
-            payment_method='cash',
-            status='pending'
-        )
-        db.session.add(new_payment)
-
-        # Update appointment payment status
-        appointment.payment_status = 'pending'
-        db.session.commit()
+        # Create the payment record - cash payment at clinic; a repeat visit finds the first one
+        payment_record, created = ensure_payment(appointment, consultation_fee, payment_method='cash', status='pending')
+        if created:
+            # Update appointment payment status
+            appointment.payment_status = 'pending'
+            db.session.commit()
 
         flash('Appointment booked successfully! Please pay ₹500 at the clinic.', 'success')
         return redirect(url_for('success'))
@@ -262,54 +289,115 @@ def staff_verify_appointment():
 # API route for checking available time slots
 @app.route('/api/available-slots', methods=['GET'])
 def available_slots():
+    """Free slots for one date (?date=) or for every date in a range (?start=&end=)
+
+    A single date returns a list of times as before; a range returns
+    {"YYYY-MM-DD": [times], ...} computed from one query.
+    """
     selected_date = request.args.get('date')
+    start = request.args.get('start')
+    end = request.args.get('end')
 
     # If no date provided, return empty list
-    if not selected_date:
+    if not (selected_date or start):
         return jsonify([])
 
     try:
-        # Convert selected_date string to date object
-        selected_date = datetime.strptime(selected_date, '%Y-%m-%d').date()
-
-        # Check if the selected date is Sunday (weekday 6)
-        is_sunday = selected_date.weekday() == 6
-
-        # Define available slots based on day of week
-        if is_sunday:
-            # Sunday slots (10 AM to 1 PM with 30-minute intervals)
-            all_slots = [
-                "10:00", "10:30", "11:00", "11:30", "12:00", "12:30", "13:00"
-            ]
-        else:
-            # Monday to Saturday slots (5 PM to 8 PM with 30-minute intervals)
-            all_slots = [
-                "17:00", "17:30", "18:00", "18:30", "19:00", "19:30", "20:00"
-            ]
-
-        # Get all non-cancelled appointments for the selected date
-        booked_appointments = Appointment.query.filter_by(
-            appointment_date=selected_date
-        ).filter(Appointment.status != 'cancelled').all()
-
-        # Count appointments per time slot
-        slot_counts = {}
-        for appointment in booked_appointments:
-            time_str = appointment.appointment_time.strftime('%H:%M')
-            slot_counts[time_str] = slot_counts.get(time_str, 0) + 1
-
-        # Filter out slots that have 3 or more appointments (full capacity)
-        available_slots = []
-        for slot in all_slots:
-            appointments_in_slot = slot_counts.get(slot, 0)
-            if appointments_in_slot < 3:  # Allow up to 3 appointments per slot
-                available_slots.append(slot)
-
-        return jsonify(available_slots)
+        if selected_date:
+            # Convert selected_date string to date object
+            selected_date = datetime.strptime(selected_date, '%Y-%m-%d').date()
+            return jsonify(slot_availability(selected_date)[selected_date])
+
+        start = datetime.strptime(start, '%Y-%m-%d').date()
+        end = datetime.strptime(end, '%Y-%m-%d').date() if end else start
+        if end < start:
+            return jsonify({"error": "end must not be before start"}), 400
+        if (end - start).days >= SLOT_MAX_RANGE_DAYS:
+            return jsonify({"error": f"Date range is limited to {SLOT_MAX_RANGE_DAYS} days"}), 400
+
+        availability = slot_availability(start, end)
+        return jsonify({day.isoformat(): times for day, times in availability.items()})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 
+# API route for staff patient typeahead
+@app.route('/api/patients/search', methods=['GET'])
+@login_required
+def api_patient_search():
+    """Return the best matching patients for a partial name, mobile number or email"""
+    if not (isinstance(current_user, Admin) or isinstance(current_user, Doctor) or isinstance(current_user, Assistant)):
+        return jsonify({"error": "Staff privileges required"}), 403
+
+    try:
+        limit = int(request.args.get('limit', SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        limit = SEARCH_DEFAULT_LIMIT
+
+    patients = search_patients(request.args.get('q', ''), limit=limit)
+    return jsonify([patient.to_dict() for patient in patients])
+
+
+# API route for database connection pool metrics
+@app.route('/api/pool-stats', methods=['GET'])
+@login_required
+def api_pool_stats():
+    """Connection pool usage and checkout wait times for the worker serving the request"""
+    if not (isinstance(current_user, Admin) or isinstance(current_user, Doctor)):
+        return jsonify({"error": "Admin privileges required"}), 403
+
+    stats = pool_stats(db.engine)
+    if REPLICA_BIND in db.engines:
+        stats['replica'] = pool_stats(db.engines[REPLICA_BIND], REPLICA_BIND)
+    return jsonify(stats)
+
+
+# API route for logged-in user cache metrics
+@app.route('/api/user-cache-stats', methods=['GET'])
+@login_required
+def api_user_cache_stats():
+    """Hit rate of the user loader cache for the worker serving the request"""
+    if not (isinstance(current_user, Admin) or isinstance(current_user, Doctor)):
+        return jsonify({"error": "Admin privileges required"}), 403
+
+    return jsonify(user_cache_stats())
+
+
+# API route for SMTP transport metrics
+@app.route('/api/mail-stats', methods=['GET'])
+@login_required
+def api_mail_stats():
+    """SMTP connection reuse and send totals for the worker serving the request"""
+    if not (isinstance(current_user, Admin) or isinstance(current_user, Doctor)):
+        return jsonify({"error": "Admin privileges required"}), 403
+
+    return jsonify(transport_stats())
+
+
+# API route for public page cache metrics
+@app.route('/api/page-cache-stats', methods=['GET'])
+@login_required
+def api_page_cache_stats():
+    """Hit rate of the public page cache for the worker serving the request"""
+    if not (isinstance(current_user, Admin) or isinstance(current_user, Doctor)):
+        return jsonify({"error": "Admin privileges required"}), 403
+
+    return jsonify(page_cache_stats())
+
+
+# API route showing which process runs each background job
+@app.route('/api/leader-status', methods=['GET'])
+@login_required
+def api_leader_status():
+    """Job lease holders, plus the reminder scheduler as seen by the worker serving the request"""
+    if not (isinstance(current_user, Admin) or isinstance(current_user, Doctor)):
+        return jsonify({"error": "Admin privileges required"}), 403
+
+    status = lease_status()
+    status['reminders'] = reminder_status()
+    return jsonify(status)
+
+
 # Patient Authentication Routes
 @app.route('/patient/register', methods=['GET', 'POST'])
 def patient_register():
@@ -337,18 +425,8 @@ def patient_register():
 
             # If email is provided, use OTP verification
             if form.email.data:
-                # Generate 6-digit OTP
-                otp_code = ''.join(random.choices(string.digits, k=6))
-                expires_at = datetime.utcnow() + timedelta(minutes=30)
-
-                # Store OTP in database
-                new_otp = OTP(
-                    email=form.email.data,
-                    otp_code=otp_code,
-                    expires_at=expires_at
-                )
-                db.session.add(new_otp)
-                db.session.commit()
+                # Generate and store a 6-digit OTP
+                otp_code = issue_otp(form.email.data)
 
                 # Store registration data in session
                 session['registration_data'] = {
@@ -360,24 +438,12 @@ def patient_register():
                     'password': form.password.data
                 }
 
-                # Send OTP via email
-                subject = "Your OTP for Dr. Richa's Eye Clinic Registration"
-                message = f"""
-Dear {form.full_name.data},
-
-Your OTP for registration is: {otp_code}
-
-This OTP will expire in 30 minutes.
-
-Best regards,
-Dr. Richa's Eye Clinic
-                """
-                try:
-                    send_email_notification(form.email.data, subject, message)
-                    flash('OTP has been sent to your email address', 'success')
-                except Exception as email_error:
-                    print(f"Email error: {str(email_error)}")
-                    flash('Registration completed! Please proceed to login.', 'info')
+                # Queue the OTP email
+                queue_notification(form.email.data, 'otp', purpose='registration',
+                                   patient_name=form.full_name.data, otp_code=otp_code,
+                                   ttl_minutes=OTP_TTL_MINUTES)
+                db.session.commit()
+                flash('OTP has been sent to your email address', 'success')
 
                 return redirect(url_for('verify_otp', email=form.email.data))
 
@@ -425,21 +491,18 @@ def verify_otp(email):
     form.email.data = email
 
     if form.validate_on_submit():
-        # Find the most recent OTP for this email
-        otp_record = OTP.query.filter_by(
-            email=email,
-            is_verified=False
-        ).order_by(desc(OTP.created_at)).first()
+        # Check the latest OTP sent to this email; a valid one is used up
+        otp_status = check_otp(email, form.otp.data)
 
-        if not otp_record:
+        if otp_status == OTP_MISSING:
             flash('OTP record not found or already verified. Please request a new OTP.', 'danger')
             return redirect(url_for('patient_register'))
 
-        if otp_record.is_expired():
+        if otp_status == OTP_EXPIRED:
             flash('OTP has expired. Please request a new OTP.', 'danger')
             return redirect(url_for('patient_register'))
 
-        if otp_record.otp_code != form.otp.data:
+        if otp_status == OTP_INVALID:
             flash('Invalid OTP. Please try again.', 'danger')
             return redirect(url_for('verify_otp', email=email))
 
@@ -455,9 +518,6 @@ def verify_otp(email):
         )
         new_patient.set_password(registration_data['password'])
 
-        # Mark OTP as verified
-        otp_record.is_verified = True
-
         db.session.add(new_patient)
 
         try:
@@ -511,39 +571,16 @@ def patient_gmail_login():
             db.session.add(patient)
             db.session.flush()
 
-        # Generate 6-digit OTP
-        otp_code = ''.join(random.choices(string.digits, k=6))
-
-        # Set expiry time (30 minutes)
-        expires_at = datetime.utcnow() + timedelta(minutes=30)
-
-        # Store OTP in database
-        new_otp = OTP(
-            email=email,
-            otp_code=otp_code,
-            expires_at=expires_at
-        )
-        db.session.add(new_otp)
-
         try:
-            db.session.commit()
-
-            # Send OTP via email
-            subject = "Your OTP for Dr. Richa's Eye Clinic Login"
-            message = f"""
-            Dear {patient.full_name if patient else "User"},
-
-            Your OTP for login is: {otp_code}
+            # Generate and store a 6-digit OTP
+            otp_code = issue_otp(email)
 
-            This OTP will expire in 30 minutes.
-
-            Best regards,
-            Dr. Richa's Eye Clinic
-            """
-            if send_email_notification(email, subject, message):
-                flash('OTP has been sent to your email address', 'success')
-            else:
-                flash('Error sending OTP. Please try again.', 'danger')
+            # Queue the OTP email with the patient record
+            queue_notification(email, 'otp', purpose='login',
+                               patient_name=patient.full_name if patient else None, otp_code=otp_code,
+                               ttl_minutes=OTP_TTL_MINUTES)
+            db.session.commit()
+            flash('OTP has been sent to your email address', 'success')
 
             # Redirect to OTP verification page
             return redirect(url_for('verify_login_otp', email=email))
@@ -566,28 +603,21 @@ def verify_login_otp(email):
     form.email.data = email
 
     if form.validate_on_submit():
-        # Find the most recent OTP for this email
-        otp_record = OTP.query.filter_by(
-            email=email,
-            is_verified=False
-        ).order_by(desc(OTP.created_at)).first()
+        # Check the latest OTP sent to this email; a valid one is used up
+        otp_status = check_otp(email, form.otp.data)
 
-        if not otp_record:
+        if otp_status == OTP_MISSING:
             flash('OTP record not found or already verified. Please request a new OTP.', 'danger')
             return redirect(url_for('patient_gmail_login'))
 
-        if otp_record.is_expired():
+        if otp_status == OTP_EXPIRED:
             flash('OTP has expired. Please request a new OTP.', 'danger')
             return redirect(url_for('patient_gmail_login'))
 
-        # Check if OTP matches
-        if otp_record.otp_code != form.otp.data:
+        if otp_status == OTP_INVALID:
             flash('Invalid OTP. Please try again.', 'danger')
             return redirect(url_for('verify_login_otp', email=email))
 
-        # Mark OTP as verified
-        otp_record.is_verified = True
-
         # Find the patient with this email
         patient = Patient.query.filter_by(email=email).first()
 
@@ -657,7 +687,7 @@ def patient_logout():
 def patient_dashboard():
     """Patient dashboard route"""
     # Get patient's appointments
-    appointments = Appointment.query.filter_by(patient_id=current_user.id).order_by(desc(Appointment.appointment_date), desc(Appointment.appointment_time)).all()
+    appointments = patient_appointments_query(current_user.id).all()
 
     return render_template('patient/dashboard.html', appointments=appointments)
 
@@ -699,28 +729,14 @@ def patient_cancel_appointment(appointment_id):
         if appointment.payment:
             appointment.payment.status = 'cancelled'
 
-        db.session.commit()
-
-        # Send email notification to clinic and patient
-        clinic_message = f"""
-        Appointment Cancellation Notice
+        # Queue email notifications to clinic and patient with the cancellation
+        cancellation = dict(patient_name=appointment.patient.full_name,
+                            appointment_date=appointment.appointment_date,
+                            appointment_time=appointment.appointment_time)
+        queue_notification(app.config['MAIL_USERNAME'], 'cancellation_clinic', **cancellation)
+        queue_notification(appointment.patient.email, 'cancellation_patient', **cancellation)
 
-        Patient: {appointment.patient.full_name}
-        Date: {appointment.appointment_date}
-        Time: {appointment.appointment_time}
-
-        The appointment has been cancelled by the patient.
-        """
-        patient_message = f"""
-        Dear {appointment.patient.full_name},
-
-        Your appointment scheduled for {appointment.appointment_date.strftime('%d %B, %Y')} at {appointment.appointment_time.strftime('%I:%M %p')} has been cancelled.  We apologize for any inconvenience.
-
-        Best regards,
-        Dr. Richa's Eye Clinic
-        """
-        send_email_notification(app.config['MAIL_USERNAME'], "Appointment Cancellation", clinic_message)
-        send_email_notification(appointment.patient.email, "Appointment Cancellation", patient_message)
+        db.session.commit()
 
         flash('Appointment cancelled successfully.', 'success')
     except Exception as e:
@@ -757,6 +773,8 @@ def patient_complete_profile():
             current_user.sex = form.sex.data
 
             db.session.commit()
+            # Serve the updated profile on the next request
+            invalidate_user(current_user.get_id())
             flash('Profile completed successfully!', 'success')
             return redirect(url_for('patient_dashboard'))
         except Exception as e:
@@ -814,6 +832,8 @@ def patient_edit_profile():
             current_user.sex = form.sex.data
 
             db.session.commit()
+            # Serve the updated profile on the next request
+            invalidate_user(current_user.get_id())
             flash('Profile updated successfully!', 'success')
             return redirect(url_for('patient_dashboard'))
         except Exception as e:
@@ -824,8 +844,12 @@ def patient_edit_profile():
 
 @app.route('/patient/medical-records')
 @login_required
+@replica_reads
 def patient_medical_records():
     """Patient medical records route"""
+    # Load prescription summaries shown on the page in one query
+    patient_with_prescription_summaries(current_user.id)
+
     # Get patient's appointments with medical records
     appointments = (
         db.session.query(Appointment)
@@ -923,125 +947,29 @@ def assistant_dashboard():
         return redirect(url_for('index'))
 
     try:
-        # Get statistics
-        today = datetime.now().date()
-        upcoming_appointments = Appointment.query.filter(
-            Appointment.appointment_date >= today,
-            Appointment.status == 'scheduled'
-        ).count()
-
-        total_appointments = Appointment.query.count()
-        total_patients = Patient.query.count()
-        prescriptions_count = OptometristPrescription.query.filter_by(assistant_id=current_user.id).count()
-
-        # Get salary records
-        salary_records = Salary.query.filter_by(
-            assistant_id=current_user.id
-        ).order_by(desc(Salary.payment_date)).all()
+        # Get statistics in one query
+        stats = dashboard_stats(assistant_id=current_user.id)
 
-        return render_template(
-            'assistant/optometrist_dashboard.html',
-            upcoming_appointments=upcoming_appointments,
-            total_appointments=total_appointments,
-            total_patients=total_patients,
-            prescriptions_count=prescriptions_count,
-            salary_records=salary_records
-        )
-    except Exception as e:
-        flash(f'Error loading dashboard: {str(e)}', 'danger')
-        return redirect(url_for('index'))
-
-    try:
-        # Create form for CSRF token
-        form = FlaskForm()
-
-        # Get all patients
-        all_patients = Patient.query.order_by(Patient.full_name).all()
-
-        # Get today's appointments
-        today = datetime.now().date()
-        today_appointments = Appointment.query.filter_by(appointment_date=today).all()
-
-        # Get all appointments
-        all_appointments = Appointment.query.order_by(desc(Appointment.appointment_date)).all()
-
-        # Get upcoming appointments count
-        upcoming_appointments = Appointment.query.filter(
-            Appointment.appointment_date >= today,
-            Appointment.status == 'scheduled'
-        ).count()
-
-        # Get total appointments
-        total_appointments = Appointment.query.count()
-
-        # Get total patients
-        total_patients = Patient.query.count()
-
-        # Get salary records
-        salary_records = Salary.query.filter_by(assistant_id=current_user.id).order_by(desc(Salary.payment_date)).all()
+        # Salary totals from the summary rows, and one page of recent records
+        salary_summary = assistant_salary_summary(current_user.id)
+        salary_page = salary_ledger_page(assistant_id=current_user.id)
+        if wants_json():
+            return jsonify(dict(salary_page.to_dict(), summary=salary_summary))
 
         return render_template(
-            'assistant/dashboard.html',
-            form=form,
-            all_patients=all_patients,
-            today_appointments=today_appointments,
-            all_appointments=all_appointments,
-            upcoming_appointments=upcoming_appointments,
-            total_appointments=total_appointments,
-            total_patients=total_patients,
-            salary_records=salary_records
+            'assistant/optometrist_dashboard.html',
+            upcoming_appointments=stats['upcoming_appointments'],
+            total_appointments=stats['total_appointments'],
+            total_patients=stats['total_patients'],
+            prescriptions_count=stats['prescriptions_count'],
+            salary_records=salary_page.items,
+            salary_page=salary_page,
+            salary_summary=salary_summary
         )
     except Exception as e:
         flash(f'Error loading dashboard: {str(e)}', 'danger')
         return redirect(url_for('index'))
 
-    try:
-        # Get all patients
-        all_patients = db.session.query(
-            Patient.id, 
-            Patient.full_name, 
-            Patient.mobile_number, 
-            Patient.email, 
-            Patient.age, 
-            Patient.is_registered
-        ).all()
-
-        # Get today's appointments
-        today = datetime.now().date()
-        today_appointments = Appointment.query.filter_by(appointment_date=today).all()
-
-        # Get all appointments
-        all_appointments = Appointment.query.order_by(desc(Appointment.appointment_date)).all()
-
-        # Get upcoming appointments
-        upcoming_appointments = Appointment.query.filter(
-            Appointment.appointment_date >= today,
-            Appointment.status == 'scheduled'
-        ).count()
-
-        # Get total appointments
-        total_appointments = Appointment.query.count()
-
-        # Get total patients
-        total_patients = Patient.query.count()
-
-        # Get salary records for current assistant
-        salary_records = Salary.query.filter_by(assistant_id=current_user.id).order_by(desc(Salary.payment_date)).all()
-    except Exception as e:
-        flash(f'Error loading dashboard data: {str(e)}', 'danger')
-        return redirect(url_for('index'))
-
-    return render_template(
-        'assistant/dashboard.html',
-        all_patients=all_patients,
-        today_appointments=today_appointments,
-        all_appointments=all_appointments,
-        upcoming_appointments=upcoming_appointments,
-        total_appointments=total_appointments,
-        total_patients=total_patients,
-        salary_records=salary_records
-    )
-
 
 # Admin/Doctor Authentication Routes
 @app.route('/admin/login', methods=['GET', 'POST'])
@@ -1085,31 +1013,23 @@ def admin_dashboard():
         flash('Access denied. Staff privileges required.', 'danger')
         return redirect(url_for('index'))
 
-    # Get counts for dashboard
-    total_patients = Patient.query.count()
-    total_appointments = Appointment.query.count()
-    upcoming_appointments = Appointment.query.filter(
-        Appointment.appointment_date >= datetime.now().date(),
-        Appointment.status == 'scheduled'
-    ).count()
-    pending_reviews = Review.query.filter_by(is_approved=False).count()
+    # Get counts for dashboard in one query
+    stats = dashboard_stats()
 
     # Today's appointments
-    today_appointments = Appointment.query.filter(
-        Appointment.appointment_date == datetime.now().date(),
-        Appointment.status == 'scheduled'
-    ).order_by(Appointment.appointment_time).all()
+    today_appointments = appointments_on_date(datetime.now().date(), status='scheduled')
 
     return render_template('admin/dashboard.html', 
-                          total_patients=total_patients,
-                          total_appointments=total_appointments,
-                          upcoming_appointments=upcoming_appointments,
-                          pending_reviews=pending_reviews,
+                          total_patients=stats['total_patients'],
+                          total_appointments=stats['total_appointments'],
+                          upcoming_appointments=stats['upcoming_appointments'],
+                          pending_reviews=stats['pending_reviews'],
                           today_appointments=today_appointments)
 
 
 @app.route('/admin/appointments')
 @login_required
+@replica_reads
 def admin_appointments():
     """Admin appointments management route"""
     # Ensure only admins, doctors or assistants can access this page
@@ -1117,14 +1037,94 @@ def admin_appointments():
         flash('Access denied. Staff privileges required.', 'danger')
         return redirect(url_for('index'))
 
-    # Get all appointments
-    appointments = Appointment.query.order_by(desc(Appointment.appointment_date), desc(Appointment.appointment_time)).all()
+    # One page per tab, each with its own filter, order and cursors
+    tabs = appointment_tab_queries(datetime.now().date())
+    tab = request.args.get('tab')
+
+    # ?tab=<name>&format=json returns just that tab's page
+    if wants_json() and tab in tabs:
+        query, order_by = tabs[tab]
+        return jsonify(paginate_request(query, order_by, prefix=f'{tab}_').to_dict())
+
+    # Each tab's next/prev links reopen that tab
+    pages = {
+        name: paginate_request(query, order_by, prefix=f'{name}_', link_args={'tab': name})
+        for name, (query, order_by) in tabs.items()
+    }
+    if wants_json():
+        return jsonify({name: page.to_dict() for name, page in pages.items()})
+
+    return render_template('admin/appointments.html',
+                          upcoming_page=pages['upcoming'],
+                          completed_page=pages['completed'],
+                          all_page=pages['all'],
+                          active_tab=tab if tab in tabs else 'upcoming')
 
-    return render_template('admin/appointments.html', appointments=appointments)
+
+def _upcoming_page_url():
+    """The Upcoming tab page the bulk form was submitted from"""
+    args = {name: request.form[name] for name in ('upcoming_after', 'upcoming_before', 'per_page') if request.form.get(name)}
+    return url_for('admin_appointments', tab='upcoming', **args)
+
+
+@app.route('/admin/appointments/bulk', methods=['POST'])
+@login_required
+def admin_bulk_appointments():
+    """Confirm or cancel several appointments at once"""
+    as_json = request.is_json or wants_json()
+
+    # Same staff roles as the single appointment view
+    if not (isinstance(current_user, Admin) or isinstance(current_user, Assistant) or isinstance(current_user, Doctor)):
+        if as_json:
+            return jsonify({"error": "Staff privileges required"}), 403
+        flash('Access denied. Staff privileges required.', 'danger')
+        return redirect(url_for('index'))
+
+    # JSON clients send {"action": ..., "appointment_ids": [...]}; the list page posts a form
+    if request.is_json:
+        payload = request.get_json(silent=True) or {}
+        action = payload.get('action')
+        raw_ids = payload.get('appointment_ids') or []
+    else:
+        action = request.form.get('action')
+        raw_ids = request.form.getlist('appointment_ids')
+
+    try:
+        appointment_ids = parse_ids(raw_ids if isinstance(raw_ids, list) else [raw_ids])
+        results = bulk_update_appointments(appointment_ids, action)
+    except BulkActionError as e:
+        if as_json:
+            return jsonify({"error": str(e)}), 400
+        flash(str(e), 'warning')
+        return redirect(_upcoming_page_url())
+    except Exception as e:
+        db.session.rollback()
+        if as_json:
+            return jsonify({"error": f"Error updating appointments: {str(e)}"}), 500
+        flash(f'Error updating appointments: {str(e)}', 'danger')
+        return redirect(_upcoming_page_url())
+
+    summary = summarize(results)
+    if as_json:
+        return jsonify({'action': action, 'summary': summary, 'results': results})
+
+    updated = summary.get('updated', 0)
+    skipped = len(results) - updated
+    notified = sum(1 for result in results if result['notified'])
+    verb = 'confirmed' if action == 'confirm' else 'cancelled'
+    message = f'{updated} appointment{"s" if updated != 1 else ""} {verb}.'
+    if updated:
+        message += f' {notified} patient{"s" if notified != 1 else ""} notified by email'
+        message += f', {updated - notified} without an email address.' if notified < updated else '.'
+    if skipped:
+        message += f' {skipped} skipped (already {verb}, not eligible or not found).'
+    flash(message, 'success' if updated else 'warning')
+    return redirect(_upcoming_page_url())
 
 
 @app.route('/admin/patients')
 @login_required
+@replica_reads
 def admin_patients():
     """Admin patients management route"""
     # Ensure only admins, doctors or assistants can access this page
@@ -1132,10 +1132,12 @@ def admin_patients():
         flash('Access denied. Staff privileges required.', 'danger')
         return redirect(url_for('index'))
 
-    # Get all patients
-    patients = Patient.query.order_by(Patient.full_name).all()
+    # Get one page of patients
+    page = paginate_request(patient_list_query(Patient.appointments), PATIENT_ORDER)
+    if wants_json():
+        return jsonify(page.to_dict())
 
-    return render_template('admin/patients.html', patients=patients)
+    return render_template('admin/patients.html', patients=page.items, page=page)
 
 
 @app.route('/admin/patient/<int:patient_id>')
@@ -1155,8 +1157,8 @@ def admin_patient_view(patient_id):
     else:
         return_url = url_for('admin_dashboard')
 
-    # Get patient details
-    patient = Patient.query.get_or_404(patient_id)
+    # Get patient details with prescription summaries for the list cards
+    patient = patient_with_prescription_summaries(patient_id)
 
     # Get patient's appointments and medical records
     appointments = Appointment.query.filter_by(patient_id=patient_id).order_by(desc(Appointment.appointment_date)).all()
@@ -1180,6 +1182,9 @@ def admin_appointment_view(appointment_id):
     if request.method == 'POST':
         action = request.form.get('action')
 
+        # Staff decisions stand even if the slot has since filled up
+        appointment.allow_overbooking = True
+
         if action == 'complete':
             appointment.status = 'confirmed'
 
@@ -1192,34 +1197,16 @@ def admin_appointment_view(appointment_id):
                 else:
                     print(f"No payment found for appointment {appointment_id}")  # Debug log
 
-                db.session.commit()
-
-                # Send confirmation email when doctor confirms the appointment
+                # Queue the confirmation email with the status change
                 if appointment.patient.email:
-                    subject = "Appointment Confirmed - Dr. Richa's Eye Clinic"
-                    message = f"""
-Dear {appointment.patient.full_name},
-
-Great news! Your appointment has been CONFIRMED by Dr. Richa.
-
-Confirmed Appointment Details:
-- Date: {appointment.appointment_date.strftime('%A, %B %d, %Y')}
-- Time: {appointment.appointment_time.strftime('%I:%M %p')}
-- Primary Issue: {appointment.primary_issue}
-- Consultation Fee: ₹500 (to be paid at the clinic)
-
-Please arrive 15 minutes before your scheduled time.
-
-You will receive a reminder email 7-8 hours before your appointment.
-
-Location: First floor, DVR Town Centre, near to IGUS private limited, 
-Mandur, Budigere Road (New Airport Road), Bengaluru, Karnataka 560049
-
-Best regards,
-Dr. Richa's Eye Clinic
-                    """
-                    send_email_notification(appointment.patient.email, subject, message)
+                    queue_notification(appointment.patient.email, 'appointment_confirmed',
+                                       patient_name=appointment.patient.full_name,
+                                       appointment_date=appointment.appointment_date,
+                                       appointment_time=appointment.appointment_time,
+                                       primary_issue=appointment.primary_issue,
+                                       reminder_offsets=describe_offsets())
 
+                db.session.commit()
                 flash('Appointment confirmed and confirmation email sent to patient.', 'success')
                 return redirect(url_for('admin_appointment_view', appointment_id=appointment_id))
             except Exception as e:
@@ -1238,33 +1225,14 @@ Dr. Richa's Eye Clinic
                 else:
                     print(f"No payment found for appointment {appointment_id}")  # Debug log
 
-                db.session.commit()
-
-                # Send cancellation email when doctor cancels the appointment
+                # Queue the cancellation email with the status change
                 if appointment.patient.email:
-                    subject = "Appointment Cancelled - Dr. Richa's Eye Clinic"
-                    message = f"""
-Dear {appointment.patient.full_name},
-
-We regret to inform you that your appointment scheduled for {appointment.appointment_date.strftime('%A, %B %d, %Y')} at {appointment.appointment_time.strftime('%I:%M %p')} has been cancelled by our medical team.
-
-We apologize for any inconvenience caused. Please contact us at your earliest convenience to reschedule your appointment.
-
-You can:
-- Call us during clinic hours
-- Visit our website to book a new appointment
-- Reply to this email with your preferred time slots
-
-We look forward to serving you soon.
-
-Best regards,
-Dr. Richa's Eye Clinic
-Phone: +91 98765 43210
-Location: First floor, DVR Town Centre, near to IGUS private limited, 
-Mandur, Budigere Road (New Airport Road), Bengaluru, Karnataka 560049
-                    """
-                    send_email_notification(appointment.patient.email, subject, message)
+                    queue_notification(appointment.patient.email, 'appointment_cancelled',
+                                       patient_name=appointment.patient.full_name,
+                                       appointment_date=appointment.appointment_date,
+                                       appointment_time=appointment.appointment_time)
 
+                db.session.commit()
                 flash('Appointment cancelled and notification sent to patient.', 'warning')
                 return redirect(url_for('admin_appointment_view', appointment_id=appointment_id))
             except Exception as e:
@@ -1272,7 +1240,7 @@ Mandur, Budigere Road (New Airport Road), Bengaluru, Karnataka 560049
                 flash(f'Error updating appointment: {str(e)}', 'danger')
 
     # Get medical record if it exists
-    medical_record = MedicalRecord.query.filter_by(appointment_id=appointment_id).first()
+    medical_record = medical_record_for(appointment_id)
     has_medical_record = medical_record is not None
 
     return render_template('admin/appointment_view.html', appointment=appointment, medical_record=medical_record, has_medical_record=has_medical_record)
@@ -1294,7 +1262,7 @@ def admin_add_prescription(appointment_id):
     print(f"Found appointment for patient ID: {appointment.patient_id}")  # Debug log
 
     # Get or create medical record
-    medical_record = MedicalRecord.query.filter_by(appointment_id=appointment_id).first()
+    medical_record = medical_record_for(appointment_id)
     is_edit = medical_record is not None
 
     if not medical_record:
@@ -1402,9 +1370,9 @@ def admin_assistant_salary():
 
     form = SalaryForm()
 
-    # Populate assistant choices
-    assistants = Assistant.query.all()
-    form.assistant_id.choices = [(assistant.id, f"{assistant.full_name} ({assistant.email})") for assistant in assistants]
+    # Each assistant with their month, year and all-time totals from the summary rows
+    payroll = payroll_totals()
+    form.assistant_id.choices = [(row['assistant_id'], f"{row['full_name']} ({row['email']})") for row in payroll]
 
     if form.validate_on_submit():
         # Get the selected assistant
@@ -1421,31 +1389,19 @@ def admin_assistant_salary():
                     status='completed'
                 )
                 db.session.add(new_salary)
-                db.session.commit()
 
-                # Send email notification only if assistant has a valid email
+                # Queue the receipt with the salary record, only if assistant has a valid email
                 if assistant.email and assistant.email != 'assistant@eyeclinic.com':
-                    subject = "Salary Payment Receipt - Dr. Richa's Eye Clinic"
-                    message = f"""
-Dear {assistant.full_name},
-
-Your salary payment has been processed:
-
-Amount: ₹{form.amount.data}
-Date: {form.payment_date.data}
-Payment Method: {form.payment_method.data}
-Description: {form.description.data}
-
-Best regards,
-Dr. Richa's Eye Clinic
-"""
-                    try:
-                        send_email_notification(assistant.email, subject, message)
-                        flash('Salary payment processed successfully and notification sent!', 'success')
-                    except Exception as email_error:
-                        print(f"Email notification failed: {str(email_error)}")
-                        flash('Salary payment processed successfully! (Email notification failed)', 'warning')
+                    queue_notification(assistant.email, 'salary_receipt',
+                                       assistant_name=assistant.full_name,
+                                       amount=form.amount.data,
+                                       payment_date=form.payment_date.data,
+                                       payment_method=form.payment_method.data,
+                                       description=form.description.data)
+                    db.session.commit()
+                    flash('Salary payment processed successfully and notification sent!', 'success')
                 else:
+                    db.session.commit()
                     flash('Salary payment processed successfully! (No email configured for assistant)', 'success')
 
                 return redirect(url_for('admin_assistant_salary'))
@@ -1456,17 +1412,13 @@ Dr. Richa's Eye Clinic
         else:
             flash('No assistant found in the system', 'danger')
 
-    # Get all salary records from all assistants
-    assistants = Assistant.query.all()
-    salary_records = []
-    for assistant in assistants:
-        assistant_salaries = Salary.query.filter_by(assistant_id=assistant.id).order_by(desc(Salary.payment_date)).all()
-        salary_records.extend(assistant_salaries)
+    # One page of the ledger across all assistants, newest first
+    salary_page = salary_ledger_page()
+    if wants_json():
+        return jsonify(dict(salary_page.to_dict(), payroll=payroll))
 
-    # Sort all salary records by payment date
-    salary_records.sort(key=lambda x: x.payment_date, reverse=True)
-
-    return render_template('admin/assistant_salary.html', form=form, salary_records=salary_records, assistants=assistants)
+    return render_template('admin/assistant_salary.html', form=form, salary_records=salary_page.items,
+                           salary_page=salary_page, payroll=payroll)
 
 @app.route('/admin/reviews')
 @login_required
@@ -1477,13 +1429,17 @@ def admin_reviews():
         flash('Access denied. Staff privileges required.', 'danger')
         return redirect(url_for('index'))
 
-    # Get pending reviews
-    pending_reviews = Review.query.filter_by(is_approved=False).order_by(desc(Review.created_at)).all()
-
-    # Get approved reviews
-    approved_reviews = Review.query.filter_by(is_approved=True).order_by(desc(Review.created_at)).all()
+    # Get one page each of pending and approved reviews
+    pending_page = paginate_request(Review.query.filter_by(is_approved=False), REVIEW_ORDER, prefix='pending_')
+    approved_page = paginate_request(Review.query.filter_by(is_approved=True), REVIEW_ORDER, prefix='approved_')
+    if wants_json():
+        return jsonify({'pending': pending_page.to_dict(), 'approved': approved_page.to_dict()})
 
-    return render_template('admin/reviews.html', pending_reviews=pending_reviews, approved_reviews=approved_reviews)
+    return render_template('admin/reviews.html',
+                          pending_reviews=pending_page.items,
+                          approved_reviews=approved_page.items,
+                          pending_page=pending_page,
+                          approved_page=approved_page)
 
 
 @app.route('/admin/review/approve/<int:review_id>', methods=['POST'])
@@ -1503,6 +1459,7 @@ def admin_approve_review(review_id):
 
     try:
         db.session.commit()
+        invalidate_pages('reviews')
         flash('Review approved!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -1525,6 +1482,7 @@ def admin_delete_review(review_id):
     try:
         db.session.delete(review)
         db.session.commit()
+        invalidate_pages('reviews')
         flash('Review deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -1532,30 +1490,6 @@ def admin_delete_review(review_id):
 
     return redirect(url_for('admin_reviews'))
 
-def send_email_notification(to_email, subject, message):
-    try:
-        smtp_server = app.config['MAIL_SERVER']
-        smtp_port = app.config['MAIL_PORT']
-        sender_email = app.config['MAIL_USERNAME']
-        sender_password = app.config['MAIL_PASSWORD']
-
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        msg.attach(MIMEText(message, 'plain'))
-
-        # Send email
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(sender_email, sender_password)
-            server.send_message(msg)
-        return True
-    except Exception as e:
-        print(f"Error sending email: {str(e)}")
-        return False
-
 @app.route('/assistant/add-patient', methods=['GET', 'POST'])
 @login_required
 def assistant_add_patient():
@@ -1627,6 +1561,8 @@ def assistant_add_patient():
                 consultation_fee=500.0,
                 payment_status='paid'
             )
+            # The patient is already at the clinic, so a full slot does not turn them away
+            walk_in_appointment.allow_overbooking = True
             db.session.add(walk_in_appointment)
             db.session.flush()  # Get appointment ID
 
@@ -1670,8 +1606,15 @@ def doctor_prescriptions():
         flash('Access denied', 'danger')
         return redirect(url_for('index'))
 
-    all_patients = Patient.query.order_by(Patient.full_name).all()
-    return render_template('doctor/prescriptions.html', all_patients=all_patients)
+    query = patient_list_query(Patient.doctor_prescriptions)
+    search_term = request.args.get('q', '').strip()
+    if search_term:
+        query = query.filter(patient_match_clause(search_term))
+
+    page = paginate_request(query, PATIENT_ORDER)
+    if wants_json():
+        return jsonify(page.to_dict())
+    return render_template('doctor/prescriptions.html', all_patients=page.items, page=page, search_term=search_term)
 
 @app.route('/doctor/add-prescription/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
@@ -1746,8 +1689,15 @@ def assistant_prescriptions():
         flash('Access denied', 'danger')
         return redirect(url_for('index'))
 
-    all_patients = Patient.query.order_by(Patient.full_name).all()
-    return render_template('assistant/prescriptions.html', all_patients=all_patients)
+    query = patient_list_query(Patient.optometrist_prescriptions)
+    search_term = request.args.get('q', '').strip()
+    if search_term:
+        query = query.filter(patient_match_clause(search_term))
+
+    page = paginate_request(query, PATIENT_ORDER)
+    if wants_json():
+        return jsonify(page.to_dict())
+    return render_template('assistant/prescriptions.html', all_patients=page.items, page=page, search_term=search_term)
 
 @app.route('/assistant/add-prescription/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
@@ -1880,13 +1830,19 @@ def assistant_add_prescription(patient_id):
     return render_template('assistant/add_prescription.html', form=form, patient=patient)
 
 @app.route('/print-prescription/<string:type>/<int:prescription_id>')
+@replica_reads
 def print_prescription(type, prescription_id):
     """Print prescription route"""
     if type == 'doctor':
-        prescription = DoctorPrescription.query.get_or_404(prescription_id)
+        prescription = doctor_prescription_detail(prescription_id)
         template = 'doctor/print_prescription.html'
     elif type == 'optometrist':
-        prescription = OptometristPrescription.query.get_or_404(prescription_id)
+        prescription = (
+            OptometristPrescription.query
+            .options(selectinload(OptometristPrescription.readings))
+            .filter_by(id=prescription_id)
+            .first_or_404()
+        )
         template = 'assistant/print_prescription.html'
     else:
         flash('Invalid prescription type', 'danger')
@@ -1895,20 +1851,17 @@ def print_prescription(type, prescription_id):
     return render_template(template, prescription=prescription)
 
 @app.route('/print-combined-prescription/<int:patient_id>')
+@replica_reads
 def print_combined_prescription(patient_id):
     """Print combined doctor and optometrist prescriptions route"""
     # Get patient
     patient = Patient.query.get_or_404(patient_id)
 
-    # Get latest doctor prescription
-    doctor_prescription = DoctorPrescription.query.filter_by(
-        patient_id=patient_id
-    ).order_by(DoctorPrescription.created_at.desc()).first()
+    # Get latest doctor prescription with the sections the combined print shows
+    doctor_prescription = latest_doctor_prescription(patient_id, 'summary', 'examination')
 
-    # Get latest optometrist prescription
-    optometrist_prescription = OptometristPrescription.query.filter_by(
-        patient_id=patient_id
-    ).order_by(OptometristPrescription.created_at.desc()).first()
+    # Get latest optometrist prescription with the final glasses it prints
+    optometrist_prescription = latest_optometrist_prescription(patient_id, 'final')
 
     if not doctor_prescription and not optometrist_prescription:
         flash('No prescriptions found for this patient.', 'warning')
@@ -1921,6 +1874,7 @@ def print_combined_prescription(patient_id):
 
 @app.route('/patient/print-combined-prescription/<int:patient_id>')
 @login_required
+@replica_reads
 def patient_print_combined_prescription(patient_id):
     """Patient route to print combined doctor and optometrist prescriptions"""
     # Check if user is authenticated and is a Patient
@@ -1940,15 +1894,11 @@ def patient_print_combined_prescription(patient_id):
     # Get patient
     patient = Patient.query.get_or_404(patient_id)
 
-    # Get latest doctor prescription
-    doctor_prescription = DoctorPrescription.query.filter_by(
-        patient_id=patient_id
-    ).order_by(DoctorPrescription.created_at.desc()).first()
+    # Get latest doctor prescription with the sections the combined print shows
+    doctor_prescription = latest_doctor_prescription(patient_id, 'summary', 'examination')
 
-    # Get latest optometrist prescription
-    optometrist_prescription = OptometristPrescription.query.filter_by(
-        patient_id=patient_id
-    ).order_by(OptometristPrescription.created_at.desc()).first()
+    # Get latest optometrist prescription with the final glasses it prints
+    optometrist_prescription = latest_optometrist_prescription(patient_id, 'final')
 
     if not doctor_prescription and not optometrist_prescription:
         flash('No prescriptions found.', 'warning')
@@ -2098,6 +2048,9 @@ def patient_google_login():
 @app.route('/patient/google-callback')
 def patient_google_callback():
     """Google OAuth callback route"""
+    # Loaded on first use; only Google sign-ins need an HTTP client
+    import requests
+
     print(f"Google callback received with args: {request.args}")  # Debug log
 
     # Check for OAuth errors first
@@ -2247,64 +2200,44 @@ def patient_google_callback():
         flash('An error occurred during authentication. Please try again.', 'danger')
         return redirect(url_for('patient_register'))
 
-@app.route('/admin/fix-payment-status')
+@app.route('/admin/fix-payment-status', methods=['POST'])
 @login_required
 def admin_fix_payment_status():
-    """Debug route to fix inconsistent payment statuses"""
+    """Queue a full payment reconciliation for the background worker"""
     if not isinstance(current_user, Doctor):
         flash('Access denied. Doctor privileges required.', 'danger')
         return redirect(url_for('index'))
 
     try:
-        fixed_count = 0
-        cancelled_count = 0
-
-        # Find payments where appointment is confirmed but payment is still pending
-        inconsistent_payments = db.session.query(Payment).join(Appointment).filter(
-            Appointment.status == 'confirmed',
-            Payment.status == 'pending'
-        ).all()
-
-        # Fix them
-        for payment in inconsistent_payments:
-            payment.status = 'completed'
-            fixed_count += 1
-            print(f"Fixed payment {payment.id} for appointment {payment.appointment_id}")
-
-        # Find payments where appointment is cancelled but payment is not cancelled
-        cancelled_payments = db.session.query(Payment).join(Appointment).filter(
-            Appointment.status == 'cancelled',
-            Payment.status != 'cancelled'
-        ).all()
-
-        for payment in cancelled_payments:
-            payment.status = 'cancelled'
-            cancelled_count += 1
-            print(f"Fixed cancelled payment {payment.id} for appointment {payment.appointment_id}")
-
-        # Also check for payments with completed status where appointment is still scheduled
-        completed_payments_wrong = db.session.query(Payment).join(Appointment).filter(
-            Appointment.status == 'scheduled',
-            Payment.status == 'completed'
-        ).all()
-
-        for payment in completed_payments_wrong:
-            payment.status = 'pending'
-            fixed_count += 1
-            print(f"Reset payment {payment.id} for scheduled appointment {payment.appointment_id}")
+        run = request_full_run(requested_by=current_user.full_name)
+        flash(f'Payment reconciliation run #{run.id} queued. Results appear under Payment Reconciliation.', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error queueing payment reconciliation: {str(e)}', 'danger')
+    return redirect(url_for('admin_revenue'))
 
-        db.session.commit()
 
-        flash(f'Fixed {fixed_count} payments and cancelled {cancelled_count} payments', 'success')
-        return redirect(url_for('admin_revenue'))
+# API route for the payment reconciliation report
+@app.route('/api/reconciliation-report', methods=['GET'])
+@login_required
+def api_reconciliation_report():
+    """Recent reconciliation runs, or the payments one run changed with ?run=<id>"""
+    if not (isinstance(current_user, Admin) or isinstance(current_user, Doctor)):
+        return jsonify({"error": "Admin privileges required"}), 403
 
-    except Exception as e:
-        db.session.rollback()
-        flash(f'Error fixing payment statuses: {str(e)}', 'danger')
-        return redirect(url_for('admin_revenue'))
+    run_id = request.args.get('run', type=int)
+    if run_id is None:
+        return jsonify({'runs': recent_runs(request.args.get('limit', 10, type=int))})
+
+    run = db.session.get(ReconciliationRun, run_id)
+    if run is None:
+        return jsonify({"error": "Run not found"}), 404
+    changes = run.changes.order_by(ReconciliationChange.id).limit(1000).all()
+    return jsonify(dict(run.to_dict(), changes=[change.to_dict() for change in changes]))
 
 @app.route('/admin/revenue', methods=['GET', 'POST'])
 @login_required
+@replica_reads
 def admin_revenue():
     """Revenue management route"""
     if not isinstance(current_user, Doctor):
@@ -2351,28 +2284,38 @@ def admin_revenue():
             db.session.rollback()
             flash(f'Error adding treatment: {str(e)}', 'danger')
 
-    # Get all payments with patient details (exclude cancelled payments and payments from cancelled appointments)
-    payments = (
-        db.session.query(Payment, Patient)
-        .join(Appointment, Payment.appointment_id == Appointment.id)
-        .join(Patient, Appointment.patient_id == Patient.id)
-        .filter(
-            Payment.status != 'cancelled',
-            Appointment.status != 'cancelled'
-        )
-        .order_by(Payment.created_at.desc())
-        .all()
-    )
-
-    # Get all treatments
-    treatments = Treatment.query.order_by(Treatment.treatment_date.desc()).all()
-
-    # Calculate total revenue (exclude cancelled payments)
-    appointment_revenue = sum(payment.amount for payment, _ in payments if payment.status == 'completed')
-    treatment_revenue = sum(treatment.amount for treatment in treatments)
-    total_revenue = appointment_revenue + treatment_revenue
-
-    # Get all patients for the treatment form
-    patients = Patient.query.order_by(Patient.full_name).all()
-
-    return render_template('admin/revenue.html', payments=payments, treatments=treatments, patients=patients, total_revenue=total_revenue, form=form)
\ No newline at end of file
+    # Date range filter, defaulting to the last 30 days
+    start, end = default_range()
+    try:
+        if request.args.get('start'):
+            start = datetime.strptime(request.args['start'], '%Y-%m-%d').date()
+        if request.args.get('end'):
+            end = datetime.strptime(request.args['end'], '%Y-%m-%d').date()
+    except ValueError:
+        flash('Invalid date range. Showing the last 30 days.', 'warning')
+        start, end = default_range()
+    if start > end:
+        start, end = end, start
+
+    group = request.args.get('group', 'day')
+    if group not in REVENUE_GRANULARITIES:
+        group = 'day'
+
+    # Totals and the per-period breakdown come from the daily revenue table
+    totals = revenue_totals(start, end)
+    rollup = revenue_rollup(group, start, end)
+
+    # Payments in range with patient details (exclude cancelled payments and payments from cancelled appointments)
+    payments = payments_with_patients(start, end)
+
+    # Treatments in range with their patients in one query
+    treatments = treatments_with_patients(start, end)
+
+    # Latest payment reconciliation runs
+    reconciliation_runs = recent_runs(5)
+
+    # Patient names for the treatment form are fetched through /api/patients/search
+    return render_template('admin/revenue.html', payments=payments, treatments=treatments,
+                           total_revenue=totals['total_revenue'], totals=totals, rollup=rollup,
+                           start=start, end=end, group=group, granularities=REVENUE_GRANULARITIES, form=form,
+                           reconciliation_runs=reconciliation_runs)
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""
+Schema maintenance helpers
+
+db.create_all() only creates missing tables, so columns and indexes declared
+on models after a table already exists are never added. These helpers bring
+an existing database up to date with the declarations in models.py.
+"""
+
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.orm import selectinload
+from app import db
+
+
+def ensure_columns():
+    """Add nullable columns declared in models.py that are missing from existing tables"""
+    added = []
+    inspector = db.inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(text(
+                    f'ALTER TABLE {preparer.format_table(table)} '
+                    f'ADD COLUMN {preparer.format_column(column)} {column_type}'
+                ))
+                added.append(f'{table.name}.{column.name}')
+
+    if added:
+        print(f"Added columns: {', '.join(added)}")
+    return added
+
+
+def ensure_indexes():
+    """Create any index declared in models.py that is missing from the database"""
+    created = []
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine, checkfirst=True)
+                created.append(index.name)
+
+    if created:
+        print(f"Created indexes: {', '.join(created)}")
+    return created
+
+
+def legacy_refraction_columns():
+    """Names of the per-value string columns optometrist prescriptions used to have"""
+    from models import REFRACTION_STAGES, REFRACTION_EYES, IOP_FIELDS
+    names = []
+    for stage, fields in REFRACTION_STAGES.items():
+        for eye in REFRACTION_EYES:
+            for field in fields:
+                names.append(f'old_add_{eye}' if field == 'add' else f'{stage}_{eye}_{field}')
+    return names + list(IOP_FIELDS)
+
+
+def migrate_legacy_refractions(drop=False, batch_size=500):
+    """Parse refraction and IOP strings left in legacy columns into the structured storage
+
+    Only fills values that are not already stored, so it is safe to run
+    repeatedly. With drop=True the legacy columns are removed afterwards.
+    """
+    from models import OptometristPrescription
+
+    inspector = db.inspect(db.engine)
+    present = {column['name'] for column in inspector.get_columns('optometrist_prescription')}
+    legacy = [name for name in legacy_refraction_columns() if name in present]
+    if not legacy:
+        return 0
+
+    preparer = db.engine.dialect.identifier_preparer
+    selected = ', '.join(preparer.quote(name) for name in legacy)
+    rows = db.session.execute(text(f'SELECT id, {selected} FROM optometrist_prescription ORDER BY id')).fetchall()
+
+    migrated = 0
+    for start in range(0, len(rows), batch_size):
+        batch = {row[0]: row[1:] for row in rows[start:start + batch_size]}
+        prescriptions = (
+            OptometristPrescription.query
+            .options(selectinload(OptometristPrescription.readings))
+            .filter(OptometristPrescription.id.in_(batch))
+            .all()
+        )
+        for prescription in prescriptions:
+            changed = False
+            for name, value in zip(legacy, batch[prescription.id]):
+                if value is None or not str(value).strip() or getattr(prescription, name) is not None:
+                    continue
+                setattr(prescription, name, value)
+                changed = True
+            migrated += changed
+        db.session.commit()
+
+    if drop:
+        with db.engine.begin() as conn:
+            for name in legacy:
+                conn.execute(text(f'ALTER TABLE optometrist_prescription DROP COLUMN {preparer.quote(name)}'))
+        print(f'Dropped {len(legacy)} legacy refraction columns')
+
+    print(f'Migrated refraction data for {migrated} optometrist prescriptions')
+    return migrated
+
+
+def ensure_refractions_migrated():
+    """Run the legacy refraction migration on the first start after upgrading"""
+    from models import RefractionReading
+    if RefractionReading.query.first() is None:
+        migrate_legacy_refractions()
+
+
+def dedupe_payments():
+    """Delete extra payments recorded for the same appointment before the unique index is built
+
+    Keeps a completed payment if the appointment has one, otherwise the
+    oldest. Deleting through the session lets the revenue events take the
+    removed rows out of the daily totals.
+    """
+    from models import Payment
+
+    inspector = db.inspect(db.engine)
+    if not inspector.has_table('payment'):
+        return 0
+    if 'uq_payment_appointment_id' in {index['name'] for index in inspector.get_indexes('payment')}:
+        return 0
+
+    duplicated = (
+        db.session.query(Payment.appointment_id)
+        .group_by(Payment.appointment_id)
+        .having(db.func.count(Payment.id) > 1)
+    )
+    payments = Payment.query.filter(Payment.appointment_id.in_(duplicated)).order_by(Payment.id).all()
+    if not payments:
+        return 0
+
+    # The daily totals must exist before the deleted rows are taken out of them
+    from revenue import ensure_daily_revenue
+    ensure_daily_revenue()
+
+    kept = {}
+    for payment in payments:
+        current = kept.get(payment.appointment_id)
+        if current is None or (payment.status == 'completed' and current.status != 'completed'):
+            kept[payment.appointment_id] = payment
+
+    removed = 0
+    for payment in payments:
+        if kept[payment.appointment_id] is not payment:
+            db.session.delete(payment)
+            removed += 1
+    db.session.commit()
+
+    if removed:
+        print(f'Removed {removed} duplicate payments from {len(kept)} appointments')
+    return removed
+
+
+# Reviews saved without a date sort as the oldest
+UNDATED_REVIEW_TIME = datetime(1970, 1, 1)
+
+
+def backfill_review_dates():
+    """Give undated reviews a created_at and make the column NOT NULL where the database allows it
+
+    created_at leads the keyset sort of the review lists, and a NULL key
+    never compares true, so undated reviews would drop out of every page
+    after the first. SQLite cannot alter a column's nullability; there the
+    model's nullable=False and default keep new rows dated.
+    """
+    from models import Review
+
+    inspector = db.inspect(db.engine)
+    if not inspector.has_table('review'):
+        return 0
+
+    table = Review.__table__
+    with db.engine.begin() as conn:
+        filled = conn.execute(
+            table.update().where(table.c.created_at.is_(None)).values(created_at=UNDATED_REVIEW_TIME)
+        ).rowcount
+        column = {column['name']: column for column in inspector.get_columns('review')}['created_at']
+        if column['nullable'] and db.engine.dialect.name == 'postgresql':
+            conn.execute(text('ALTER TABLE review ALTER COLUMN created_at SET NOT NULL'))
+
+    if filled:
+        print(f'Dated {filled} reviews that had no created_at')
+    return filled
@@ -0,0 +1,174 @@
+"""
+Patient search for staff pages
+
+Matches Patient.full_name, mobile_number and email by prefix, substring and
+approximate (typo-tolerant) similarity without loading the patient table.
+
+- PostgreSQL: pg_trgm GIN indexes; fuzzy matches use the trigram % operator.
+- SQLite: an FTS5 trigram table kept in sync with patient by triggers; fuzzy
+  matches OR together the trigrams of the search term and rank by bm25.
+- Anything else falls back to plain substring matching.
+"""
+
+from sqlalchemy import case, func, or_, text
+from app import db
+from models import Patient
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# Columns covered by the search indexes
+SEARCH_COLUMNS = ('full_name', 'mobile_number', 'email')
+
+
+def ensure_search_indexes():
+    """Create the trigram (PostgreSQL) or FTS5 (SQLite) search structures"""
+    dialect = db.engine.dialect.name
+    try:
+        with db.engine.begin() as conn:
+            if dialect == 'postgresql':
+                conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+                for column in SEARCH_COLUMNS:
+                    conn.execute(text(
+                        f'CREATE INDEX IF NOT EXISTS ix_patient_{column}_trgm '
+                        f'ON patient USING gin ({column} gin_trgm_ops)'
+                    ))
+            elif dialect == 'sqlite':
+                # Triggers are dropped with the patient table, so check for them
+                # rather than the FTS table itself
+                synced = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'patient_fts_ai'"
+                )).first()
+                if not synced:
+                    conn.execute(text(
+                        "CREATE VIRTUAL TABLE IF NOT EXISTS patient_fts USING fts5("
+                        "full_name, mobile_number, email, "
+                        "content='patient', content_rowid='id', tokenize='trigram')"
+                    ))
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS patient_fts_ai AFTER INSERT ON patient BEGIN "
+                        "INSERT INTO patient_fts(rowid, full_name, mobile_number, email) "
+                        "VALUES (new.id, new.full_name, new.mobile_number, new.email); END"
+                    ))
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS patient_fts_ad AFTER DELETE ON patient BEGIN "
+                        "INSERT INTO patient_fts(patient_fts, rowid, full_name, mobile_number, email) "
+                        "VALUES ('delete', old.id, old.full_name, old.mobile_number, old.email); END"
+                    ))
+                    conn.execute(text(
+                        "CREATE TRIGGER IF NOT EXISTS patient_fts_au AFTER UPDATE ON patient BEGIN "
+                        "INSERT INTO patient_fts(patient_fts, rowid, full_name, mobile_number, email) "
+                        "VALUES ('delete', old.id, old.full_name, old.mobile_number, old.email); "
+                        "INSERT INTO patient_fts(rowid, full_name, mobile_number, email) "
+                        "VALUES (new.id, new.full_name, new.mobile_number, new.email); END"
+                    ))
+                    # Index any patients that existed before the table was created
+                    conn.execute(text("INSERT INTO patient_fts(patient_fts) VALUES ('rebuild')"))
+                    print('Patient search index created')
+    except Exception as e:
+        # Search still works through the substring fallback
+        print(f'Could not create patient search indexes: {str(e)}')
+
+
+def patient_match_clause(term):
+    """Substring filter on name, mobile number or email for list queries"""
+    return or_(
+        Patient.full_name.icontains(term, autoescape=True),
+        Patient.mobile_number.contains(term, autoescape=True),
+        Patient.email.icontains(term, autoescape=True),
+    )
+
+
+def _trigrams(term):
+    """Distinct lowercase trigrams of a search term"""
+    term = term.lower()
+    return sorted({term[i:i + 3] for i in range(len(term) - 2)})
+
+
+def _prefix_rank(term):
+    """0 for prefix matches, 1 for other substring matches, 2 for fuzzy matches"""
+    return case(
+        (or_(
+            Patient.full_name.istartswith(term, autoescape=True),
+            Patient.mobile_number.startswith(term, autoescape=True),
+            Patient.email.istartswith(term, autoescape=True),
+        ), 0),
+        (patient_match_clause(term), 1),
+        else_=2,
+    )
+
+
+def _search_postgresql(term, limit):
+    score = func.greatest(
+        func.similarity(Patient.full_name, term),
+        func.similarity(func.coalesce(Patient.email, ''), term),
+    )
+    return (
+        Patient.query
+        .filter(or_(
+            patient_match_clause(term),
+            Patient.full_name.bool_op('%')(term),
+            Patient.email.bool_op('%')(term),
+        ))
+        .order_by(_prefix_rank(term), score.desc(), Patient.full_name)
+        .limit(limit)
+        .all()
+    )
+
+
+def _search_sqlite(term, limit):
+    grams = _trigrams(term)
+    if not grams:
+        # Too short for trigrams; prefix/substring matching is cheap enough
+        return _search_fallback(term, limit)
+
+    match = ' OR '.join('"{}"'.format(gram.replace('"', '""')) for gram in grams)
+    rows = db.session.execute(text(
+        "SELECT rowid FROM patient_fts WHERE patient_fts MATCH :match "
+        "ORDER BY rank LIMIT :candidates"
+    ), {'match': match, 'candidates': limit * 5}).fetchall()
+    ids = [row[0] for row in rows]
+    if not ids:
+        return []
+
+    return (
+        Patient.query
+        .filter(Patient.id.in_(ids))
+        .order_by(_prefix_rank(term), case({patient_id: i for i, patient_id in enumerate(ids)}, value=Patient.id))
+        .limit(limit)
+        .all()
+    )
+
+
+def _search_fallback(term, limit):
+    return (
+        Patient.query
+        .filter(patient_match_clause(term))
+        .order_by(_prefix_rank(term), Patient.full_name)
+        .limit(limit)
+        .all()
+    )
+
+
+def search_patients(term, limit=DEFAULT_LIMIT):
+    """Return up to `limit` patients best matching `term`
+
+    Prefix matches come first, then substring matches, then approximate
+    matches ranked by trigram similarity.
+    """
+    term = (term or '').strip()
+    if not term:
+        return []
+    limit = max(1, min(int(limit), MAX_LIMIT))
+
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'postgresql':
+            return _search_postgresql(term, limit)
+        if dialect == 'sqlite':
+            return _search_sqlite(term, limit)
+    except Exception as e:
+        # Missing extension or FTS table: degrade to substring matching
+        db.session.rollback()
+        print(f'Patient search falling back to substring match: {str(e)}')
+    return _search_fallback(term, limit)
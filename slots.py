@@ -0,0 +1,371 @@
+"""
+Appointment slot availability
+
+The clinic runs fixed half-hour slots (Sunday mornings, weekday evenings)
+with room for SLOT_CAPACITY patients each. Occupancy for a range of days is
+read with one GROUP BY over (appointment_date, appointment_time) and kept in
+an in-process cache keyed by day, so browsing a month on the booking page
+costs one query rather than one per day.
+
+Cached days are dropped after any commit that inserts, deletes or changes
+the date, time or status of an appointment (booking in `appointment`,
+cancelling in `patient_cancel_appointment`, status changes in
+`admin_appointment_view`, walk-ins from `assistant_add_patient`, and any
+other ORM write). Each worker process has its own cache, so entries also
+expire after CACHE_TTL seconds to bound staleness across workers.
+
+Availability shown to patients is advisory. Capacity is enforced by the
+slot_reservation ledger: every write that makes an appointment hold a place
+(booking, un-cancelling, rescheduling) claims it with a conditional
+    UPDATE slot_reservation SET booked = booked + 1
+    WHERE slot_date = ? AND slot_time = ? AND booked < capacity
+inside the same transaction. The UPDATE row-locks only that slot until
+commit, so concurrent bookings for one slot queue behind each other while
+other slots proceed in parallel, and a claim that matches no row raises
+SlotUnavailable and aborts the booking. Cancelling, deleting or moving an
+appointment gives its place back.
+"""
+
+import threading
+import time as clock
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import case, event, func, inspect, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from models import Appointment, SlotReservation
+from orm_history import previous, track_previous
+
+SUNDAY_SLOTS = ('10:00', '10:30', '11:00', '11:30', '12:00', '12:30', '13:00')
+WEEKDAY_SLOTS = ('17:00', '17:30', '18:00', '18:30', '19:00', '19:30', '20:00')
+SLOT_CAPACITY = 3
+
+MAX_RANGE_DAYS = 62
+CACHE_TTL = 60
+
+# day -> (loaded_at, {'HH:MM': booked count}, {'HH:MM': capacity override})
+_occupancy_cache = {}
+_cache_lock = threading.Lock()
+
+
+def slots_for_day(day):
+    """All bookable slot times for a date"""
+    # Sunday is weekday 6
+    return SUNDAY_SLOTS if day.weekday() == 6 else WEEKDAY_SLOTS
+
+
+def invalidate_days(days):
+    """Drop cached occupancy for the given dates"""
+    with _cache_lock:
+        for day in days:
+            _occupancy_cache.pop(day, None)
+
+
+def clear_occupancy_cache():
+    with _cache_lock:
+        _occupancy_cache.clear()
+
+
+def _holds_place_clause():
+    """SQL form of _holds_place: a missing status counts as scheduled"""
+    return or_(Appointment.status.is_(None), Appointment.status != 'cancelled')
+
+
+def occupancy_query(start, end):
+    """Booked count per (date, time) for every day in [start, end]"""
+    return (
+        db.session.query(Appointment.appointment_date, Appointment.appointment_time, func.count(Appointment.id))
+        .filter(
+            Appointment.appointment_date >= start,
+            Appointment.appointment_date <= end,
+            _holds_place_clause()
+        )
+        .group_by(Appointment.appointment_date, Appointment.appointment_time)
+    )
+
+
+def _load_occupancy(start, end):
+    """Booked counts per slot for every day in [start, end] in one query"""
+    rows = occupancy_query(start, end).all()
+
+    # Slots whose capacity differs from the default
+    overrides = (
+        db.session.query(SlotReservation.slot_date, SlotReservation.slot_time, SlotReservation.capacity)
+        .filter(
+            SlotReservation.slot_date >= start,
+            SlotReservation.slot_date <= end,
+            SlotReservation.capacity != SLOT_CAPACITY
+        )
+        .all()
+    )
+
+    occupancy = {start + timedelta(days=i): ({}, {}) for i in range((end - start).days + 1)}
+    for day, slot_time, count in rows:
+        occupancy[day][0][slot_time.strftime('%H:%M')] = count
+    for day, slot_time, capacity in overrides:
+        occupancy[day][1][slot_time.strftime('%H:%M')] = capacity
+    return occupancy
+
+
+def occupancy(start, end):
+    """(booked counts, capacity overrides) per slot for each day in [start, end]
+
+    Served from the cache when fresh.
+    """
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    now = clock.monotonic()
+
+    with _cache_lock:
+        cached = {
+            day: entry[1:] for day in days
+            if (entry := _occupancy_cache.get(day)) and now - entry[0] < CACHE_TTL
+        }
+
+    missing = [day for day in days if day not in cached]
+    if missing:
+        # One query covering the span of days not already cached
+        loaded = _load_occupancy(missing[0], missing[-1])
+        with _cache_lock:
+            for day, (counts, capacities) in loaded.items():
+                _occupancy_cache[day] = (now, counts, capacities)
+        cached.update(loaded)
+
+    return {day: cached[day] for day in days}
+
+
+def available_slots(start, end=None):
+    """Slots with spare capacity for each day in [start, end], as {date: ['HH:MM', ...]}"""
+    end = end or start
+    return {
+        day: [
+            slot for slot in slots_for_day(day)
+            if counts.get(slot, 0) < capacities.get(slot, SLOT_CAPACITY)
+        ]
+        for day, (counts, capacities) in occupancy(start, end).items()
+    }
+
+
+# Collect the days touched by appointment writes during a flush and drop
+# them from the cache once the transaction commits
+def _touched_days(session):
+    return session.info.setdefault('slot_days_touched', set())
+
+
+def _record(target):
+    session = inspect(target).session
+    if session is None:
+        return
+    days = _touched_days(session)
+    days.add(target.appointment_date)
+    # A rescheduled appointment frees a slot on its previous date too
+    days.update(inspect(target).attrs.appointment_date.history.deleted)
+
+
+# The cache and ledger handlers need the slot an appointment is moving from
+track_previous(Appointment.appointment_date, Appointment.appointment_time, Appointment.status)
+
+
+@event.listens_for(Appointment, 'after_insert')
+def _appointment_inserted(mapper, connection, target):
+    _record(target)
+
+
+@event.listens_for(Appointment, 'after_delete')
+def _appointment_deleted(mapper, connection, target):
+    _record(target)
+
+
+@event.listens_for(Appointment, 'after_update')
+def _appointment_updated(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in ('appointment_date', 'appointment_time', 'status')):
+        _record(target)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_after_commit(session):
+    days = session.info.pop('slot_days_touched', None)
+    if days:
+        invalidate_days(days)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_after_rollback(session, previous_transaction):
+    session.info.pop('slot_days_touched', None)
+
+
+# Reservation ledger
+
+class SlotUnavailable(ValueError):
+    """Raised when a booking claims a slot that has no places left"""
+
+    def __init__(self, day, slot_time):
+        super().__init__(f'The {slot_time.strftime("%I:%M %p")} slot on {day.strftime("%d %B, %Y")} is fully booked')
+        self.day = day
+        self.slot_time = slot_time
+
+
+def _holds_place(status):
+    return (status or 'scheduled') != 'cancelled'
+
+
+def _ensure_slot_row(connection, day, slot_time):
+    """Create the ledger row for a slot, counting bookings made before it existed
+
+    Must run before any appointment for the slot is written in the current
+    flush, otherwise the seed count includes rows that then claim again.
+    """
+    table = SlotReservation.__table__
+    existing = select(func.count(Appointment.id)).where(
+        Appointment.appointment_date == day,
+        Appointment.appointment_time == slot_time,
+        _holds_place_clause(),
+    ).scalar_subquery()
+    values = {
+        'slot_date': day,
+        'slot_time': slot_time,
+        'capacity': SLOT_CAPACITY,
+        'booked': existing,
+        'updated_at': datetime.utcnow(),
+    }
+
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        connection.execute(insert(table).values(**values).on_conflict_do_nothing())
+        return
+
+    found = connection.execute(
+        select(table.c.booked).where(table.c.slot_date == day, table.c.slot_time == slot_time)
+    ).first()
+    if found is None:
+        connection.execute(table.insert().values(**values))
+
+
+def _take_place(connection, day, slot_time, enforce):
+    table = SlotReservation.__table__
+    stmt = (
+        table.update()
+        .where(table.c.slot_date == day, table.c.slot_time == slot_time)
+        .values(booked=table.c.booked + 1, updated_at=datetime.utcnow())
+    )
+    if enforce:
+        stmt = stmt.where(table.c.booked < table.c.capacity)
+    if connection.execute(stmt).rowcount == 0:
+        raise SlotUnavailable(day, slot_time)
+
+
+def claim_slot(connection, day, slot_time, enforce=True):
+    """Take one place in a slot inside the current transaction
+
+    Raises SlotUnavailable when `enforce` is set and the slot is full. Call it
+    before writing the appointment that takes the place.
+    """
+    _ensure_slot_row(connection, day, slot_time)
+    _take_place(connection, day, slot_time, enforce)
+
+
+def release_slot(connection, day, slot_time, count=1):
+    """Give places in a slot back"""
+    table = SlotReservation.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.slot_date == day, table.c.slot_time == slot_time, table.c.booked > 0)
+        .values(booked=case((table.c.booked > count, table.c.booked - count), else_=0),
+                updated_at=datetime.utcnow())
+    )
+
+
+def release_cancelled(session, slots_held):
+    """Release places for appointments a bulk UPDATE cancelled
+
+    `slots_held` is the (date, time) of each cancelled appointment that held a
+    place. Each slot is updated once, and its day is dropped from the cache
+    when the transaction commits.
+    """
+    connection = session.connection()
+    for (day, slot_time), count in Counter(slots_held).items():
+        release_slot(connection, day, slot_time, count)
+    _touched_days(session).update(day for day, _ in slots_held)
+
+
+def _slot_change(target):
+    """(old slot or None, new slot or None) for a pending appointment write
+
+    A slot is (date, time) and is only given when the appointment holds a
+    place there. Both are None when nothing affecting the ledger changed.
+    """
+    new = (target.appointment_date, target.appointment_time, target.status)
+    if inspect(target).has_identity:
+        old = (previous(target, 'appointment_date'), previous(target, 'appointment_time'),
+               previous(target, 'status'))
+        if old == new:
+            return None, None
+    else:
+        old = None
+    return (old[:2] if old and _holds_place(old[2]) else None,
+            new[:2] if _holds_place(new[2]) else None)
+
+
+@event.listens_for(db.session, 'before_flush')
+def _seed_slot_rows(session, flush_context, instances):
+    """Create missing ledger rows before the flush writes any appointment
+
+    A flush can insert several appointments for one slot in a single batch,
+    so a seed count taken after the INSERT would include rows that each go
+    on to claim their own place.
+    """
+    slots = set()
+    for target in list(session.new) + list(session.dirty):
+        if isinstance(target, Appointment):
+            new_slot = _slot_change(target)[1]
+            if new_slot is not None:
+                slots.add(new_slot)
+    if slots:
+        connection = session.connection()
+        for day, slot_time in sorted(slots):
+            _ensure_slot_row(connection, day, slot_time)
+
+
+@event.listens_for(Appointment, 'after_insert')
+def _claim_on_insert(mapper, connection, target):
+    if _holds_place(target.status):
+        _take_place(connection, target.appointment_date, target.appointment_time,
+                    enforce=not target.allow_overbooking)
+
+
+@event.listens_for(Appointment, 'after_update')
+def _claim_on_update(mapper, connection, target):
+    old_slot, new_slot = _slot_change(target)
+    if old_slot is not None:
+        release_slot(connection, *old_slot)
+    if new_slot is not None:
+        _take_place(connection, *new_slot, enforce=not target.allow_overbooking)
+
+
+@event.listens_for(Appointment, 'after_delete')
+def _release_on_delete(mapper, connection, target):
+    if _holds_place(target.status):
+        release_slot(connection, target.appointment_date, target.appointment_time)
+
+
+def rebuild_slot_ledger():
+    """Recompute booked places from appointments, keeping configured capacities"""
+    counts = (
+        db.session.query(Appointment.appointment_date, Appointment.appointment_time, func.count(Appointment.id))
+        .filter(_holds_place_clause())
+        .group_by(Appointment.appointment_date, Appointment.appointment_time)
+        .all()
+    )
+    rows = {(row.slot_date, row.slot_time): row for row in SlotReservation.query.all()}
+    for row in rows.values():
+        row.booked = 0
+    for day, slot_time, count in counts:
+        row = rows.get((day, slot_time))
+        if row is None:
+            row = SlotReservation(slot_date=day, slot_time=slot_time, capacity=SLOT_CAPACITY)
+            db.session.add(row)
+        row.booked = count
+    db.session.commit()
+    clear_occupancy_cache()
+    return len(counts)
@@ -112,41 +112,66 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     // Time slot selection
+    // Availability is fetched a month at a time and reused for every date
+    // picked in that month
+    const monthAvailability = new Map();
+
+    function fetchMonthAvailability(selectedDate) {
+        const [year, month] = selectedDate.split('-').map(Number);
+        const key = `${year}-${String(month).padStart(2, '0')}`;
+        if (!monthAvailability.has(key)) {
+            const lastDay = new Date(year, month, 0).getDate();
+            const request = fetch(`/api/available-slots?start=${key}-01&end=${key}-${lastDay}`)
+                .then(response => {
+                    if (!response.ok) throw new Error('Could not load time slots');
+                    return response.json();
+                })
+                .catch(error => {
+                    monthAvailability.delete(key);
+                    throw error;
+                });
+            monthAvailability.set(key, request);
+        }
+        return monthAvailability.get(key);
+    }
+
     function loadTimeSlots(selectedDate) {
         const timeSlotsContainer = document.getElementById('time-slots-container');
-        if (!timeSlotsContainer) return;
+        if (!timeSlotsContainer || !selectedDate) return;
 
         // Show loading
         timeSlotsContainer.innerHTML = '<div class="text-center"><i class="fas fa-spinner fa-spin"></i> Loading available times...</div>';
 
-        // Simulate API call (replace with actual endpoint)
-        setTimeout(() => {
-            const timeSlots = generateTimeSlots(selectedDate);
-            renderTimeSlots(timeSlots);
-        }, 500);
+        fetchMonthAvailability(selectedDate)
+            .then(availability => {
+                const free = new Set(availability[selectedDate] || []);
+                renderTimeSlots(generateTimeSlots(selectedDate).map(slot => ({
+                    ...slot,
+                    available: free.has(slot.time)
+                })));
+            })
+            .catch(() => {
+                timeSlotsContainer.innerHTML = '<p class="text-danger small">Could not load time slots. Please try again.</p>';
+            });
+    }
+
+    function formatSlot(time) {
+        const [hours, minutes] = time.split(':').map(Number);
+        const suffix = hours >= 12 ? 'PM' : 'AM';
+        return `${hours % 12 || 12}:${String(minutes).padStart(2, '0')} ${suffix}`;
     }
 
     function generateTimeSlots(date) {
-        const selectedDate = new Date(date);
-        const dayOfWeek = selectedDate.getDay();
+        const [year, month, day] = date.split('-').map(Number);
+        const dayOfWeek = new Date(year, month - 1, day).getDay();
 
         // Sunday (0) has different hours: 10:00 AM - 1:00 PM
         // Monday-Saturday (1-6): 5:00 PM - 8:00 PM
+        const slots = dayOfWeek === 0
+            ? ['10:00', '10:30', '11:00', '11:30', '12:00', '12:30', '13:00']
+            : ['17:00', '17:30', '18:00', '18:30', '19:00', '19:30', '20:00'];
 
-        let slots = [];
-        if (dayOfWeek === 0) {
-            // Sunday slots
-            slots = ['10:00 AM', '10:30 AM', '11:00 AM', '11:30 AM', '12:00 PM', '12:30 PM'];
-        } else {
-            // Weekday slots
-            slots = ['5:00 PM', '5:30 PM', '6:00 PM', '6:30 PM', '7:00 PM', '7:30 PM'];
-        }
-
-        // Mark some slots as unavailable (example logic)
-        return slots.map(slot => ({
-            time: slot,
-            available: Math.random() > 0.3 // Random availability for demo
-        }));
+        return slots.map(time => ({ time: time, label: formatSlot(time), available: false }));
     }
 
     function renderTimeSlots(slots) {
@@ -156,7 +181,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const slotsHtml = slots.map(slot => `
             <button type="button" class="time-slot ${!slot.available ? 'disabled' : ''}"
                     data-time="${slot.time}" ${!slot.available ? 'disabled' : ''}>
-                ${slot.time}
+                ${slot.label}
             </button>
         `).join('');
 
@@ -0,0 +1,51 @@
+// Patient typeahead for staff forms
+// Fills the datalist of any input with a data-patient-search URL from the
+// server-side search endpoint instead of shipping every patient in the page.
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('input[data-patient-search]').forEach(initPatientSearch);
+
+    function initPatientSearch(input) {
+        const endpoint = input.dataset.patientSearch;
+        const datalist = document.getElementById(input.getAttribute('list'));
+        let timer = null;
+        let controller = null;
+
+        if (!datalist) {
+            return;
+        }
+
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            const term = input.value.trim();
+            if (term.length < 2) {
+                datalist.innerHTML = '';
+                return;
+            }
+
+            // Debounce keystrokes and drop responses for stale terms
+            timer = setTimeout(function() {
+                if (controller) {
+                    controller.abort();
+                }
+                controller = new AbortController();
+
+                fetch(`${endpoint}?q=${encodeURIComponent(term)}`, { signal: controller.signal })
+                    .then(response => response.ok ? response.json() : [])
+                    .then(patients => {
+                        datalist.innerHTML = '';
+                        patients.forEach(patient => {
+                            const option = document.createElement('option');
+                            option.value = patient.full_name;
+                            option.label = patient.mobile_number;
+                            datalist.appendChild(option);
+                        });
+                    })
+                    .catch(error => {
+                        if (error.name !== 'AbortError') {
+                            console.error('Patient search failed:', error);
+                        }
+                    });
+            }, 200);
+        });
+    }
+});
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Concurrency stress check for slot reservations
+
+Starts many threads, each with its own database session and connection,
+that all try to book the same appointment slot at the same moment. Exits
+non-zero if more appointments hold the slot than its capacity allows or if
+the reservation ledger disagrees with the appointment table.
+
+Runs against DATABASE_URL and removes everything it creates. Use a
+PostgreSQL database to exercise row-level locking the way production does;
+on SQLite writers are serialised by the database lock instead.
+
+    python stress_slot_booking.py --workers 50
+"""
+
+import argparse
+import sys
+import threading
+from datetime import datetime, timedelta, time
+from sqlalchemy import func
+from app import app, db
+from models import Patient, Appointment, SlotReservation
+from slots import SLOT_CAPACITY, SlotUnavailable
+
+
+def book(slot_date, slot_time, patient_id, barrier, results):
+    """Try to book the slot once and record the outcome"""
+    with app.app_context():
+        barrier.wait()
+        try:
+            db.session.add(Appointment(
+                patient_id=patient_id,
+                appointment_date=slot_date,
+                appointment_time=slot_time,
+                primary_issue='Slot booking stress check',
+                status='scheduled'
+            ))
+            db.session.commit()
+            outcome = 'booked'
+        except SlotUnavailable:
+            db.session.rollback()
+            outcome = 'full'
+        except Exception as e:
+            db.session.rollback()
+            outcome = f'error: {type(e).__name__}'
+
+    with results['lock']:
+        results[outcome] = results.get(outcome, 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=30, help='concurrent booking attempts')
+    args = parser.parse_args()
+
+    # A weekday evening slot far enough ahead not to collide with real bookings
+    slot_date = datetime.now().date() + timedelta(days=3650)
+    while slot_date.weekday() == 6:
+        slot_date += timedelta(days=1)
+    slot_time = time(17, 0)
+
+    with app.app_context():
+        patient = Patient(full_name='Slot Stress Check', mobile_number='0000000000', age=1, is_registered=False)
+        db.session.add(patient)
+        db.session.commit()
+        patient_id = patient.id
+
+    barrier = threading.Barrier(args.workers)
+    results = {'lock': threading.Lock()}
+    threads = [
+        threading.Thread(target=book, args=(slot_date, slot_time, patient_id, barrier, results))
+        for _ in range(args.workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.pop('lock')
+
+    with app.app_context():
+        held = db.session.query(func.count(Appointment.id)).filter(
+            Appointment.appointment_date == slot_date,
+            Appointment.appointment_time == slot_time,
+            Appointment.status != 'cancelled'
+        ).scalar()
+        ledger = db.session.get(SlotReservation, (slot_date, slot_time))
+        capacity = ledger.capacity if ledger else SLOT_CAPACITY
+        booked = ledger.booked if ledger else 0
+
+        # Clean up through the ORM so the ledger and counters stay consistent
+        for appointment in Appointment.query.filter_by(patient_id=patient_id).all():
+            db.session.delete(appointment)
+        db.session.delete(db.session.get(Patient, patient_id))
+        db.session.commit()
+        SlotReservation.query.filter_by(slot_date=slot_date, slot_time=slot_time).delete()
+        db.session.commit()
+
+    print(f"{args.workers} concurrent bookings for {slot_date} {slot_time.strftime('%H:%M')} "
+          f"(capacity {capacity}):")
+    for outcome, count in sorted(results.items()):
+        print(f"    {outcome}: {count}")
+    print(f"    appointments holding the slot: {held}, ledger booked: {booked}")
+
+    if held > capacity:
+        print(f"\n❌ Slot overbooked by {held - capacity}")
+        return 1
+    if held != booked:
+        print("\n❌ Reservation ledger does not match the appointment table")
+        return 1
+
+    print("\n✅ No overbooking")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
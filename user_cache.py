@@ -0,0 +1,214 @@
+"""
+Logged-in user cache for the Flask-Login user loader
+
+Flask-Login calls load_user once per request (the result is kept on `g`
+for the rest of that request), which costs a primary-key SELECT on every
+page, AJAX call and slot lookup. This module keeps a snapshot of each
+logged-in user's columns in a per-process cache for USER_CACHE_TTL seconds.
+
+A cache hit returns a CachedUser: it answers `isinstance(current_user,
+Doctor)`, `current_user.id`, `current_user.full_name` and the like from the
+snapshot, and loads the real row into the session (hydrates) only when a
+route reads a relationship or anything else the snapshot does not hold, or
+assigns to an attribute. Password hashes are never cached.
+
+Entries are dropped when the user logs out, after profile edits
+(`patient_complete_profile`, `patient_edit_profile`) and after any commit
+that updates or deletes a Patient, Doctor, Assistant or Admin row. Each
+worker process has its own cache, so changes made in another worker are
+picked up when the entry expires. Set USER_CACHE_TTL=0 to disable caching.
+"""
+
+import os
+import threading
+import time
+from types import MethodType
+from flask_login import user_logged_out
+from sqlalchemy import event, inspect
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+from app import db
+from models import Patient, Doctor, Assistant, Admin
+
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+
+# Columns kept out of the snapshot
+UNCACHED_COLUMNS = ('password_hash',)
+
+# Prefix of the Flask-Login user id for each staff model; patients have none
+USER_ID_PREFIXES = {Doctor: 'doctor_', Assistant: 'assistant_', Admin: 'admin_'}
+
+# user id -> (loaded_at, model, {column: value})
+_user_cache = {}
+_cache_lock = threading.Lock()
+
+
+class _CacheStats:
+    """Hit and miss counts for this worker's user cache"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.hydrations = 0
+        self.invalidations = 0
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'hydrations': self.hydrations,
+                'invalidations': self.invalidations,
+            }
+
+
+cache_stats = _CacheStats()
+
+
+def user_cache_key(model, user_pk):
+    """The Flask-Login user id of a model row"""
+    return f'{USER_ID_PREFIXES.get(model, "")}{user_pk}'
+
+
+def _parse_user_id(user_id):
+    """(model, primary key) for a Flask-Login user id"""
+    for model, prefix in USER_ID_PREFIXES.items():
+        if user_id.startswith(prefix):
+            return model, int(user_id[len(prefix):])
+    return Patient, int(user_id)
+
+
+def _snapshot(user):
+    return {
+        prop.key: getattr(user, prop.key)
+        for prop in user.__mapper__.column_attrs
+        if not prop.deferred and prop.key not in UNCACHED_COLUMNS
+    }
+
+
+class CachedUser:
+    """A logged-in user's cached columns, loading the ORM row on demand"""
+
+    def __init__(self, model, values):
+        object.__setattr__(self, '_model', model)
+        object.__setattr__(self, '_values', values)
+        object.__setattr__(self, '_instance', None)
+
+    @property
+    def __class__(self):
+        # Lets isinstance() role checks treat the snapshot as the model
+        return self._model
+
+    def _hydrate(self):
+        """The user's row, loaded into the current session on first use"""
+        instance = self._instance
+        if instance is None:
+            instance = db.session.get(self._model, self._values['id'])
+            object.__setattr__(self, '_instance', instance)
+            cache_stats.count('hydrations')
+        return instance
+
+    def __getattr__(self, name):
+        if self._instance is not None:
+            return getattr(self._instance, name)
+        if name in self._values:
+            return self._values[name]
+
+        # Methods and properties such as get_id and is_authenticated run
+        # against the snapshot; columns it lacks and relationships need the row
+        attribute = getattr(self._model, name, None)
+        if isinstance(attribute, property):
+            return attribute.fget(self)
+        if callable(attribute) and not isinstance(attribute, InstrumentedAttribute):
+            return MethodType(attribute, self)
+        return getattr(self._hydrate(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._hydrate(), name, value)
+
+    def __repr__(self):
+        return f'<CachedUser {user_cache_key(self._model, self._values["id"])}>'
+
+
+def load_cached_user(user_id):
+    """The user for a Flask-Login user id, from the cache when fresh"""
+    try:
+        model, user_pk = _parse_user_id(user_id)
+    except ValueError:
+        return None
+
+    now = time.monotonic()
+    if USER_CACHE_TTL > 0:
+        with _cache_lock:
+            entry = _user_cache.get(user_id)
+        if entry is not None and now - entry[0] < USER_CACHE_TTL:
+            cache_stats.count('hits')
+            return CachedUser(entry[1], entry[2])
+
+    cache_stats.count('misses')
+    user = db.session.get(model, user_pk)
+    if user is not None and USER_CACHE_TTL > 0:
+        with _cache_lock:
+            _user_cache[user_id] = (now, model, _snapshot(user))
+    return user
+
+
+def invalidate_user(user_id):
+    """Drop a user's cached snapshot"""
+    with _cache_lock:
+        removed = _user_cache.pop(user_id, None)
+    if removed is not None:
+        cache_stats.count('invalidations')
+
+
+def clear_user_cache():
+    with _cache_lock:
+        _user_cache.clear()
+
+
+def user_cache_stats():
+    """Hit rate and size of this worker's user cache"""
+    stats = cache_stats.snapshot()
+    with _cache_lock:
+        stats['size'] = len(_user_cache)
+    stats.update({'pid': os.getpid(), 'ttl': USER_CACHE_TTL})
+    return stats
+
+
+# Users changed by the current transaction, dropped from the cache after commit
+def _changed_users(session):
+    return session.info.setdefault('users_changed', set())
+
+
+def _record_change(mapper, connection, target):
+    session = inspect(target).session
+    if session is not None:
+        _changed_users(session).add(user_cache_key(type(target), target.id))
+
+
+for _model in (Patient, Doctor, Assistant, Admin):
+    event.listen(_model, 'after_update', _record_change)
+    event.listen(_model, 'after_delete', _record_change)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_after_commit(session):
+    for user_id in session.info.pop('users_changed', ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_after_rollback(session, previous_transaction):
+    session.info.pop('users_changed', None)
+
+
+@user_logged_out.connect
+def _invalidate_on_logout(sender, user, **extra):
+    if user is not None and getattr(user, 'is_authenticated', False):
+        invalidate_user(user.get_id())